@@ -1,39 +1,285 @@
 import cv2
 import base64
+import os
 import socketio
 import threading
 import time
-import queue
+
+class LatestFrameBuffer:
+    """
+    Zwei-Slot-Puffer zwischen Capture- und Sende-Thread. Die Kamera schreibt
+    direkt in den Slot, der gerade nicht gelesen wird (cap.read mit Zielpuffer),
+    der Sender bekommt immer nur den neuesten fertigen Frame.
+    """
+    def __init__(self):
+        self.slots = [None, None]
+        self.captured_at = [None, None]  # Aufnahmezeitpunkt je Slot (time.time())
+        self.latest = None    # Index des neuesten fertigen Slots
+        self.reading = None   # Index des Slots, den der Sender gerade verwendet
+        self.seq = 0
+        self.dropped = 0      # Frames, die nie gelesen wurden
+        self.last_read_seq = 0
+        self.closed = False
+        self.condition = threading.Condition()
+    
+    def begin_write(self):
+        """Liefert (Index, Puffer) des Slots, in den die Kamera schreiben darf"""
+        with self.condition:
+            if self.reading is not None:
+                index = 1 - self.reading
+            else:
+                index = 1 if self.latest == 0 else 0
+            if self.latest == index:
+                self.latest = None  # Wird überschrieben, bis end_write nicht lesbar
+            return index, self.slots[index]
+    
+    def end_write(self, index, frame, ok):
+        with self.condition:
+            self.slots[index] = frame  # cap.read legt bei Größenänderung neu an
+            if ok:
+                self.captured_at[index] = time.time()
+                self.latest = index
+                self.seq += 1
+                self.condition.notify_all()
+    
+    def acquire(self, last_seq, timeout=None):
+        """Wartet auf einen Frame neuer als last_seq, gibt (Frame, seq, Aufnahmezeit) oder
+        (None, last_seq, None) nach timeout bzw. close() zurück"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or (self.seq > last_seq and self.latest is not None),
+                                    timeout)
+            if self.closed or self.seq <= last_seq or self.latest is None:
+                return None, last_seq, None
+            self.reading = self.latest
+            self.dropped += max(0, self.seq - self.last_read_seq - 1)
+            self.last_read_seq = self.seq
+            return self.slots[self.reading], self.seq, self.captured_at[self.reading]
+    
+    def release(self):
+        with self.condition:
+            self.reading = None
+    
+    def close(self):
+        """Weckt einen wartenden Sender zum Beenden"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class PipelineStats:
+    """Zählt Frames je Stufe (capture/encode/passthrough/send) und gibt periodisch FPS aus"""
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.totals = {}
+        self.window = {}
+        self.window_start = time.time()
+        self.lock = threading.Lock()
+        self.last_fps = {}
+    
+    def count(self, stage):
+        with self.lock:
+            self.totals[stage] = self.totals.get(stage, 0) + 1
+            self.window[stage] = self.window.get(stage, 0) + 1
+    
+    def report(self, dropped=0):
+        """Gibt alle interval Sekunden die FPS je Stufe aus"""
+        elapsed = time.time() - self.window_start
+        if elapsed < self.interval:
+            return
+        with self.lock:
+            self.last_fps = {stage: round(n / elapsed, 1) for stage, n in self.window.items()}
+            self.window = {}
+            self.window_start = time.time()
+        print(f"Pipeline: {self.last_fps} FPS, nicht gelesen: {dropped}")
+
+class MotionGate:
+    """
+    Vorfilter auf dem Pi: nur Frames mit Bewegung (Frame-Differenz) oder
+    Gesichtskandidat (optional Haar-Cascade) werden gesendet. Bei leerer Spur
+    geht nur alle keepalive_interval Sekunden ein Keep-Alive-Frame raus.
+    Beides läuft auf einer stark verkleinerten Graustufen-Kopie.
+    """
+    def __init__(self, use_face_cascade=False, analysis_width=160, pixel_threshold=25,
+                 motion_min_ratio=0.01, hold_time=2.0, keepalive_interval=5.0):
+        self.analysis_width = analysis_width
+        self.pixel_threshold = pixel_threshold      # Grauwert-Differenz ab der ein Pixel als bewegt gilt
+        self.motion_min_ratio = motion_min_ratio    # Anteil bewegter Pixel für "Bewegung"
+        self.hold_time = hold_time                  # Nachlauf nach letzter Aktivität (Person steht still)
+        self.keepalive_interval = keepalive_interval
+        
+        self.prev_gray = None
+        self.last_active = 0.0
+        self.last_sent = 0.0
+        self.stats = {'motion': 0, 'face': 0, 'hold': 0, 'keepalive': 0, 'gated': 0}
+        
+        self.cascade = None
+        if use_face_cascade:
+            cascade_file = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+            cascade = cv2.CascadeClassifier(cascade_file)
+            if cascade.empty():
+                print(f"Haar-Cascade nicht ladbar: {cascade_file} - nur Bewegungserkennung")
+            else:
+                self.cascade = cascade
+    
+    def check(self, frame):
+        """Gibt (senden, Grund) zurück - Grund: motion, face, hold, keepalive oder None"""
+        now = time.time()
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (self.analysis_width, int(height * self.analysis_width / width)),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        
+        reason = None
+        if self.prev_gray is not None and self.prev_gray.shape == gray.shape:
+            diff = cv2.absdiff(gray, self.prev_gray)
+            _, mask = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+            if cv2.countNonZero(mask) >= self.motion_min_ratio * mask.size:
+                reason = 'motion'
+        self.prev_gray = gray
+        
+        # Cascade nur wenn keine Bewegung erkannt wurde (stillstehende Person)
+        if reason is None and self.cascade is not None:
+            faces = self.cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(20, 20))
+            if len(faces) > 0:
+                reason = 'face'
+        
+        if reason:
+            self.last_active = now
+        elif now - self.last_active < self.hold_time:
+            reason = 'hold'
+        elif now - self.last_sent >= self.keepalive_interval:
+            reason = 'keepalive'
+        
+        if reason:
+            self.last_sent = now
+            self.stats[reason] += 1
+            return True, reason
+        
+        self.stats['gated'] += 1
+        return False, None
+
+class FaceRoiCropper:
+    """
+    Schneller Gesichtsdetektor auf dem Pi (Haar-Cascade auf verkleinertem Graubild).
+    Liefert einen gepolsterten Ausschnitt in voller Auflösung plus Offset und
+    Gesichtsboxen, damit der Server die HOG-Detektion überspringen kann.
+    """
+    def __init__(self, analysis_width=240, padding=0.4, max_area_ratio=0.6):
+        self.analysis_width = analysis_width
+        self.padding = padding                  # Rand um die Gesichter (Anteil der Boxgröße)
+        self.max_area_ratio = max_area_ratio    # Größere Ausschnitte -> ganzen Frame senden
+        
+        cascade_file = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.cascade = cv2.CascadeClassifier(cascade_file)
+        if self.cascade.empty():
+            print(f"Haar-Cascade nicht ladbar: {cascade_file} - ROI-Modus deaktiviert")
+            self.cascade = None
+    
+    def crop(self, frame):
+        """Gibt (Ausschnitt, roi) zurück oder (None, None) wenn der ganze Frame gesendet werden soll"""
+        if self.cascade is None:
+            return None, None
+        
+        height, width = frame.shape[:2]
+        scale = width / self.analysis_width
+        small = cv2.resize(frame, (self.analysis_width, int(height / scale)), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(20, 20))
+        if len(faces) == 0:
+            return None, None
+        
+        # Alle Gesichter in einem gemeinsamen Ausschnitt (Koordinaten in voller Auflösung)
+        boxes = [(int(x * scale), int(y * scale), int((x + w) * scale), int((y + h) * scale))
+                 for x, y, w, h in faces]
+        x0 = min(b[0] for b in boxes)
+        y0 = min(b[1] for b in boxes)
+        x1 = max(b[2] for b in boxes)
+        y1 = max(b[3] for b in boxes)
+        pad = int(self.padding * max(x1 - x0, y1 - y0))
+        left, top = max(0, x0 - pad), max(0, y0 - pad)
+        right, bottom = min(width, x1 + pad), min(height, y1 + pad)
+        
+        if (right - left) * (bottom - top) > self.max_area_ratio * width * height:
+            return None, None
+        
+        roi = {
+            'left': left,
+            'top': top,
+            'width': right - left,
+            'height': bottom - top,
+            'frame_width': width,
+            'frame_height': height,
+            # Gesichter relativ zum Ausschnitt im face_recognition-Format (top, right, bottom, left)
+            'faces': [[b[1] - top, b[2] - left, b[3] - top, b[0] - left] for b in boxes]
+        }
+        return frame[top:bottom, left:right], roi
 
 class OptimizedFaceStreamClient:
-    def __init__(self, server_url):
+    DEFAULT_STREAM_SETTINGS = {'target_fps': 7.5, 'width': 480, 'jpeg_quality': 50, 'roi_allowed': False}
+    
+    def __init__(self, server_url, gate=None, roi_cropper=None, mjpeg_passthrough=True, binary_frames=True):
         self.server_url = server_url
-        self.sio = socketio.Client()
+        self.gate = gate                # Optionaler MotionGate-Vorfilter
+        self.roi_cropper = roi_cropper  # Optional: nur Gesichtsausschnitt senden
+        # Reconnect übernimmt connect_to_server (eigenes Backoff, Threads laufen weiter)
+        self.sio = socketio.Client(reconnection=False)
         self.cap = cv2.VideoCapture(0)
         self.streaming = False
-        self.frame_queue = queue.Queue(maxsize=2)
+        self.connected = threading.Event()
+        self.stop_event = threading.Event()
+        self.threads = []
+        
+        # Verbindungsstatistik
+        self.started_at = time.time()
+        self.connected_at = None
+        self.disconnected_at = None
+        self.total_uptime = 0.0
+        self.reconnects = 0
+        self.reconnect_latencies = []
+        self.frame_buffer = LatestFrameBuffer()
+        self.stats = PipelineStats()
+        self.binary_frames = binary_frames
+        
+        # Sendevorgaben, werden per frame_ack vom Server nachgeregelt
+        self.CAMERA_FPS = 15
+        self.stream_settings = dict(self.DEFAULT_STREAM_SETTINGS)
         
         # Kamera optimiert für niedrige Latenz
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 480)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
         self.cap.set(cv2.CAP_PROP_FPS, 15)
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or 480
+        self.mjpeg_passthrough = self.enable_mjpeg_passthrough() if mjpeg_passthrough else False
         
         self.setup_events()
     
     def setup_events(self):
         @self.sio.event
         def connect():
-            print("Verbindung zur VM hergestellt")
-            self.streaming = True
-            # Capture und Send in separaten Threads
-            threading.Thread(target=self.capture_frames, daemon=True).start()
-            threading.Thread(target=self.send_frames, daemon=True).start()
+            now = time.time()
+            if self.disconnected_at is not None:
+                latency = now - self.disconnected_at
+                self.reconnects += 1
+                self.reconnect_latencies.append(latency)
+                print(f"Wieder mit der VM verbunden nach {latency:.2f}s ({self.reconnects}. Reconnect)")
+            else:
+                print("Verbindung zur VM hergestellt")
+            
+            # Vorgaben gelten pro Server (Gesichts- und Produktserver regeln unterschiedlich)
+            self.stream_settings = dict(self.DEFAULT_STREAM_SETTINGS)
+            self.connected_at = now
+            self.connected.set()
         
         @self.sio.event
         def disconnect():
-            print("Verbindung getrennt")
-            self.streaming = False
+            self.connected.clear()
+            now = time.time()
+            if self.connected_at is not None:
+                uptime = now - self.connected_at
+                self.total_uptime += uptime
+                print(f"Verbindung getrennt nach {uptime:.0f}s - Kamera läuft weiter")
+            self.connected_at = None
+            self.disconnected_at = now
         
         @self.sio.event
         def connect_error(data):
@@ -45,78 +291,235 @@ class OptimizedFaceStreamClient:
                 name = data.get('user_name', 'Unbekannt')
                 confidence = data.get('confidence', 0)
                 print(f"{name} ({confidence:.1%})")
+        
+        @self.sio.event
+        def frame_ack(data):
+            # Back-Pressure vom Server: nur bekannte Felder übernehmen
+            settings = dict(self.stream_settings)
+            for key in settings:
+                if data.get(key) is not None:
+                    settings[key] = data[key]
+            
+            if settings != self.stream_settings:
+                print(f"Server-Vorgabe: {settings['target_fps']} FPS, {settings['width']}px, "
+                      f"Qualität {settings['jpeg_quality']} (Server: {data.get('processing_fps', 0)} FPS)")
+            self.stream_settings = settings
+
+        @self.sio.event
+        def redirect(data):
+            # Hot-Standby auf der VM: der inaktive Dienst verweist auf den aktiven
+            url = data.get('url')
+            if not url or url == self.server_url:
+                return
+            print(f"Server-Wechsel: {self.server_url} -> {url}")
+            self.server_url = url
+            # Neuer Client für den Zielserver - der alte trennt im Hintergrund
+            # (beim Polling-Transport wartet disconnect() bis zum Ende des laufenden Requests)
+            old_sio = self.sio
+            self.sio = socketio.Client(reconnection=False)
+            self.setup_events()
+            threading.Thread(target=old_sio.disconnect, daemon=True).start()
+
+    def enable_mjpeg_passthrough(self):
+        """
+        Versucht den MJPEG-Stream der Kamera (V4L2) direkt zu übernehmen:
+        cap.read() liefert dann die fertigen JPEG-Bytes, die ohne Re-Encoding
+        gesendet werden können. Fällt auf BGR-Frames zurück wenn Kamera oder
+        Backend das nicht unterstützen.
+        """
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        
+        ret, frame = self.cap.read()
+        if ret and frame is not None and (frame.ndim == 1 or frame.shape[0] == 1):
+            print("MJPEG-Passthrough aktiv (Kamera liefert JPEG)")
+            return True
+        
+        self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        print("MJPEG-Passthrough nicht verfügbar - Frames werden selbst codiert")
+        return False
     
     def capture_frames(self):
-        """Kontinuierliches Frame-Capturing"""
+        """Kontinuierliches Frame-Capturing direkt in den freien Slot (Takt gibt die Kamera vor)"""
         print("Frame-Capture gestartet")
         while self.streaming:
-            ret, frame = self.cap.read()
-            if ret:
-                # Queue leeren wenn voll (nur neueste Frames)
-                while not self.frame_queue.empty():
-                    try:
-                        self.frame_queue.get_nowait()
-                    except queue.Empty:
-                        break
-                
-                try:
-                    self.frame_queue.put_nowait(frame)
-                except queue.Full:
-                    pass
+            index, buffer = self.frame_buffer.begin_write()
+            ret, frame = self.cap.read(buffer)
+            self.frame_buffer.end_write(index, frame, ret)
             
-            time.sleep(0.033)  # ~30 FPS Capture
+            if ret:
+                self.stats.count('capture')
+            else:
+                time.sleep(0.01)  # Kamera-Aussetzer, nicht im Leerlauf drehen
+    
+    def decode_passthrough(self, jpeg, reduced=False):
+        """JPEG der Kamera decodieren (reduced: halbe Größe, reicht für den Vorfilter)"""
+        flags = cv2.IMREAD_REDUCED_COLOR_2 if reduced else cv2.IMREAD_COLOR
+        return cv2.imdecode(jpeg.reshape(-1), flags)
     
     def send_frames(self):
-        """Frame-Versendung mit Kompression"""
+        """Frame-Versendung: neuester Frame aus dem Puffer, JPEG nur wenn nötig neu codieren"""
         print("Frame-Versendung gestartet")
         frame_skip = 0
+        last_seq = 0
         
         while self.streaming:
+            # Ohne Verbindung schlafen (kein Timeout) - nach dem Reconnect geht sofort der
+            # neueste Frame raus, cleanup() weckt über dasselbe Event zum Beenden
+            self.connected.wait()
+            if not self.streaming:
+                break
+            
+            # Blockiert bis die Kamera einen neuen Frame liefert (kein Polling)
+            frame, seq, captured_at = self.frame_buffer.acquire(last_seq)
+            if frame is None:
+                continue
+            last_seq = seq
+            
             try:
-                frame = self.frame_queue.get(timeout=0.1)
+                settings = self.stream_settings
                 
-                # Nur jeden 2. Frame senden
+                # Nur so viele Frames senden wie der Server verarbeiten kann
+                # (Standard: jeden 2. Frame bei 15 FPS)
+                send_every = max(1, round(self.CAMERA_FPS / settings['target_fps']))
                 frame_skip += 1
-                if frame_skip % 2 != 0:
+                if frame_skip % send_every != 0:
                     continue
                 
-                # Kompression
-                encode_params = [
-                    cv2.IMWRITE_JPEG_QUALITY, 50,
-                    cv2.IMWRITE_JPEG_OPTIMIZE, 1
-                ]
+                jpeg = frame.reshape(-1) if self.mjpeg_passthrough else None
+                image = None if self.mjpeg_passthrough else frame
+                
+                # Leere Spur nicht hochladen (nur Keep-Alive)
+                if self.gate:
+                    gate_image = image if image is not None else self.decode_passthrough(jpeg, reduced=True)
+                    if not self.gate.check(gate_image)[0]:
+                        continue
                 
-                ret, buffer = cv2.imencode('.jpg', frame, encode_params)
-                if ret:
-                    frame_b64 = base64.b64encode(buffer).decode('utf-8')
-                    self.sio.emit('video_frame', {'image': frame_b64})
+                # ROI-Modus (nur wenn der Server ihn erlaubt): Gesichtsausschnitt in voller Auflösung
+                roi = None
+                if self.roi_cropper and settings['roi_allowed']:
+                    if image is None:
+                        image = self.decode_passthrough(jpeg)
+                    crop, roi = self.roi_cropper.crop(image)
+                    if roi:
+                        image = crop
                 
-            except queue.Empty:
+                # Kamera-JPEG direkt senden wenn weder Ausschnitt, Verkleinerung
+                # noch niedrigere Qualität verlangt ist
+                passthrough = (jpeg is not None and roi is None and
+                               settings['width'] >= self.frame_width and
+                               settings['jpeg_quality'] >= self.DEFAULT_STREAM_SETTINGS['jpeg_quality'])
+                
+                if passthrough:
+                    payload_bytes = jpeg.tobytes()
+                    self.stats.count('passthrough')
+                else:
+                    if image is None:
+                        image = self.decode_passthrough(jpeg)
+                    
+                    # Auflösung nach Server-Vorgabe reduzieren (vor dem Codieren)
+                    height, width = image.shape[:2]
+                    if roi is None and width > settings['width']:
+                        image = cv2.resize(image, (settings['width'], int(height * settings['width'] / width)),
+                                           interpolation=cv2.INTER_AREA)
+                    
+                    # Kompression (ohne JPEG_OPTIMIZE - kostet auf dem Pi 4 viel CPU für wenige Bytes)
+                    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(settings['jpeg_quality'])])
+                    if not ret:
+                        continue
+                    payload_bytes = buffer.tobytes()
+                    self.stats.count('encode')
+            except Exception as e:
+                print(f"Verarbeitungsfehler: {e}")
                 continue
+            finally:
+                # Slot erst nach dem Codieren freigeben (Ausschnitte sind Views in den Slot)
+                self.frame_buffer.release()
+            
+            try:
+                # Binär senden spart Base64 (+33% Bytes) auf dem Pi und im Uplink
+                image_payload = payload_bytes if self.binary_frames else base64.b64encode(payload_bytes).decode('utf-8')
+                # Aufnahmezeitpunkt: der Server verwirft Frames, die bis zur Erkennung zu alt sind
+                payload = {'image': image_payload, 'captured_at': captured_at}
+                if roi:
+                    payload['roi'] = roi
+                self.sio.emit('video_frame', payload)
+                self.stats.count('send')
             except Exception as e:
                 print(f"Send-Fehler: {e}")
                 if not self.streaming:
                     break
-    
-    def connect_to_server(self):
-        try:
-            print("Verbinde mit Server...")
-            # Timeout-Parameter entfernt für Kompatibilität
-            self.sio.connect(self.server_url)
             
-            # Warte auf Verbindung oder Fehler
-            print("Warte auf Verbindung...")
-            self.sio.wait()
+            self.stats.report(self.frame_buffer.dropped)
+    
+    def start_pipeline(self):
+        """Startet Capture- und Sende-Thread einmalig - sie überdauern Reconnects"""
+        if self.streaming:
+            return
+        self.streaming = True
+        self.threads = [threading.Thread(target=self.capture_frames, daemon=True),
+                        threading.Thread(target=self.send_frames, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+    
+    def connect_to_server(self, base_backoff=0.25, max_backoff=2.0):
+        """
+        Verbindet mit dem Server und nach jedem Abbruch automatisch neu
+        (exponentielles Backoff, nach erfolgreicher Verbindung zurückgesetzt).
+        Kamera und Threads bleiben dabei aktiv.
+        """
+        self.start_pipeline()
+        backoff = base_backoff
+        
+        while not self.stop_event.is_set():
+            try:
+                print(f"Verbinde mit Server {self.server_url}...")
+                # Timeout-Parameter entfernt für Kompatibilität
+                self.sio.connect(self.server_url)
+                backoff = base_backoff
+                
+                # Kehrt zurück sobald die Verbindung abbricht
+                self.sio.wait()
+                continue
+            except socketio.exceptions.ConnectionError as e:
+                print(f"Socket.IO Verbindungsfehler: {e}")
+            except Exception as e:
+                print(f"Allgemeiner Verbindungsfehler: {e}")
             
-        except socketio.exceptions.ConnectionError as e:
-            print(f"Socket.IO Verbindungsfehler: {e}")
-        except Exception as e:
-            print(f"Allgemeiner Verbindungsfehler: {e}")
+            print(f"Neuer Verbindungsversuch in {backoff:.2f}s")
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, max_backoff)
+    
+    def connection_summary(self):
+        """Verbindungs-Uptime und Reconnect-Latenzen"""
+        now = time.time()
+        current = now - self.connected_at if self.connected_at else 0.0
+        runtime = now - self.started_at
+        return {
+            'connected': self.connected_at is not None,  # Event wird von cleanup() gesetzt
+            'uptime_s': round(current, 1),
+            'total_uptime_s': round(self.total_uptime + current, 1),
+            'availability': round((self.total_uptime + current) / runtime, 3) if runtime else 0.0,
+            'reconnects': self.reconnects,
+            'last_reconnect_latency_s': round(self.reconnect_latencies[-1], 2) if self.reconnect_latencies else None,
+            'max_reconnect_latency_s': round(max(self.reconnect_latencies), 2) if self.reconnect_latencies else None
+        }
     
     def cleanup(self):
         print("Aufräumen...")
+        self.stop_event.set()
         self.streaming = False
-        time.sleep(0.5)
+        self.connected.set()  # Sender aufwecken, falls er auf eine Verbindung wartet
+        self.frame_buffer.close()
+        # Capture endet mit dem nächsten Kamera-Frame, der Sender sofort
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        
+        print(f"Verbindung: {self.connection_summary()}")
+        
+        if self.gate:
+            print(f"Vorfilter: {self.gate.stats}")
+        print(f"Pipeline gesamt: {self.stats.totals}, nicht gelesen: {self.frame_buffer.dropped}")
         
         if self.cap and self.cap.isOpened():
             self.cap.release()
@@ -128,6 +531,11 @@ class OptimizedFaceStreamClient:
 
 if __name__ == "__main__":
     SERVER_URL = "http://141.72.12.186:5000"
+    MOTION_GATE = True     # Nur Frames mit Bewegung/Gesicht senden, sonst Keep-Alive
+    FACE_CASCADE = False   # Zusätzlich Haar-Cascade für stillstehende Personen (mehr Pi-CPU)
+    ROI_MODE = False       # Nur gepolsterten Gesichtsausschnitt in voller Auflösung senden
+    MJPEG_PASSTHROUGH = True  # Kamera-JPEG (V4L2 MJPG) ohne Re-Encoding senden wenn möglich
+    BINARY_FRAMES = True      # JPEG als Binärdaten statt Base64 senden
     
     print("Starte Video-Stream... (Strg+C zum Beenden)")
     print(f"Server: {SERVER_URL}")
@@ -140,7 +548,10 @@ if __name__ == "__main__":
     test_cap.release()
     print("Kamera OK")
     
-    client = OptimizedFaceStreamClient(SERVER_URL)
+    gate = MotionGate(use_face_cascade=FACE_CASCADE) if MOTION_GATE else None
+    roi_cropper = FaceRoiCropper() if ROI_MODE else None
+    client = OptimizedFaceStreamClient(SERVER_URL, gate=gate, roi_cropper=roi_cropper,
+                                       mjpeg_passthrough=MJPEG_PASSTHROUGH, binary_frames=BINARY_FRAMES)
     try:
         client.connect_to_server()
     except KeyboardInterrupt:
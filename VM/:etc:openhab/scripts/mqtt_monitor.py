@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 """
 MQTT Monitor für Face/Product Recognition
-Überwacht MQTT Topics und startet entsprechende Scripts
+Überwacht MQTT Topics und schaltet zwischen den Diensten um
+
+Hot-Standby: Gesichts- und Produkterkennung laufen dauerhaft (Modelle geladen,
+Ports gebunden). Ein Trigger schaltet nur den aktiven Dienst per
+POST /control/active um; der inaktive Dienst leitet den Pi zum aktiven weiter.
+Neu gestartet wird ein Dienst nur, wenn er abgestürzt ist.
+
+Kombinierter Betrieb (FAY_COMBINED=1): nur combined_server.py läuft, beide
+Erkennungen in einem Prozess. Ein Trigger schaltet dort per POST /control/mode
+die aktiven Erkennungsstufen um.
 """
 import paho.mqtt.client as mqtt
+import json
+import os
 import subprocess
+import threading
 import time
 import logging
 import signal
 import sys
+import urllib.error
+import urllib.request
 
 # Logging Setup
 logging.basicConfig(
@@ -29,18 +43,48 @@ TOPICS = {
     "fay_node/product/selection": "product_recognition"
 }
 
-# Script Pfade
-SCRIPTS = {
-    "face_recognition": "/etc/openhab/scripts/face_recognition.py",
-    "product_recognition": "/etc/openhab/scripts/product_recognition.py"
+# Dienste (dauerhaft gestartet, jeweils eigener Port)
+SERVICES = {
+    "face_recognition": {
+        "script": "/home/ubuntu/Documents/stream_server.py",
+        "cwd": "/home/ubuntu/Documents",
+        "port": 5000,
+        "log": "/home/ubuntu/Documents/stream_server.log"
+    },
+    "product_recognition": {
+        "script": "/home/ubuntu/Documents/product_recog/product_recog.py",
+        "cwd": "/home/ubuntu/Documents/product_recog",
+        "port": 5001,
+        "log": "/home/ubuntu/Documents/product_recog.log"
+    }
 }
 
+COMBINED = os.environ.get("FAY_COMBINED") == "1"
+if COMBINED:
+    SERVICES = {
+        "combined": {
+            "script": "/home/ubuntu/Documents/combined_server.py",
+            "cwd": "/home/ubuntu/Documents",
+            "port": 5000,
+            "log": "/home/ubuntu/Documents/combined_server.log"
+        }
+    }
+
 PYTHON_PATH = "/home/ubuntu/Documents/face_recognition_env/bin/python3"
+PUBLIC_HOST = MQTT_BROKER  # Adresse unter der der Pi die Dienste erreicht
+STARTUP_TIMEOUT = 90       # Sekunden bis ein Dienst nach dem Start /health beantwortet (Modelle laden)
+WATCHDOG_INTERVAL = 5      # Sekunden zwischen Health-Checks
 
 # Globale MQTT Client Variable
 mqtt_client_global = None
 
-def reset_mqtt_topics():
+# Supervisor-Zustand
+processes = {}           # script_type -> Popen
+active_service = None    # Aktuell aktiver Dienst (None = beide im Standby)
+switch_lock = threading.Lock()
+shutdown_event = threading.Event()
+
+def reset_mqtt_topics(wait=True):
     """Setzt alle MQTT Topics zurück (leert sie)"""
     try:
         if mqtt_client_global and mqtt_client_global.is_connected():
@@ -59,80 +103,181 @@ def reset_mqtt_topics():
                 mqtt_client_global.publish(topic, "", retain=True)
                 logger.info(f"Reset Topic: {topic}")
             
-            # Kurz warten damit Messages gesendet werden
-            time.sleep(0.5)
+            # Beim Beenden kurz warten damit Messages gesendet werden
+            # (beim Umschalten sendet der Netzwerk-Loop sie nach dem Callback)
+            if wait:
+                time.sleep(0.5)
             logger.info("Alle MQTT Topics zurückgesetzt")
             
     except Exception as e:
         logger.error(f"Fehler beim MQTT Reset: {e}")
 
-def stop_all_scripts():
-    """Stoppt alle laufenden Recognition Scripts UND setzt MQTT Topics zurück"""
+def service_url(script_type, host="127.0.0.1"):
+    return f"http://{host}:{SERVICES[script_type]['port']}"
+
+def http_json(url, payload=None, timeout=1.0):
+    """GET (bzw. POST mit JSON-Body) an einen Dienst, gibt die JSON-Antwort oder None zurück"""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
     try:
-        logger.info("=== ALLE SCRIPTS STOPPEN + MQTT RESET ===")
-        
-        # 1. MQTT Topics zurücksetzen
-        reset_mqtt_topics()
-        
-        # 2. Prozesse mit SUDO stoppen (für root-Prozesse)
-        subprocess.run(["sudo", "pkill", "-f", "stream_server.py"], check=False)
-        subprocess.run(["sudo", "pkill", "-f", "product_recog.py"], check=False)
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read().decode() or "{}")
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+def is_healthy(script_type):
+    """Dienst beantwortet /health"""
+    health = http_json(f"{service_url(script_type)}/health")
+    return bool(health and health.get("status") == "running")
+
+def wait_until_healthy(script_type, timeout=STARTUP_TIMEOUT):
+    """Wartet per Health-Check statt fester Pausen bis der Dienst bereit ist"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and not shutdown_event.is_set():
+        if is_healthy(script_type):
+            return True
+        process = processes.get(script_type)
+        if process and process.poll() is not None:
+            logger.error(f"{script_type} beim Start beendet (Exit-Code {process.returncode})")
+            return False
+        shutdown_event.wait(0.2)
+    return False
+
+def stop_stray_scripts():
+    """Beendet Dienste, die nicht von diesem Monitor gestartet wurden (z.B. alte OpenHAB-Starts)"""
+    for service in SERVICES.values():
+        script_name = service["script"].rsplit("/", 1)[-1]
+        subprocess.run(["sudo", "pkill", "-f", script_name], check=False)
+
+def start_service(script_type):
+    """Startet einen Dienst im Standby (ohne auf /health zu warten)"""
+    service = SERVICES[script_type]
+    logger.info(f"Starte {script_type}: {service['script']} (Port {service['port']}, Standby)")
+    
+    # sudo verwirft die Umgebung - Port und Standby-Flag über env übergeben
+    # (der kombinierte Dienst ist immer aktiv, dort wird nur der Modus umgeschaltet)
+    log_file = open(service["log"], "a")
+    processes[script_type] = subprocess.Popen([
+        "sudo", "env", f"FAY_PORT={service['port']}", f"FAY_START_ACTIVE={1 if COMBINED else 0}",
+        PYTHON_PATH, service["script"]
+    ], cwd=service["cwd"], stdout=log_file, stderr=subprocess.STDOUT)
+    log_file.close()
+
+def ensure_services():
+    """Startet alle Dienste einmal parallel und wartet bis sie gesund sind"""
+    for script_type in SERVICES:
+        if not is_healthy(script_type):
+            start_service(script_type)
+    
+    for script_type in SERVICES:
+        started = time.time()
+        if wait_until_healthy(script_type):
+            logger.info(f"{script_type} bereit nach {time.time() - started:.1f}s")
+        else:
+            logger.error(f"{script_type} nicht bereit nach {STARTUP_TIMEOUT}s")
+
+def set_service_active(script_type, active, redirect_url=None):
+    """Schaltet einen laufenden Dienst aktiv bzw. in den Standby"""
+    result = http_json(f"{service_url(script_type)}/control/active",
+                       {"active": active, "redirect_url": redirect_url})
+    if result is None:
+        logger.error(f"{script_type}: Umschalten auf {'aktiv' if active else 'Standby'} fehlgeschlagen")
+        return False
+    return True
+
+def apply_mode():
+    """Kombinierter Betrieb: aktive Erkennungsstufen auf den aktuellen Modus setzen"""
+    if active_service is None:
+        return True  # Noch kein Trigger - Startmodus von combined_server.py bleibt
+    result = http_json(f"{service_url('combined')}/control/mode", {"mode": active_service})
+    if result is None:
+        logger.error(f"combined: Umschalten auf {active_service} fehlgeschlagen")
+        return False
+    return True
+
+def apply_active_state(script_type):
+    """Setzt den Soll-Zustand (aktiv/Standby mit Weiterleitung) für einen Dienst"""
+    if COMBINED:
+        return apply_mode()
+    if script_type == active_service:
+        return set_service_active(script_type, True)
+    redirect_url = service_url(active_service, PUBLIC_HOST) if active_service else None
+    return set_service_active(script_type, False, redirect_url)
+
+def switch_service(script_type):
+    """Aktiviert einen Dienst, alle anderen gehen in den Standby und leiten den Pi weiter"""
+    global active_service
+    with switch_lock:
+        started = time.perf_counter()
+        service = "combined" if COMBINED else script_type
         
-        # 3. Falls das nicht reicht: SIGKILL verwenden
-        time.sleep(2)
-        subprocess.run(["sudo", "pkill", "-9", "-f", "stream_server.py"], check=False)
-        subprocess.run(["sudo", "pkill", "-9", "-f", "product_recog.py"], check=False)
+        # Nur ein abgestürzter Dienst wird neu gestartet, ein noch ladender nur abgewartet
+        if not is_healthy(service):
+            process = processes.get(service)
+            if process is None or process.poll() is not None:
+                logger.warning(f"{service} nicht erreichbar - Neustart")
+                start_service(service)
+            if not wait_until_healthy(service):
+                logger.error(f"{service} konnte nicht gestartet werden")
+                return False
         
-        logger.info("Alle Scripts gestoppt")
+        reset_mqtt_topics(wait=False)
+        active_service = script_type
         
-        # 4. Länger warten bis Ports frei sind
-        time.sleep(5)
+        if COMBINED:
+            # Ein Prozess - nur die aktiven Erkennungsstufen wechseln
+            if not apply_mode():
+                return False
+        else:
+            # Erst die anderen in den Standby (Weiterleitung), dann den Ziel-Dienst aktivieren
+            for other in SERVICES:
+                if other != script_type:
+                    apply_active_state(other)
+            if not apply_active_state(script_type):
+                return False
         
-    except Exception as e:
-        logger.error(f"Fehler beim Stoppen: {e}")
+        logger.info(f"{script_type} aktiv nach {(time.perf_counter() - started) * 1000:.0f} ms")
+        send_status_update(script_type, "RUNNING")
+        return True
 
-def start_script(script_type):
-    """Startet ein bestimmtes Script"""
+def watchdog_loop():
+    """Startet abgestürzte Dienste neu und stellt ihren Aktiv/Standby-Zustand wieder her"""
+    while not shutdown_event.wait(WATCHDOG_INTERVAL):
+        for script_type in SERVICES:
+            process = processes.get(script_type)
+            if process is None or process.poll() is None:
+                continue
+            
+            logger.warning(f"{script_type} abgestürzt (Exit-Code {process.returncode}) - Neustart")
+            with switch_lock:
+                start_service(script_type)
+                if wait_until_healthy(script_type):
+                    apply_active_state(script_type)
+
+def stop_all_scripts():
+    """Stoppt alle Dienste dieses Monitors"""
     try:
-        if script_type not in SCRIPTS:
-            logger.error(f"Unbekannter Script-Typ: {script_type}")
-            return False
-        
-        script_path = SCRIPTS[script_type]
-        logger.info(f"Starte {script_type}: {script_path}")
+        logger.info("=== ALLE DIENSTE STOPPEN ===")
+        shutdown_event.set()
         
-        # Script als Hintergrundprozess starten
-        process = subprocess.Popen([
-            "sudo", PYTHON_PATH, script_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for script_type, process in processes.items():
+            if process.poll() is None:
+                process.terminate()
+        for script_type, process in processes.items():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
         
-        time.sleep(3)  # Kurz warten
+        # Falls sudo das Signal nicht weitergereicht hat
+        stop_stray_scripts()
+        logger.info("Alle Dienste gestoppt")
         
-        # Prüfen ob Prozess läuft
-        if script_type == "face_recognition":
-            check_cmd = ["pgrep", "-f", "stream_server.py"]
-        else:
-            check_cmd = ["pgrep", "-f", "product_recog.py"]
-        
-        result = subprocess.run(check_cmd, capture_output=True)
-        if result.returncode == 0:
-            pid = result.stdout.decode().strip()
-            logger.info(f"{script_type} erfolgreich gestartet (PID: {pid})")
-            
-            # Nach erfolgreichem Start: Status-Update senden
-            send_status_update(script_type, "RUNNING")
-            
-            return True
-        else:
-            logger.error(f"{script_type} konnte nicht gestartet werden")
-            return False
-            
     except Exception as e:
-        logger.error(f"Fehler beim Starten von {script_type}: {e}")
-        return False
+        logger.error(f"Fehler beim Stoppen: {e}")
 
 def send_status_update(script_type, status):
-    """Sendet Status-Update nach erfolgreichem Script-Start"""
+    """Sendet Status-Update nach erfolgreichem Umschalten"""
     try:
         if mqtt_client_global and mqtt_client_global.is_connected():
             if script_type == "face_recognition":
@@ -182,13 +327,11 @@ def on_message(client, userdata, msg):
         
         if topic == "fay_node/payment/method" and message == "FACE_RECOGNITION":
             logger.info("=== FACE RECOGNITION TRIGGER ===")
-            stop_all_scripts()  # Inkludiert MQTT Reset
-            start_script("face_recognition")
+            switch_service("face_recognition")  # Inkludiert MQTT Reset
             
         elif topic == "fay_node/product/selection" and message == "PRODUCT_RECOGNITION":
             logger.info("=== PRODUCT RECOGNITION TRIGGER ===")
-            stop_all_scripts()  # Inkludiert MQTT Reset
-            start_script("product_recognition")
+            switch_service("product_recognition")  # Inkludiert MQTT Reset
         
         else:
             logger.info(f"Ignoriere: {topic} = {message}")
@@ -218,6 +361,11 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    # Beide Dienste einmal starten und warm halten
+    stop_stray_scripts()
+    ensure_services()
+    threading.Thread(target=watchdog_loop, daemon=True).start()
+    
     # MQTT Client Setup
     client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
     client.on_connect = on_connect
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Async-Betrieb für stream_server.py (ASGI unter uvicorn)
+
+Statt Flask-SocketIO unter dem Werkzeug-Dev-Server:
+- Socket.IO über python-socketio AsyncServer, Events sind Coroutinen
+- Event-Handler mit blockierendem I/O (SQLite, Stripe, Produktdatei) laufen in
+  einem begrenzten Thread-Pool, video_frame und Viewer-Events direkt im Loop
+- HTTP-Routen der Flask-App über asgiref WsgiToAsgi in einem eigenen,
+  begrenzten Thread-Pool
+- /video_stream und /video_feed nativ asynchron (ein Task pro Viewer statt Thread)
+- Erkennungsergebnisse und alle anderen Broadcasts aus den Worker-Threads gehen
+  über eine asyncio.Queue an den AsyncServer (broadcast/reply in stream_server)
+
+Die Erkennung selbst (background_processor) bleibt ein Thread - sie ist CPU-gebunden.
+
+Aufruf (im Verzeichnis von stream_server.py):
+    python async_server.py
+    uvicorn async_server:app --host 0.0.0.0 --port 5000
+
+Umgebungsvariablen: FAY_PORT, FAY_HTTP_WORKERS (16), FAY_IO_WORKERS (8)
+Als Worker von cluster_server.py zusätzlich FAY_WORKER_ID und FAY_MESSAGE_QUEUE
+(Socket.IO-Fan-out und gemeinsamer Zustand über MQTT).
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import stream_server as server
+
+HTTP_WORKERS = int(os.environ.get('FAY_HTTP_WORKERS', 16))
+IO_WORKERS = int(os.environ.get('FAY_IO_WORKERS', 8))
+
+# Handler ohne blockierendes I/O laufen direkt im Event-Loop
+INLINE_EVENTS = {'connect', 'video_frame', 'start_video_stream', 'stop_video_stream'}
+
+SOCKET_EVENTS = {
+    'video_frame': server.handle_video_frame,
+    'start_video_stream': server.handle_start_video_stream,
+    'stop_video_stream': server.handle_stop_video_stream,
+    'confirm_payment': server.handle_payment_confirmation,
+    'pay_for_products': server.handle_pay_for_products_socket,
+    'cart_sync': server.handle_cart_sync,
+    'request_product_status': server.handle_request_product_status,
+    'clear_products': server.handle_clear_products_socket
+}
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi mit eigenem begrenzten Thread-Pool statt asgirefs Single-Thread-Executor"""
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # Ungewrappte Originalmethode (in asgiref per @sync_to_async dekoriert) -
+        # interne Struktur, daher asgiref-Version in vm_requirements.txt begrenzt
+        run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+class AsyncBridge:
+    """
+    Verbindet die Thread-Welt von stream_server mit dem asyncio-Loop:
+    broadcast()/reply() aus beliebigen Threads landen in einer asyncio.Queue,
+    die ein Task an den AsyncServer ausliefert.
+    """
+    def __init__(self, sio):
+        self.sio = sio
+        self.loop = None
+        self.queue = None
+        self.frame_notify = None
+        self.io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='fay-io')
+        self.http_executor = ThreadPoolExecutor(max_workers=HTTP_WORKERS, thread_name_prefix='fay-http')
+        self.render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fay-render')
+        self.stats = {'emitted': 0, 'max_queue_depth': 0, 'emit_errors': 0}
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.frame_notify = asyncio.Condition()
+        server.broadcast_hook = self.enqueue
+        server.frame_hook = self.notify_frame_threadsafe
+        self.loop.create_task(self.pump())
+
+        # Modelle laden und Hintergrund-Threads starten, ohne den Loop zu blockieren
+        await self.loop.run_in_executor(self.io_executor, server.init_server)
+        print(f"⚡ Async-Modus: HTTP-Pool {HTTP_WORKERS}, I/O-Pool {IO_WORKERS} Threads")
+
+    def stop(self):
+        server.stop_processing()
+        server.broadcast_hook = None
+        server.frame_hook = None
+        if server.cluster_bus:
+            server.cluster_bus.close()
+        for executor in (self.io_executor, self.http_executor, self.render_executor):
+            executor.shutdown(wait=False)
+
+    def enqueue(self, event, data=None, to=None, local=False):
+        """broadcast_hook von stream_server - thread-sicher, auch aus dem Loop selbst"""
+        # Antworten an eine sid bleiben immer in diesem Worker
+        item = (event, data, to, local or to is not None)
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.queue.put_nowait(item)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def pump(self):
+        while True:
+            event, data, to, local = await self.queue.get()
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize() + 1)
+            try:
+                await self.sio.emit(event, data, to=to, ignore_queue=local)
+                self.stats['emitted'] += 1
+            except Exception as e:
+                self.stats['emit_errors'] += 1
+                print(f"Async-Emit Fehler ({event}): {e}")
+
+    @staticmethod
+    def call_with_reply(sid, handler, *args):
+        """Führt einen stream_server-Handler aus, reply() geht an sid"""
+        server.reply_target.sid = sid
+        try:
+            handler(*args)
+        finally:
+            server.reply_target.sid = None
+
+    def make_handler(self, event, handler):
+        inline = event in INLINE_EVENTS
+
+        async def on_event(sid, *args):
+            if inline:
+                self.call_with_reply(sid, handler, *args)
+                if event == 'video_frame':
+                    await self.notify_frame()
+            else:
+                await self.loop.run_in_executor(self.io_executor, self.call_with_reply, sid, handler, *args)
+        return on_event
+
+    async def notify_frame(self):
+        async with self.frame_notify:
+            self.frame_notify.notify_all()
+
+    def notify_frame_threadsafe(self):
+        """Frame eines anderen Workers (kommt im paho-Thread an)"""
+        asyncio.run_coroutine_threadsafe(self.notify_frame(), self.loop)
+
+    async def wait_frame(self, last_seq, timeout):
+        """Wartet (ohne Thread) bis viewer_stream einen Frame neuer als last_seq hat"""
+        async with self.frame_notify:
+            try:
+                await asyncio.wait_for(
+                    self.frame_notify.wait_for(lambda: server.viewer_stream.seq > last_seq), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return server.viewer_stream.seq > last_seq
+
+class FayAsgiApp:
+    """HTTP-Router: Video-Routen nativ asynchron, alles andere an die Flask-App"""
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.wsgi = PooledWsgiToAsgi(server.app, bridge.http_executor)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == '/video_stream':
+            await self.video_stream(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/video_feed':
+            await self.video_feed(send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def video_feed(self, send):
+        server.keep_viewer_lease()
+        jpeg = await self.bridge.loop.run_in_executor(self.bridge.render_executor, server.viewer_stream.latest)
+        if jpeg is None:
+            await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'image/jpeg'), (b'cache-control', b'no-cache')]})
+        await send({'type': 'http.response.body', 'body': jpeg})
+
+    async def video_stream(self, receive, send):
+        """MJPEG-Stream wie /video_stream in stream_server, aber als Task statt Thread"""
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                                (b'cache-control', b'no-cache')]})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        disconnected = asyncio.ensure_future(wait_disconnect())
+
+        viewers = server.viewer_stream.subscribe()
+        print(f"📺 MJPEG-Viewer verbunden ({viewers} aktiv)")
+        seq = 0
+        try:
+            while server.processing_active and not disconnected.done():
+                server.keep_viewer_lease()
+                if not await self.bridge.wait_frame(seq, timeout=1.0):
+                    continue
+                # Rendern (ggf. Boxen + JPEG) einmal pro Frame im Render-Thread, für alle Viewer geteilt
+                jpeg, seq = await self.bridge.loop.run_in_executor(
+                    self.bridge.render_executor, server.viewer_stream.wait_frame, seq, 0)
+                if jpeg is None:
+                    continue
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                                     str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')})
+        finally:
+            disconnected.cancel()
+            viewers = server.viewer_stream.unsubscribe()
+            print(f"📺 MJPEG-Viewer getrennt ({viewers} aktiv)")
+
+def create_app():
+    client_manager = None
+    if os.environ.get('FAY_MESSAGE_QUEUE'):
+        import cluster_server
+        client_manager = cluster_server.attach_worker(server, server.WORKER_ID)
+    
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*',
+                               ping_timeout=60, ping_interval=25, client_manager=client_manager)
+    bridge = AsyncBridge(sio)
+
+    @sio.event
+    async def connect(sid, environ, auth=None):
+        bridge.call_with_reply(sid, server.handle_connect)
+
+    @sio.event
+    async def disconnect(sid, *args):
+        server.handle_disconnect()
+
+    for event, handler in SOCKET_EVENTS.items():
+        sio.on(event, bridge.make_handler(event, handler))
+
+    return socketio.ASGIApp(sio, other_asgi_app=FayAsgiApp(bridge),
+                            on_startup=bridge.start, on_shutdown=bridge.stop)
+
+app = create_app()
+
+if __name__ == '__main__':
+    import uvicorn
+    print(f"Server läuft auf http://0.0.0.0:{server.SERVER_PORT} ({'aktiv' if server.service_active else 'Standby'}, "
+          f"ASGI/uvicorn, Worker {server.WORKER_ID})")
+    uvicorn.run(app, host='0.0.0.0', port=server.SERVER_PORT, log_level='warning')
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Produktionsbetrieb für stream_server.py: mehrere Worker-Prozesse
+
+Statt eines einzelnen Prozesses (socketio.run mit allow_unsafe_werkzeug):
+- N Worker (async_server.py unter uvicorn) auf BASE_PORT, BASE_PORT+1, ...
+- nginx davor mit ip_hash (Sticky Sessions): ein Kassen-Pi bzw. Dashboard bleibt
+  bei seinem Worker, Socket.IO-Polling und die Frame-Reihenfolge bleiben intakt
+  (Beispiel: VM/:etc:nginx/sites-available/fay.conf)
+- Socket.IO-Fan-out über den vorhandenen MQTT-Broker (AsyncMqttManager): ein
+  payment_dialog aus Worker 1 erreicht auch Dashboards an Worker 0
+- Gemeinsamer Erkennungszustand über MQTT (ClusterBus): letzte Erkennung,
+  Gesichtsliste nach add_face/delete_face, Hot-Standby-Umschaltung.
+  Frames des Pi gehen nur dann an die anderen Worker, wenn dort ein Viewer
+  (/video_stream, /video_feed) hängt - sonst bliebe das Dashboard leer, das
+  ip_hash auf einen anderen Worker als den Pi verteilt.
+  Die 30s-Sperre für den Payment-Dialog liegt in SQLite (face_payments.db).
+- Abgestürzte Worker werden neu gestartet
+
+Jeder Cluster bekommt ein eigenes Topic fay/cluster/<cluster-id> (Standard: zufällig
+je Start), damit mehrere Cluster - z.B. ein Lasttest neben dem Produktivbetrieb -
+am selben Broker nichts voneinander sehen.
+
+Aufruf (im Verzeichnis von stream_server.py):
+    python cluster_server.py --workers 4
+    python cluster_server.py --workers 2 --base-port 5100 --message-queue mqtt://127.0.0.1:1883
+    python cluster_server.py --workers 2 --cluster-id kasse1
+
+Benötigt wie async_server.py: uvicorn und asgiref (siehe vm_requirements.txt)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+BASE_PORT = 5100
+CLUSTER_TOPIC = 'fay/cluster'
+WATCHDOG_INTERVAL = 5  # Sekunden zwischen Prüfungen der Worker-Prozesse
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'async_server.py')
+
+def default_message_queue():
+    broker = os.environ.get('FAY_MQTT_BROKER', '141.72.12.186')
+    return os.environ.get('FAY_MESSAGE_QUEUE', f'mqtt://{broker}:1883')
+
+def cluster_topic(cluster_id=None):
+    """Topic eines Clusters - ohne cluster_id eindeutig je Aufruf"""
+    return f"{CLUSTER_TOPIC}/{cluster_id or uuid.uuid4().hex[:12]}"
+
+class ClusterBus:
+    """
+    MQTT-Verbindung eines Workers zu den anderen.
+    Zustand geht als JSON auf <topic>/state/<art>, eigene Nachrichten werden
+    am host_id erkannt und ignoriert. Handler laufen im paho-Netzwerk-Thread.
+    """
+    def __init__(self, url, worker_id=0, topic=CLUSTER_TOPIC):
+        parsed = urlparse(url)
+        if parsed.scheme != 'mqtt':
+            raise ValueError(f"Message-Queue muss mqtt://host:port sein, nicht {url}")
+        self.topic = topic
+        self.host_id = uuid.uuid4().hex
+        self.worker_id = worker_id
+        self.state_handlers = {}
+        self.raw_handlers = {}
+        self.stats = {'published': 0, 'received': 0, 'handler_errors': 0,
+                      'frames_published': 0, 'frames_received': 0}
+
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=f"fay-worker-{worker_id}-{self.host_id[:8]}")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(parsed.hostname, parsed.port or 1883, 60)
+        self.client.loop_start()
+        print(f"🔗 Cluster-Bus: {parsed.hostname}:{parsed.port or 1883} (Worker {worker_id})")
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        # Auch nach einem Reconnect neu abonnieren
+        client.subscribe(f"{self.topic}/#")
+
+    def on_message(self, client, userdata, msg):
+        try:
+            if msg.topic in self.raw_handlers:
+                self.raw_handlers[msg.topic](msg.payload)
+                return
+            message = json.loads(msg.payload)
+            if message.get('host_id') == self.host_id:
+                return
+            kind = msg.topic.rsplit('/', 1)[-1]
+            handler = self.state_handlers.get(kind)
+            if handler:
+                self.stats['received'] += 1
+                handler(kind, message['data'])
+        except Exception as e:
+            self.stats['handler_errors'] += 1
+            print(f"Cluster-Bus Fehler ({msg.topic}): {e}")
+
+    def on_state(self, kinds, handler):
+        for kind in kinds:
+            self.state_handlers[kind] = handler
+
+    def on_raw(self, topic, handler):
+        """Unverarbeitete Payloads eines Topics (Socket.IO-Kanal)"""
+        self.raw_handlers[topic] = handler
+
+    def publish(self, kind, data):
+        self.client.publish(f"{self.topic}/state/{kind}",
+                            json.dumps({'host_id': self.host_id, 'worker': self.worker_id, 'data': data}))
+        self.stats['published'] += 1
+
+    def publish_frame(self, jpeg_bytes, roi=None):
+        """Frame für Viewer an anderen Workern: JSON-Kopfzeile + JPEG-Bytes"""
+        header = json.dumps({'host_id': self.host_id, 'roi': roi}).encode()
+        self.client.publish(f"{self.topic}/frames", header + b'\n' + jpeg_bytes)
+        self.stats['frames_published'] += 1
+
+    def on_frame(self, handler):
+        """handler(jpeg_bytes, roi) für Frames anderer Worker"""
+        def receive(payload):
+            header, _, jpeg_bytes = payload.partition(b'\n')
+            message = json.loads(header)
+            if message['host_id'] == self.host_id:
+                return
+            self.stats['frames_received'] += 1
+            handler(jpeg_bytes, message.get('roi'))
+        self.on_raw(f"{self.topic}/frames", receive)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+class AsyncMqttManager(AsyncPubSubManager):
+    """Socket.IO-Fan-out zwischen den Workern über MQTT (wie AsyncRedisManager)"""
+    name = 'mqtt'
+
+    def __init__(self, bus, write_only=False, logger=None):
+        super().__init__(channel=f"{bus.topic}/socketio", write_only=write_only, logger=logger)
+        self.bus = bus
+
+    async def _publish(self, data):
+        self.bus.client.publish(self.channel, json.dumps(data))
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self.bus.on_raw(self.channel, lambda payload: loop.call_soon_threadsafe(queue.put_nowait, payload))
+        while True:
+            yield await queue.get()
+
+def attach_worker(server, worker_id):
+    """
+    Verbindet stream_server eines Workers mit dem Cluster: Zustand teilen und
+    Zustand der anderen Worker übernehmen. Rückgabe: Client-Manager für den AsyncServer.
+    """
+    bus = ClusterBus(os.environ.get('FAY_MESSAGE_QUEUE') or default_message_queue(), worker_id,
+                     os.environ.get('FAY_CLUSTER_TOPIC') or cluster_topic())
+    bus.on_state(('recognition', 'faces', 'active', 'viewers'), server.apply_shared_state)
+    bus.on_frame(server.apply_shared_frame)
+    server.cluster_bus = bus
+    return AsyncMqttManager(bus)
+
+class WorkerPool:
+    """Startet und überwacht die Worker-Prozesse"""
+    def __init__(self, workers, base_port, message_queue, topic):
+        self.workers = workers
+        self.base_port = base_port
+        self.message_queue = message_queue
+        self.topic = topic
+        self.processes = {}
+
+    def start(self, worker_id):
+        env = dict(os.environ,
+                   FAY_PORT=str(self.base_port + worker_id),
+                   FAY_WORKER_ID=str(worker_id),
+                   FAY_MESSAGE_QUEUE=self.message_queue,
+                   FAY_CLUSTER_TOPIC=self.topic)
+        self.processes[worker_id] = subprocess.Popen([sys.executable, WORKER_SCRIPT], env=env)
+        print(f"🚀 Worker {worker_id} gestartet (Port {self.base_port + worker_id}, PID {self.processes[worker_id].pid})")
+
+    def start_all(self):
+        for worker_id in range(self.workers):
+            self.start(worker_id)
+
+    def watch(self):
+        """Blockiert; startet abgestürzte Worker neu"""
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            for worker_id, process in self.processes.items():
+                if process.poll() is not None:
+                    print(f"⚠️ Worker {worker_id} beendet (Code {process.returncode}) - Neustart")
+                    self.start(worker_id)
+
+    def stop_all(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        print("Alle Worker beendet")
+
+def main():
+    parser = argparse.ArgumentParser(description='stream_server mit mehreren Worker-Prozessen')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('FAY_WORKERS', 2)))
+    parser.add_argument('--base-port', type=int, default=BASE_PORT)
+    parser.add_argument('--message-queue', default=default_message_queue(),
+                        help='MQTT-Broker für Fan-out und gemeinsamen Zustand (mqtt://host:port)')
+    parser.add_argument('--cluster-id', default=os.environ.get('FAY_CLUSTER_ID'),
+                        help='Topic-Suffix fay/cluster/<id> (Standard: zufällig je Start)')
+    args = parser.parse_args()
+
+    topic = cluster_topic(args.cluster_id)
+    pool = WorkerPool(args.workers, args.base_port, args.message_queue, topic)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pool.start_all()
+    ports = ', '.join(f"127.0.0.1:{args.base_port + i}" for i in range(args.workers))
+    print(f"📡 Fan-out über {args.message_queue} ({topic})")
+    print(f"🔀 nginx-Upstream (ip_hash): {ports}")
+
+    try:
+        pool.watch()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop_all()
+
+if __name__ == '__main__':
+    main()
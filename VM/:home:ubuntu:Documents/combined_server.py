@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Kombinierter Betrieb: Gesichts- und Produkterkennung in einem Prozess
+
+Statt zweier Server (stream_server.py und product_recog/product_recog.py), die
+mqtt_monitor.py umschaltet und die nur über detected_products.txt gekoppelt sind:
+- ein Prozess, eine Socket.IO-Verbindung zum Pi, ein Decode je Frame:
+  die Produktstufe hängt als zweite Stufe an der RecognitionPipeline von
+  stream_server, Gesicht (halbe Auflösung) und Produkt (volle Auflösung)
+  teilen sich den decodierten Frame
+- eigenes Rechenzeit-Budget je Stufe (StageBudget), damit die teure
+  Produkterkennung den Payment-Dialog nicht ausbremst
+- Warenkorb direkt aus der Erkennungs-Session im Speicher (product_source),
+  detected_products.txt wird weiter als Journal geschrieben
+- ein Joystick-Moduswechsel schaltet nur die aktiven Stufen um
+  (POST /control/mode, von mqtt_monitor.py mit FAY_COMBINED=1)
+
+Aufruf (im Verzeichnis von stream_server.py):
+    python combined_server.py
+    FAY_MODE=combined FAY_PRODUCT_BUDGET_MS=200 python combined_server.py
+
+Umgebungsvariablen: FAY_PORT, FAY_MODE (face_recognition / product_recognition /
+combined), FAY_FACE_BUDGET_MS (150), FAY_PRODUCT_BUDGET_MS (250),
+FAY_PRODUCT_BACKEND (sift, orb, akaze)
+"""
+
+import os
+import sys
+
+from flask import jsonify, request
+
+import stream_server as server
+from recognition_pipeline import AdmissionController, Recognizer
+
+PRODUCT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'product_recog')
+if PRODUCT_DIR not in sys.path:
+    sys.path.insert(0, PRODUCT_DIR)
+from product_recognizer import ProductStreamRecognizer
+
+# Joystick-Modus (wie in mqtt_monitor.py) -> aktive Stufen
+MODES = {
+    'face_recognition': ('face',),
+    'product_recognition': ('product',),
+    'combined': ('face', 'product')
+}
+START_MODE = os.environ.get('FAY_MODE', 'face_recognition')
+FACE_BUDGET = float(os.environ.get('FAY_FACE_BUDGET_MS', 150)) / 1000
+PRODUCT_BUDGET = float(os.environ.get('FAY_PRODUCT_BUDGET_MS', 250)) / 1000
+
+current_mode = None
+current_products = {
+    'products_found': False,
+    'product_count': 0,
+    'products': [],
+    'total_value': 0.0,
+    'best_product': 'Warte...',
+    'best_confidence': 0
+}
+
+# Journal liegt wie beim eigenständigen Produktserver in product_recog/
+recognizer = ProductStreamRecognizer(models_path=os.path.join(PRODUCT_DIR, 'models'),
+                                     feature_backend=os.environ.get('FAY_PRODUCT_BACKEND', 'sift'),
+                                     output_dir=PRODUCT_DIR)
+recognizer.stage_timer = server.pipeline.timer  # SIFT/Tracking-Stufen erscheinen in /metrics
+
+class ProductRecognizer(Recognizer):
+    """Produkterkennung (SIFT/ORB + Tracking) als zweite Stufe der Pipeline"""
+    name = 'product'
+    reduce = 1  # Volle Auflösung, die Gesichtsstufe verkleinert daraus
+
+    def process(self, frame):
+        return recognizer.recognize_products_in_frame(frame.bgr())
+
+    def get_stats(self):
+        return {'models_loaded': len(recognizer.models)}
+
+class SessionProducts:
+    """Warenkorb-Quelle für stream_server (product_source): Session der Produkterkennung"""
+    def signature(self):
+        session = recognizer.get_session_summary()
+        return (session.get('session_start'), session['total_products'])
+
+    def products(self):
+        """Session-Einträge im Format von load_detected_products"""
+        products = []
+        for entry in recognizer.get_session_summary()['products']:
+            timestamp = entry['timestamp'].replace('T', ' ')[:19]
+            name = server.PRODUCT_DISPLAY_NAMES.get(entry['name'], entry['name'])
+            products.append({
+                'name': name,
+                'price_euro': entry['price_euro'],
+                'confidence_percent': round(entry['confidence'] * 100, 1),
+                'timestamp': timestamp,
+                'model_id': f"Model-{entry['model_id']}",
+                'id': f"{name}_{timestamp.replace(' ', '_').replace(':', '_')}"
+            })
+        return products
+
+    def clear(self):
+        recognizer.init_output_files()
+        recognizer.reset_tracks()
+
+def on_product_result(stage, result, frame):
+    """Ergebnis der Produktstufe: an alle Clients senden, neue Produkte sofort in den Warenkorb"""
+    global current_products
+    current_products = result
+    server.broadcast('product_result', result)
+
+    if result['products_found']:
+        print(f"🎯 PRODUKTE ERKANNT: {result['product_count']} - Bestes: {result['best_product']} "
+              f"({result['best_confidence']:.1%}) - Wert: {result['total_value']:.2f}€")
+
+    # Neue Tracks stehen schon in der Session - Delta sofort pushen (hier läuft kein cart_watcher)
+    server.cart.refresh()
+
+def set_mode(mode):
+    """Joystick-Modus setzen: nur die aktiven Stufen ändern sich, nichts wird neu gestartet"""
+    global current_mode
+    stages = MODES[mode]
+    product_active = 'product' in stages
+    if product_active and (current_mode is None or 'product' not in MODES[current_mode]):
+        recognizer.reset_tracks()  # Tracks aus dem letzten Produktmodus sind veraltet
+
+    for stage in server.pipeline.stages:
+        server.pipeline.set_stage_active(stage.name, stage.name in stages)
+
+    # Produkterkennung braucht das ganze Bild in fester Auflösung: keine Gesichtsausschnitte vom Pi
+    server.admission.configure(widths=(480,) if product_active else AdmissionController.WIDTHS,
+                               roi_allowed=not product_active)
+    current_mode = mode
+    print(f"🔀 Modus {mode}: Stufen {', '.join(stages)}")
+
+server.product_source = SessionProducts()
+server.pipeline.set_stage_budget('face', FACE_BUDGET)
+server.pipeline.add_stage(ProductRecognizer(), on_result=on_product_result, budget=PRODUCT_BUDGET)
+set_mode(START_MODE if START_MODE in MODES else 'face_recognition')
+
+@server.app.route('/control/mode', methods=['GET', 'POST'])
+def control_mode():
+    """Moduswechsel durch mqtt_monitor.py (POST nur lokal erreichbar)"""
+    if request.method == 'POST':
+        if request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({'error': 'Nur lokal erlaubt'}), 403
+
+        mode = (request.get_json(silent=True) or {}).get('mode')
+        if mode not in MODES:
+            return jsonify({'error': f'Unbekannter Modus: {mode}', 'modes': list(MODES)}), 400
+        set_mode(mode)
+
+    return jsonify({
+        'mode': current_mode,
+        'stages': {stage.name: server.pipeline.active[stage.name] for stage in server.pipeline.stages},
+        'products': current_products
+    })
+
+def init_server():
+    """Neue Produkt-Session anlegen, dann wie stream_server starten"""
+    recognizer.init_output_files()
+    server.init_server()
+
+if __name__ == '__main__':
+    init_server()
+
+    print(f"\nServer läuft auf http://0.0.0.0:{server.SERVER_PORT} (kombiniert, Modus {current_mode})")
+    print(f"Budgets: Gesicht {FACE_BUDGET * 1000:.0f} ms, Produkt {PRODUCT_BUDGET * 1000:.0f} ms pro Frame")
+    print(f"{len(recognizer.models)} Produkt-Models, {len(server.known_face_names)} Gesichter")
+    print("\n  GET  /control/mode                  - Aktueller Modus")
+    print("  POST /control/mode                  - Modus umschalten (lokal)")
+    print("  GET  /metrics                       - Laufzeiten und Budgets je Stufe")
+    print("\n🛒 Warenkorb aus der Erkennungs-Session im Speicher, Push per 'cart_delta'")
+
+    try:
+        server.socketio.run(server.app, host='0.0.0.0', port=server.SERVER_PORT,
+                            debug=False, allow_unsafe_werkzeug=True)
+    finally:
+        server.stop_processing()
+        recognizer.journal.close()
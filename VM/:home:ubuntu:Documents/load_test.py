@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Lasttest für den Mehrprozess-Betrieb (cluster_server.py)
+
+Startet den Cluster nacheinander mit verschiedenen Worker-Anzahlen und misst:
+- HTTP: Anfragen/s und Latenz (parallele Clients, je Client fest ein Worker
+  wie bei nginx ip_hash)
+- Socket.IO: Request/Response-Runden/s ('cart_sync' -> 'cart_sync')
+- Fan-out: ein Pi schickt Frames an Worker 0, gezählt wird, wie viele
+  recognition_result bei Dashboards an jedem Worker ankommen und ob
+  /video_feed an jedem Worker Bilder liefert
+
+Die Clients laufen in eigenen Prozessen, damit der Lastgenerator nicht am GIL hängt.
+Die Skalierung ist durch die CPU-Kerne der VM begrenzt (Worker > Kerne bringt nichts).
+
+Aufruf (im Verzeichnis von stream_server.py, MQTT-Broker muss laufen - Standard ist
+ein lokaler Broker, nicht der Produktiv-Broker; jeder Lauf nutzt ein eigenes Cluster-Topic):
+    python load_test.py --workers 1 2 4 --duration 10
+    python load_test.py --workers 1 2 --message-queue mqtt://10.0.0.5:1883 --output load.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+import socketio
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_TIMEOUT = 90  # Sekunden bis alle Worker /health beantworten (Modelle laden)
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+
+def http_client(url, duration):
+    """Ein Client-Prozess: GET-Schleife auf einen Worker"""
+    latencies = []
+    errors = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+    return latencies, errors
+
+def socket_client_proc(urls, duration):
+    """Ein Client-Prozess mit mehreren Socket.IO-Clients (je ein Thread)"""
+    results = [None] * len(urls)
+
+    def run(index, url):
+        latencies, errors = [], 0
+        answered = threading.Event()
+        client = socketio.Client(reconnection=False)
+        client.on('cart_sync', lambda data: answered.set())
+        try:
+            client.connect(url, transports=['websocket'], wait_timeout=10)
+        except Exception:
+            results[index] = ([], 1)
+            return
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            answered.clear()
+            start = time.perf_counter()
+            client.emit('cart_sync', {'version': -1})
+            if answered.wait(timeout=5):
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        client.disconnect()
+        results[index] = (latencies, errors)
+
+    threads = [threading.Thread(target=run, args=(i, url)) for i, url in enumerate(urls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = [lat for lats, _ in results for lat in lats]
+    return latencies, sum(errors for _, errors in results)
+
+def run_http(ports, clients, duration, path):
+    urls = [f"http://127.0.0.1:{ports[i % len(ports)]}{path}" for i in range(clients)]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(http_client, [(url, duration) for url in urls])
+    latencies = [lat for lats, _ in results for lat in lats]
+    return {
+        'requests_per_s': round(len(latencies) / duration, 1),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'errors': sum(errors for _, errors in results)
+    }
+
+def run_sockets(ports, clients, procs, duration):
+    urls = [f"http://127.0.0.1:{ports[i % len(ports)]}" for i in range(clients)]
+    groups = [urls[i::procs] for i in range(procs) if urls[i::procs]]
+    with multiprocessing.Pool(len(groups)) as pool:
+        results = pool.starmap(socket_client_proc, [(group, duration) for group in groups])
+    latencies = [lat for lats, _ in results for lat in lats]
+    return {
+        'round_trips_per_s': round(len(latencies) / duration, 1),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'errors': sum(errors for _, errors in results)
+    }
+
+def poll_video_feed(port, counts, stop):
+    """Viewer an einem Worker: /video_feed abfragen, gelieferte JPEGs zählen"""
+    while not stop.is_set():
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/video_feed", timeout=5) as response:
+                if response.status == 200 and response.read():
+                    counts[port] += 1
+        except Exception:
+            pass
+        stop.wait(0.2)
+
+def run_fanout(ports, frames=20, fps=7.5):
+    """Frames an Worker 0, recognition_result- und /video_feed-Zähler je Worker"""
+    received = {port: 0 for port in ports}
+    video = {port: 0 for port in ports}
+    stop_video = threading.Event()
+    video_threads = [threading.Thread(target=poll_video_feed, args=(port, video, stop_video), daemon=True)
+                     for port in ports]
+    for thread in video_threads:
+        thread.start()
+    listeners = []
+    for port in ports:
+        client = socketio.Client(reconnection=False)
+        client.on('recognition_result', lambda data, port=port: received.__setitem__(port, received[port] + 1))
+        client.connect(f"http://127.0.0.1:{port}", transports=['websocket'], wait_timeout=10)
+        listeners.append(client)
+    time.sleep(0.5)
+    received.update({port: 0 for port in ports})  # Erkennungsstand beim Connect nicht mitzählen
+
+    # Frame ohne Gesicht - es geht nur um die Zustellung des Ergebnisses
+    image = np.full((480, 640, 3), 128, np.uint8)
+    jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()
+    sender = socketio.Client(reconnection=False)
+    sender.connect(f"http://127.0.0.1:{ports[0]}", transports=['websocket'], wait_timeout=10)
+    for _ in range(frames):
+        sender.emit('video_frame', {'image': jpeg})
+        time.sleep(1.0 / fps)
+    time.sleep(2.0)
+
+    stop_video.set()
+    for thread in video_threads:
+        thread.join(timeout=6)
+    sender.disconnect()
+    for client in listeners:
+        client.disconnect()
+    produced = received[ports[0]]
+    return {
+        'frames_sent': frames,
+        'results_on_worker0': produced,
+        'delivery_per_worker': {str(port): count for port, count in received.items()},
+        'fanout_complete': produced > 0 and all(count == produced for count in received.values()),
+        'video_feed_per_worker': {str(port): count for port, count in video.items()},
+        'video_complete': all(count > 0 for count in video.values())
+    }
+
+def wait_for_workers(ports):
+    deadline = time.time() + STARTUP_TIMEOUT
+    pending = set(ports)
+    while pending and time.time() < deadline:
+        for port in list(pending):
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=2) as response:
+                    if response.status == 200:
+                        pending.discard(port)
+            except Exception:
+                pass
+        time.sleep(0.5)
+    return not pending
+
+def run_cluster(workers, base_port, message_queue, args, log_dir):
+    ports = [base_port + i for i in range(workers)]
+    log_path = os.path.join(log_dir, f"cluster_{workers}.log")
+    with open(log_path, 'w') as log_file:
+        cluster = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, 'cluster_server.py'),
+                                    '--workers', str(workers), '--base-port', str(base_port),
+                                    '--message-queue', message_queue,
+                                    '--cluster-id', f"loadtest-{os.getpid()}-{workers}"],
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for_workers(ports):
+            print(f"❌ {workers} Worker nicht bereit nach {STARTUP_TIMEOUT}s (Log: {log_path})")
+            return None
+        print(f"\n▶ {workers} Worker bereit (Ports {ports[0]}-{ports[-1]})")
+
+        result = {'workers': workers}
+        result['http'] = run_http(ports, args.http_clients, args.duration, args.path)
+        print(f"   HTTP:    {result['http']['requests_per_s']:>8} req/s  p95 {result['http']['p95_ms']} ms")
+        result['socket'] = run_sockets(ports, args.socket_clients, args.client_procs, args.duration)
+        print(f"   Socket:  {result['socket']['round_trips_per_s']:>8} RTT/s  p95 {result['socket']['p95_ms']} ms")
+        result['fanout'] = run_fanout(ports)
+        print(f"   Fan-out: {result['fanout']['delivery_per_worker']} "
+              f"({'vollständig' if result['fanout']['fanout_complete'] else 'UNVOLLSTÄNDIG'})")
+        print(f"   Video:   {result['fanout']['video_feed_per_worker']} "
+              f"({'alle Worker' if result['fanout']['video_complete'] else 'UNVOLLSTÄNDIG'})")
+        return result
+    finally:
+        cluster.terminate()
+        try:
+            cluster.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            cluster.kill()
+        time.sleep(1.0)  # Ports freigeben
+
+def print_summary(results):
+    print(f"\n{'='*72}")
+    print(f"{'Worker':>6} | {'HTTP req/s':>10} | {'HTTP p95':>8} | {'Socket RTT/s':>12} | {'RTT p95':>8} | Fan-out/Video")
+    print(f"{'-'*72}")
+    base = results[0]
+    for r in results:
+        http_scale = r['http']['requests_per_s'] / base['http']['requests_per_s'] if base['http']['requests_per_s'] else 0
+        sock_scale = (r['socket']['round_trips_per_s'] / base['socket']['round_trips_per_s']
+                      if base['socket']['round_trips_per_s'] else 0)
+        print(f"{r['workers']:>6} | {r['http']['requests_per_s']:>10} | {r['http']['p95_ms']:>6} ms | "
+              f"{r['socket']['round_trips_per_s']:>12} | {r['socket']['p95_ms']:>5} ms | "
+              f"{'ok' if r['fanout']['fanout_complete'] else 'fehlt'}/{'ok' if r['fanout']['video_complete'] else 'fehlt'}"
+              f"  (x{http_scale:.2f} / x{sock_scale:.2f})")
+    print(f"{'='*72}")
+    print(f"CPU-Kerne: {os.cpu_count()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest für cluster_server.py")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker-Anzahlen")
+    parser.add_argument('--base-port', type=int, default=5200)
+    parser.add_argument('--message-queue', default='mqtt://127.0.0.1:1883',
+                        help="MQTT-Broker für den Test-Cluster (mqtt://host:port)")
+    parser.add_argument('--duration', type=float, default=10.0, help="Sekunden je Messung")
+    parser.add_argument('--http-clients', type=int, default=8)
+    parser.add_argument('--socket-clients', type=int, default=32)
+    parser.add_argument('--client-procs', type=int, default=4, help="Prozesse für die Socket.IO-Clients")
+    parser.add_argument('--path', default='/api/product_status', help="HTTP-Route für die Messung")
+    parser.add_argument('--output', help="JSON-Report speichern")
+    args = parser.parse_args()
+
+    message_queue = args.message_queue
+    log_dir = tempfile.mkdtemp(prefix='fay_load_')
+    print(f"Message-Queue: {message_queue}, Logs: {log_dir}")
+
+    results = []
+    for workers in args.workers:
+        result = run_cluster(workers, args.base_port, message_queue, args, log_dir)
+        if result:
+            results.append(result)
+
+    if results:
+        print_summary(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'duration_s': args.duration, 'results': results}, f, indent=2)
+        print(f"\n📄 Report gespeichert: {args.output}")
+
+if __name__ == '__main__':
+    main()
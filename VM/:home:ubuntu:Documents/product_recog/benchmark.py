@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Offline-Benchmark für die Produkterkennung
+
+Spielt aufgenommene Frames (JPEG-Ordner oder Videodatei) ohne Flask/SocketIO
+durch den ProductStreamRecognizer und erstellt einen JSON-Report mit
+Laufzeiten je Stufe, Durchsatz sowie Precision/Recall je Model.
+
+Label-Datei (JSON): Frame -> Liste der sichtbaren Model-IDs
+    Ordner:  {"frame_0001.jpg": [0, 2], "frame_0002.jpg": []}
+    Video:   {"0": [0], "15": [0, 1]}   (Frame-Index, nicht gelabelte Frames
+                                          werden verarbeitet aber nicht bewertet)
+
+Aufruf:
+    python benchmark.py --frames recordings/tray_01 --labels recordings/tray_01/labels.json
+    python benchmark.py --video recordings/tray_02.mp4 --labels recordings/tray_02.json \\
+                        --min-matches 10 --output report.json --baseline report_alt.json
+    python benchmark.py --frames recordings/tray_01 --labels labels.json --compare-backends
+"""
+
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+from datetime import datetime
+from product_recognizer import ProductStreamRecognizer
+from recognition_pipeline import StageTimer
+
+def load_labels(labels_file):
+    """Lädt die Label-Datei als dict Frame-Schlüssel -> Set der Model-IDs"""
+    with open(labels_file, 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+    return {str(key): set(ids) for key, ids in labels.items()}
+
+def iter_frames(frames_dir=None, video=None):
+    """Liefert (Frame-Schlüssel, Frame) in Aufnahmereihenfolge"""
+    if video:
+        cap = cv2.VideoCapture(video)
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield str(index), frame
+            index += 1
+        cap.release()
+        return
+
+    for filename in sorted(os.listdir(frames_dir)):
+        if not filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        frame = cv2.imread(os.path.join(frames_dir, filename), cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"⚠️  Frame nicht lesbar: {filename}")
+            continue
+        yield filename, frame
+
+def create_recognizer(args, backend):
+    """Recognizer ohne Ausgabedateien, Schwellwerte optional überschrieben"""
+    recognizer = ProductStreamRecognizer(args.models, feature_backend=backend, persist=False)
+
+    if args.min_matches is not None:
+        recognizer.MIN_MATCHES = args.min_matches
+    if args.matching_threshold is not None:
+        recognizer.MATCHING_THRESHOLD = args.matching_threshold
+    if args.binary_matching_threshold is not None:
+        recognizer.BINARY_MATCHING_THRESHOLD = args.binary_matching_threshold
+    if args.resize_factor is not None:
+        recognizer.RESIZE_FACTOR = args.resize_factor
+    if args.color_min_correlation is not None:
+        recognizer.COLOR_HIST_MIN_CORRELATION = args.color_min_correlation
+
+    return recognizer
+
+def run_benchmark(args, labels, backend, mode):
+    """
+    Verarbeitet alle Frames und bewertet die gelabelten.
+    mode 'pipeline':  recognize_products_in_frame (inkl. Tracking, wie im Server)
+    mode 'detection': detect_products auf jedem Frame (nur volle Erkennung)
+    """
+    recognizer = create_recognizer(args, backend)
+    recognizer.stage_timer = StageTimer()
+
+    per_model = {model_id: {'tp': 0, 'fp': 0, 'fn': 0} for model_id in recognizer.models}
+    latencies = []
+    scored_frames = 0
+    full_detections = 0
+
+    for key, frame in iter_frames(args.frames, args.video):
+        start_time = time.perf_counter()
+        if mode == 'pipeline':
+            result = recognizer.recognize_products_in_frame(frame)
+            predicted = {p['id'] for p in result['products']}
+            full_detections += 1 if result.get('full_detection', True) else 0
+        else:
+            detections = recognizer.detect_products(frame) or []
+            predicted = {d['product']['id'] for d in detections}
+            full_detections += 1
+        latencies.append(time.perf_counter() - start_time)
+
+        if key not in labels:
+            continue
+
+        scored_frames += 1
+        expected = labels[key]
+        for model_id in predicted | expected:
+            stats = per_model.setdefault(model_id, {'tp': 0, 'fp': 0, 'fn': 0})
+            if model_id in predicted and model_id in expected:
+                stats['tp'] += 1
+            elif model_id in predicted:
+                stats['fp'] += 1
+            else:
+                stats['fn'] += 1
+
+    totals = {'tp': 0, 'fp': 0, 'fn': 0}
+    model_report = {}
+    for model_id, stats in sorted(per_model.items()):
+        for k in totals:
+            totals[k] += stats[k]
+        model_report[str(model_id)] = {
+            'name': recognizer.models[model_id]['name'] if model_id in recognizer.models else 'Unbekannt',
+            **stats,
+            **precision_recall(stats)
+        }
+
+    total_time = sum(latencies)
+    return {
+        'backend': backend,
+        'mode': mode,
+        'frames': len(latencies),
+        'scored_frames': scored_frames,
+        'full_detections': full_detections,
+        'throughput_fps': round(len(latencies) / total_time, 2) if total_time else 0.0,
+        'mean_latency_ms': round(float(np.mean(latencies)) * 1000, 2) if latencies else 0.0,
+        'p95_latency_ms': round(float(np.percentile(latencies, 95)) * 1000, 2) if latencies else 0.0,
+        'overall': {**totals, **precision_recall(totals)},
+        'per_model': model_report,
+        'stages': recognizer.stage_timer.summary(),
+        'config': {
+            'MIN_MATCHES': recognizer.MIN_MATCHES,
+            'MATCHING_THRESHOLD': recognizer.MATCHING_THRESHOLD,
+            'BINARY_MATCHING_THRESHOLD': recognizer.BINARY_MATCHING_THRESHOLD,
+            'COLOR_HIST_MIN_CORRELATION': recognizer.COLOR_HIST_MIN_CORRELATION,
+            'RESIZE_FACTOR': recognizer.RESIZE_FACTOR,
+            'FULL_DETECTION_INTERVAL': recognizer.FULL_DETECTION_INTERVAL,
+            'SIFT_FALLBACK': recognizer.SIFT_FALLBACK
+        }
+    }
+
+def precision_recall(stats):
+    """Precision, Recall und F1 aus tp/fp/fn"""
+    tp, fp, fn = stats['tp'], stats['fp'], stats['fn']
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'precision': round(precision, 3),
+        'recall': round(recall, 3),
+        'f1': round(f1, 3)
+    }
+
+def compare_with_baseline(report, baseline_file):
+    """Vergleicht F1 und Durchsatz mit einem früheren Report"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    old_runs = {(r['backend'], r['mode']): r for r in baseline.get('runs', [])}
+    comparison = []
+    for run in report['runs']:
+        old = old_runs.get((run['backend'], run['mode']))
+        if not old:
+            continue
+        comparison.append({
+            'backend': run['backend'],
+            'mode': run['mode'],
+            'f1_delta': round(run['overall']['f1'] - old['overall']['f1'], 3),
+            'throughput_delta_fps': round(run['throughput_fps'] - old['throughput_fps'], 2),
+            'regression': (run['overall']['f1'] < old['overall']['f1'] or
+                           run['throughput_fps'] < old['throughput_fps'] * 0.9)
+        })
+    return comparison
+
+def print_summary(report):
+    print(f"\n{'='*72}")
+    print("PRODUKTERKENNUNG BENCHMARK")
+    print(f"{'='*72}")
+    print(f"{'Backend':<8} {'Modus':<10} {'FPS':>7} {'Mittel (ms)':>12} {'p95 (ms)':>10} "
+          f"{'Precision':>10} {'Recall':>8}")
+    for run in report['runs']:
+        print(f"{run['backend']:<8} {run['mode']:<10} {run['throughput_fps']:>7.1f} "
+              f"{run['mean_latency_ms']:>12.1f} {run['p95_latency_ms']:>10.1f} "
+              f"{run['overall']['precision']:>10.3f} {run['overall']['recall']:>8.3f}")
+
+    for run in report['runs']:
+        print(f"\nStufen ({run['backend']}, {run['mode']}):")
+        for stage, stats in run['stages'].items():
+            print(f"   {stage:<20} {stats['count']:>6}x  Ø {stats['mean_ms']:>8.2f} ms  "
+                  f"p95 {stats['p95_ms']:>8.2f} ms")
+
+    for entry in report.get('baseline_comparison', []):
+        marker = "⚠️  REGRESSION" if entry['regression'] else "✓"
+        print(f"\n{marker} {entry['backend']}/{entry['mode']}: F1 {entry['f1_delta']:+.3f}, "
+              f"FPS {entry['throughput_delta_fps']:+.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline-Benchmark für Produkterkennung")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--frames', help="Ordner mit aufgenommenen JPEG-Frames")
+    source.add_argument('--video', help="Videodatei mit aufgenommenen Frames")
+    parser.add_argument('--labels', required=True, help="JSON-Datei: Frame -> Model-IDs")
+    parser.add_argument('--models', default='./models/', help="Ordner mit Produktmodellen")
+    parser.add_argument('--backend', default='sift', choices=ProductStreamRecognizer.FEATURE_BACKENDS)
+    parser.add_argument('--mode', default='pipeline', choices=['pipeline', 'detection'])
+    parser.add_argument('--compare-backends', action='store_true',
+                        help="Alle Backends im Modus 'detection' vergleichen")
+    parser.add_argument('--min-matches', type=int)
+    parser.add_argument('--matching-threshold', type=float)
+    parser.add_argument('--binary-matching-threshold', type=float)
+    parser.add_argument('--resize-factor', type=float)
+    parser.add_argument('--color-min-correlation', type=float)
+    parser.add_argument('--output', help="JSON-Report speichern")
+    parser.add_argument('--baseline', help="Früheren JSON-Report zum Vergleich")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+
+    if args.compare_backends:
+        runs = [run_benchmark(args, labels, backend, 'detection')
+                for backend in ProductStreamRecognizer.FEATURE_BACKENDS]
+    else:
+        runs = [run_benchmark(args, labels, args.backend, args.mode)]
+
+    report = {
+        'created': datetime.now().isoformat(),
+        'source': args.video or args.frames,
+        'labels': args.labels,
+        'runs': runs
+    }
+    if args.baseline:
+        report['baseline_comparison'] = compare_with_baseline(report, args.baseline)
+
+    print_summary(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📄 Report gespeichert: {args.output}")
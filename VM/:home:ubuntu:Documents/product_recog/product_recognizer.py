@@ -0,0 +1,1002 @@
+#!/usr/bin/env python3
+"""
+Product Recognizer
+SIFT/ORB-basierte Produkterkennung mit Tracking und Detection-Journal
+
+Enthält keine Flask/SocketIO-Abhängigkeiten und kann daher auch offline
+(z.B. aus benchmark.py) verwendet werden.
+"""
+
+import cv2
+import numpy as np
+import math
+import os
+import time
+import threading
+import queue
+import json
+import sys
+from datetime import datetime
+
+# Gemeinsamer Erkennungs-Kern liegt eine Ebene höher (neben stream_server.py)
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PIPELINE_DIR not in sys.path:
+    sys.path.insert(0, PIPELINE_DIR)
+from recognition_pipeline import frame_bytes
+
+PRODUCTS_FILE_HEADER = (
+    "=== ERKANNTE PRODUKTE MIT PREISEN ===\n"
+    "Format: Zeitstempel | Produktname | Preis(€) | Konfidenz(%) | Model-ID\n"
+    + "=" * 80 + "\n"
+)
+
+class DetectionJournal:
+    """
+    Crash-sicheres Journal für erkannte Produkte.
+    
+    detected_products.txt wird append-only über einen offenen Handle geschrieben,
+    die Session wird im Speicher aggregiert und nur periodisch als kompakter
+    Snapshot (atomar via os.replace) nach current_session.json geschrieben.
+    Alle Datei-Operationen laufen auf einem Hintergrund-Thread.
+    """
+    def __init__(self, output_file, session_file, fsync_interval=2.0, snapshot_interval=5.0):
+        self.output_file = output_file
+        self.session_file = session_file
+        self.fsync_interval = fsync_interval        # Sekunden zwischen fsync des Journals
+        self.snapshot_interval = snapshot_interval  # Sekunden zwischen Session-Snapshots
+        
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()       # Schützt die In-Memory Session
+        self.file_lock = threading.Lock()  # Schützt Datei-Handle und Snapshots
+        self.session = self._empty_session()
+        self.dirty = False
+        self.handle = None
+        self.last_fsync = time.time()
+        self.last_snapshot = time.time()
+        
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def _empty_session(self):
+        return {
+            "session_start": datetime.now().isoformat(),
+            "total_products": 0,
+            "total_value": 0.0,
+            "products": []
+        }
+
+    def reset(self):
+        """Startet eine neue Session: Header schreiben, Snapshot leeren"""
+        with self.file_lock:
+            if self.handle:
+                self.handle.close()
+            
+            with open(self.output_file, 'w', encoding='utf-8') as f:
+                f.write(PRODUCTS_FILE_HEADER)
+            self.handle = open(self.output_file, 'a', encoding='utf-8')
+            
+            with self.lock:
+                self.session = self._empty_session()
+                self.dirty = False
+            self._write_snapshot()
+
+    def append(self, entries):
+        """
+        Übernimmt neue Produkte sofort in die Session und reiht die
+        Journal-Zeilen für den Writer-Thread ein (blockiert nie auf Datei-I/O)
+        """
+        if not entries:
+            return
+        
+        lines = []
+        with self.lock:
+            for entry in entries:
+                self.session["products"].append(entry)
+                self.session["total_products"] += 1
+                self.session["total_value"] += entry["price_euro"]
+                
+                # Format: Zeitstempel | Produktname | Preis(€) | Konfidenz(%) | Model-ID
+                timestamp = entry["timestamp"].replace('T', ' ')[:19]
+                lines.append(f"{timestamp} | {entry['name']} | {entry['price_euro']:.2f}€ | "
+                             f"{entry['confidence'] * 100:.1f}% | Model-{entry['model_id']}\n")
+            self.session["last_update"] = datetime.now().isoformat()
+            self.dirty = True
+        
+        self.queue.put(lines)
+
+    def get_summary(self):
+        """Kopie der aktuellen Session (ohne Datei-Zugriff)"""
+        with self.lock:
+            summary = dict(self.session)
+            summary["products"] = list(self.session["products"])
+        return summary
+
+    def _write_snapshot(self):
+        """Schreibt kompakten Session-Snapshot atomar (Aufrufer hält file_lock)"""
+        with self.lock:
+            data = json.dumps(self.session, separators=(',', ':'), ensure_ascii=False)
+            self.dirty = False
+        
+        tmp_file = self.session_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.session_file)
+        self.last_snapshot = time.time()
+
+    def _writer_loop(self):
+        """Hintergrund-Thread: Journal anhängen, periodisch fsync + Snapshot"""
+        while True:
+            try:
+                lines = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                lines = []
+            
+            if lines is None:
+                break
+            
+            try:
+                with self.file_lock:
+                    if self.handle is None:
+                        continue
+                    
+                    if lines:
+                        self.handle.writelines(lines)
+                        self.handle.flush()
+                    
+                    now = time.time()
+                    if now - self.last_fsync >= self.fsync_interval:
+                        os.fsync(self.handle.fileno())
+                        self.last_fsync = now
+                    
+                    if self.dirty and now - self.last_snapshot >= self.snapshot_interval:
+                        self._write_snapshot()
+            except Exception as e:
+                print(f"✗ Journal write error: {e}")
+        
+        self._flush_all()
+
+    def _flush_all(self):
+        with self.file_lock:
+            if self.handle:
+                self.handle.flush()
+                os.fsync(self.handle.fileno())
+            if self.dirty:
+                self._write_snapshot()
+
+    def close(self):
+        """Restliche Einträge schreiben und Writer-Thread beenden"""
+        self.queue.put(None)
+        self.writer_thread.join(timeout=5)
+
+class ProductStreamRecognizer:
+    FEATURE_BACKENDS = ('orb', 'akaze', 'sift')
+
+    def __init__(self, models_path="./models/", feature_backend="sift", persist=True, output_dir="."):
+        """
+        Initialisiert den Product Stream Recognizer für Web-Interface
+        
+        feature_backend: 'sift' (Standard) oder 'orb' / 'akaze' (binäre Deskriptoren
+                         + LSH, schneller Pfad - vorher mit benchmark.py --compare-backends prüfen)
+        persist:         False für Offline-Auswertungen ohne Ausgabedateien
+        output_dir:      Verzeichnis für detected_products.txt / current_session.json
+        """
+        if feature_backend not in self.FEATURE_BACKENDS:
+            raise ValueError(f"Unbekanntes Feature-Backend: {feature_backend}")
+        
+        self.models_path = models_path
+        self.models = {}
+        self.sift = None
+        self.binary_detector = None
+        self.FEATURE_BACKEND = feature_backend
+        self.is_running = False
+        self.stage_timer = None  # Optionaler StageTimer für Laufzeitmessungen je Stufe
+        
+        # PREISSYSTEM - Feste Preise für Models
+        self.model_prices = {
+            0: 0.99,
+            1: 1.49,
+            2: 2.49,
+            3: 0.49,
+            4: 1.99,
+            5: 3.49,
+            6: 0.79,
+            7: 2.99,
+            8: 1.29,
+            9: 4.99
+        }
+        
+        # Ausgabedateien
+        self.output_file = os.path.join(output_dir, "detected_products.txt")
+        self.session_file = os.path.join(output_dir, "current_session.json")
+        self.journal = DetectionJournal(self.output_file, self.session_file) if persist else None
+        
+        # SIFT-Auflösung für Stream (Startwert, wird vom AdaptiveFrameScheduler nachgeregelt;
+        # die Framerate gibt der AdmissionController dem Pi vor)
+        self.RESIZE_FACTOR = 0.6
+        
+        # STRENGERE Erkennungsparameter
+        self.MIN_MATCHES = 8           # War: 8 → Jetzt: 15 (mehr Matches erforderlich)
+        self.MATCHING_THRESHOLD = 0.4   # War: 0.6 → Jetzt: 0.4 (strengeres Matching)
+        self.BINARY_MATCHING_THRESHOLD = 0.75  # Ratio-Test für ORB/AKAZE (Hamming-Distanzen)
+        self.SIFT_FALLBACK = True              # Knappe binäre Kandidaten mit SIFT nachprüfen
+        self.AMBIGUOUS_MIN_MATCHES = 4         # Ab hier gilt ein binärer Kandidat als "knapp"
+        self.COLOR_HIST_MIN_CORRELATION = 0.4  # H-S Histogramm-Korrelation Model <-> Szene
+        self.COLOR_HIST_BINS = [30, 32]        # Bins für Hue / Saturation
+        
+        # NEUE Parameter für zusätzliche Validierung
+        self.MIN_CONFIDENCE = 0.6       # Minimale Konfidenz für Anzeige
+        self.MIN_AREA = 3000            # Minimale Bounding Box Fläche (Pixel)
+        self.MAX_AREA_RATIO = 0.8       # Max. 80% des Bildes
+        self.GEOMETRIC_VALIDATION = True # Geometrische Validierung aktivieren
+ 
+        # Threading für Stream-Verarbeitung
+        self.frame_queue = queue.Queue(maxsize=3)
+        self.result_queue = queue.Queue(maxsize=3)
+        self.processing_active = True
+        
+        # Tracking bestätigter Produkte (ersetzt zeitbasierte Duplikat-Vermeidung)
+        self.tracks = {}                    # track_id -> Homographie, BBox, Inlier-Punkte
+        self.next_track_id = 1
+        self.prev_gray = None
+        self.frames_since_detection = 0
+        self.FULL_DETECTION_INTERVAL = 10   # Volle Erkennung spätestens jeden N-ten Frame
+        self.TRACK_MIN_POINTS = 5           # Mindestanzahl verfolgter Inlier-Punkte
+        self.TRACK_MIN_CONFIDENCE = 0.5     # Anteil überlebender Punkte, darunter volle Erkennung
+        self.TRACK_MAX_MISSES = 2           # Verpasste volle Erkennungen bis Track verworfen wird
+        self.TRACK_IOU_THRESHOLD = 0.3      # Mindest-Überlappung Erkennung <-> bestehender Track
+        self.recent_tracks = []             # Verworfene Tracks (model_id, letzte BBox, Zeitpunkt)
+        self.TRACK_REVISIT_WINDOW = 3.0     # Sekunden, in denen ein wieder erkanntes Produkt kein neues ist
+        self.TRACK_REVISIT_DISTANCE = 1.0   # Max. Mittelpunktsabstand dazu, in BBox-Größen (längere Seite)
+        self.track_lock = threading.RLock() # Tracks: Erkennungs-Thread vs. Reset aus Flask/Steuerung
+
+        # Wiederverwendete Zwischenpuffer (Resize/Farbkonvertierung) statt Neuallokation pro Frame
+        self.scratch = {}
+
+        # Farben für verschiedene Produkte
+        self.colors = [
+            (0, 255, 0),    # Grün
+            (255, 0, 0),    # Rot  
+            (0, 0, 255),    # Blau
+            (255, 255, 0),  # Gelb
+            (255, 0, 255),  # Magenta
+            (0, 255, 255),  # Cyan
+            (128, 0, 128),  # Lila
+            (255, 165, 0),  # Orange
+            (128, 128, 0),  # Olive
+            (0, 128, 128),  # Teal
+            (128, 0, 0),    # Maroon
+        ]
+        
+        # Video-Stream Setup
+        self.video_capture = None
+        self.stream_url = None
+        
+        self.init_features()
+        self.load_models()
+        self.init_output_files()
+
+    def init_output_files(self):
+        """Initialisiert die Ausgabedateien"""
+        if self.journal is None:
+            return
+        
+        try:
+            self.journal.reset()
+            
+            print(f"✓ Output files initialized:")
+            print(f"  - Products: {self.output_file}")
+            print(f"  - Session:  {self.session_file}")
+            
+        except Exception as e:
+            print(f"✗ Error initializing output files: {e}")
+
+    def write_detected_products(self, products):
+        """
+        Übergibt erkannte Produkte an das Journal (txt-Datei + Session)
+        (nur neue Tracks - Duplikate werden über die Track-Identität vermieden)
+        """
+        if not products or self.journal is None:
+            return
+        
+        timestamp = datetime.now().isoformat()
+        entries = []
+        for product in products:
+            entries.append({
+                "timestamp": timestamp,
+                "name": product['name'],
+                "model_id": product['id'],
+                "price_euro": self.model_prices.get(product['id'], 0.0),
+                "confidence": product['confidence']
+            })
+        
+        self.journal.append(entries)
+        
+        total_value = sum(e['price_euro'] for e in entries)
+        print(f"💾 PRODUKTE GESPEICHERT: {len(entries)} neue Erkennungen - Wert: {total_value:.2f}€")
+
+    def get_session_summary(self):
+        """Gibt Session-Zusammenfassung zurück"""
+        if self.journal is None:
+            return {
+                "total_products": 0,
+                "total_value": 0.0,
+                "products": []
+            }
+        return self.journal.get_summary()
+
+    def init_sift(self):
+        """Initialisiert SIFT Detektor"""
+        try:
+            self.sift = cv2.SIFT_create()
+            print("✓ SIFT initialisiert")
+        except AttributeError:
+            try:
+                self.sift = cv2.xfeatures2d.SIFT_create()
+                print("✓ SIFT (xfeatures2d) initialisiert")
+            except AttributeError:
+                raise Exception("SIFT nicht verfügbar. Installiere opencv-contrib-python")
+
+    def init_features(self):
+        """
+        Initialisiert SIFT (Fallback-Verifier) und den binären Detektor.
+        SIFT wird immer geladen, damit Model-Features für beide Backends vorliegen.
+        """
+        self.init_sift()
+        
+        if self.FEATURE_BACKEND == 'orb':
+            self.binary_detector = cv2.ORB_create(nfeatures=1500)
+        elif self.FEATURE_BACKEND == 'akaze':
+            try:
+                self.binary_detector = cv2.AKAZE_create()
+            except AttributeError:
+                self.binary_detector = cv2.xfeatures2d.AKAZE_create()
+        
+        self.bf_matcher = cv2.BFMatcher()
+        if self.binary_detector is not None:
+            print(f"✓ {self.FEATURE_BACKEND.upper()} initialisiert (LSH-Matching, SIFT-Fallback)")
+
+    def create_lsh_matcher(self):
+        """FLANN-Matcher mit LSH-Index für binäre Deskriptoren (Hamming)"""
+        index_params = dict(algorithm=6,  # FLANN_INDEX_LSH
+                            table_number=6,
+                            key_size=12,
+                            multi_probe_level=1)
+        return cv2.FlannBasedMatcher(index_params, dict(checks=50))
+
+    def load_models(self, max_models=10):
+        """Lädt alle verfügbaren Produktmodelle mit Preisen"""
+        print(f"\n=== LADE {max_models} PRODUCT MODELS MIT PREISEN ===")
+        
+        # Erstelle models Ordner falls nicht vorhanden
+        os.makedirs(self.models_path, exist_ok=True)
+        
+        loaded_count = 0
+        for i in range(max_models):
+            model_paths = [
+                os.path.join(self.models_path, f"{i}.jpg"),
+                os.path.join(self.models_path, f"{i}.png"),
+                os.path.join(self.models_path, f"product_{i}.jpg"),
+                os.path.join(self.models_path, f"product_{i}.png"),
+            ]
+            
+            model_img = None
+            used_path = None
+            for path in model_paths:
+                if os.path.exists(path):
+                    model_img = cv2.imread(path, cv2.IMREAD_COLOR)
+                    if model_img is not None:
+                        used_path = path
+                        break
+            
+            if model_img is not None:
+                # SIFT Features berechnen
+                kp_model, des_model = self.sift.detectAndCompute(model_img, None)
+                
+                # Binäre Features für den schnellen Pfad vorberechnen
+                kp_binary, des_binary = [], None
+                if self.binary_detector is not None:
+                    kp_binary, des_binary = self.binary_detector.detectAndCompute(model_img, None)
+                
+                if des_model is not None and len(kp_model) > 0:
+                    # Produktname aus Dateiname extrahieren
+                    filename = os.path.basename(used_path)
+                    name = os.path.splitext(filename)[0]
+                    if name.isdigit():
+                        name = f"Product_{name}"
+                    
+                    # Preis aus Preissystem holen
+                    price = self.model_prices.get(i, 0.0)
+                    
+                    self.models[i] = {
+                        'image': model_img,
+                        'keypoints': kp_model,
+                        'descriptors': des_model,
+                        'binary_keypoints': kp_binary,
+                        'binary_descriptors': des_binary,
+                        'color_signature': self.compute_color_signature(
+                            cv2.cvtColor(model_img, cv2.COLOR_BGR2HSV)),
+                        'num_features': len(kp_model),
+                        'name': name,
+                        'path': used_path,
+                        'price_euro': price,
+                        'has_price': True if price > 0 else False
+                    }
+                    print(f"✓ Model {i}: {name} - {len(kp_model)} keypoints - {price:.2f}€")
+                    loaded_count += 1
+                else:
+                    print(f"✗ Model {i}: Keine Features in {used_path}")
+        
+        print(f"✓ {loaded_count} Product Models mit Preisen geladen")
+        return loaded_count > 0
+
+    def connect_to_stream(self, stream_url):
+        """Verbindet sich mit Raspberry Pi Video-Stream"""
+        print(f"🔗 Verbinde mit Stream: {stream_url}")
+        
+        try:
+            # Teste verschiedene Stream-URLs
+            possible_urls = [
+                stream_url,
+                f"{stream_url}/video",
+                f"{stream_url}:8000/stream.mjpg",
+                f"{stream_url}:8080/stream.mjpg",
+            ]
+            
+            for url in possible_urls:
+                print(f"   Teste: {url}")
+                cap = cv2.VideoCapture(url)
+                
+                if cap.isOpened():
+                    # Teste ob Frame gelesen werden kann
+                    ret, frame = cap.read()
+                    if ret and frame is not None:
+                        print(f"✓ Stream erfolgreich: {url}")
+                        self.video_capture = cap
+                        self.stream_url = url
+                        return True
+                    else:
+                        print(f"   Frame-Test fehlgeschlagen")
+                        cap.release()
+                else:
+                    print(f"   Kann nicht öffnen")
+                    cap.release()
+            
+            print("✗ Alle Stream-URLs fehlgeschlagen")
+            return False
+            
+        except Exception as e:
+            print(f"✗ Stream-Verbindung fehlgeschlagen: {e}")
+            return False
+
+    def disconnect_stream(self):
+        """Trennt Stream-Verbindung"""
+        if self.video_capture:
+            self.video_capture.release()
+            self.video_capture = None
+            print("✓ Stream getrennt")
+
+    def distance_2_points(self, A, B):
+        """Berechnet Euclidische Distanz zwischen zwei Punkten"""
+        return math.sqrt(np.power(A[0] - B[0], 2) + np.power(A[1] - B[1], 2))
+
+    def match_features(self, model_descriptors, scene_descriptors, lsh_matcher=None):
+        """
+        Findet Matches zwischen Model und Scene Features.
+        Mit lsh_matcher (Index über die binären Scene-Deskriptoren) wird per
+        Hamming-LSH gematcht, sonst per Brute-Force L2 (SIFT).
+        """
+        if model_descriptors is None or scene_descriptors is None:
+            return []
+        
+        try:
+            if lsh_matcher is not None:
+                matches = lsh_matcher.knnMatch(model_descriptors, k=2)
+                threshold = self.BINARY_MATCHING_THRESHOLD
+            else:
+                matches = self.bf_matcher.knnMatch(model_descriptors, scene_descriptors, k=2)
+                threshold = self.MATCHING_THRESHOLD
+        except cv2.error:
+            return []
+        
+        good = []
+        for match_pair in matches:
+            if len(match_pair) == 2:
+                m, n = match_pair
+                if m.distance < threshold * n.distance:
+                    good.append(m)
+                    
+        return good
+
+    def validate_bounding_box(self, corners, frame_shape):
+        """Validiert und korrigiert Bounding Box"""
+        if corners is None or len(corners) != 4:
+            return None
+            
+        # Finde min/max Koordinaten
+        x_coords = [corner[0][0] for corner in corners]
+        y_coords = [corner[0][1] for corner in corners]
+        
+        x_min, x_max = int(min(x_coords)), int(max(x_coords))
+        y_min, y_max = int(min(y_coords)), int(max(y_coords))
+        
+        # Prüfe Bildgrenzen
+        height, width = frame_shape[:2]
+        x_min = max(0, min(x_min, width))
+        y_min = max(0, min(y_min, height))
+        x_max = max(0, min(x_max, width))
+        y_max = max(0, min(y_max, height))
+        
+        # Prüfe minimale Größe
+        if (x_max - x_min) < 40 or (y_max - y_min) < 40:
+            return None
+            
+        return [(x_min, y_min), (x_max, y_max)]
+
+    def compute_color_signature(self, hsv_img):
+        """Normalisiertes Hue/Saturation-Histogramm als Farbsignatur"""
+        hist = cv2.calcHist([hsv_img], [0, 1], None, self.COLOR_HIST_BINS, [0, 180, 0, 256])
+        cv2.normalize(hist, hist, alpha=1.0, norm_type=cv2.NORM_L1)
+        return hist
+
+    def quick_color_check(self, model_data, scene_hsv_crop):
+        """
+        Farbvalidierung über H-S Histogramme. Die Model-Signatur ist beim Laden
+        vorberechnet, die Szene kommt als Ausschnitt des verkleinerten HSV-Frames.
+        Gibt (ok, score) zurück.
+        """
+        if scene_hsv_crop.size == 0:
+            return False, 0.0
+        
+        scene_hist = self.compute_color_signature(scene_hsv_crop)
+        score = cv2.compareHist(model_data['color_signature'], scene_hist, cv2.HISTCMP_CORREL)
+        
+        return score >= self.COLOR_HIST_MIN_CORRELATION, score
+
+    def bbox_iou(self, a, b):
+        """Intersection over Union zweier BBox-Dicts (left/top/right/bottom)"""
+        inter_w = min(a['right'], b['right']) - max(a['left'], b['left'])
+        inter_h = min(a['bottom'], b['bottom']) - max(a['top'], b['top'])
+        if inter_w <= 0 or inter_h <= 0:
+            return 0.0
+        
+        inter = inter_w * inter_h
+        area_a = (a['right'] - a['left']) * (a['bottom'] - a['top'])
+        area_b = (b['right'] - b['left']) * (b['bottom'] - b['top'])
+        return inter / float(area_a + area_b - inter)
+
+    def record_stage(self, stage, start_time):
+        """Meldet die Laufzeit einer Stufe seit start_time (nur wenn ein StageTimer gesetzt ist)"""
+        if self.stage_timer is not None:
+            self.stage_timer.add(stage, time.perf_counter() - start_time)
+
+    def scratch_buffer(self, name, shape):
+        """Liefert einen wiederverwendbaren uint8-Puffer, neu angelegt nur bei geänderter Größe"""
+        buffer = self.scratch.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, np.uint8)
+            self.scratch[name] = buffer
+        return buffer
+
+    def reset_tracks(self, keep_recent=False):
+        """
+        Verwirft alle Tracks (z.B. bei Session-Reset oder Auflösungswechsel).
+        keep_recent: verworfene Tracks weiter gegen Doppelbuchung vormerken
+        (Auflösungswechsel - gleiche Produkte, gleiche Session)
+        """
+        with self.track_lock:
+            if keep_recent:
+                now = time.time()
+                for track in self.tracks.values():
+                    self.remember_track(track, now)
+            else:
+                self.recent_tracks = []
+            self.tracks = {}
+            self.prev_gray = None
+            self.frames_since_detection = 0
+
+    def remember_track(self, track, now):
+        """Merkt einen verworfenen Track für TRACK_REVISIT_WINDOW Sekunden vor"""
+        self.recent_tracks.append({
+            'track_id': track['track_id'],
+            'model_id': track['product']['id'],
+            'bbox': dict(track['product']['bbox']),
+            'time': now
+        })
+
+    def revisit_track(self, product, now):
+        """
+        Sucht einen kürzlich verworfenen Track desselben Models in der Nähe (z.B. Hand
+        über dem Produkt, Produkt leicht verschoben). Ein zweites Exemplar an anderer
+        Stelle ist ein neues Produkt. Bei mehreren gewinnt der kleinste Abstand.
+        Gibt dessen track_id zurück (der Eintrag wird verbraucht) oder None.
+        """
+        self.recent_tracks = [r for r in self.recent_tracks
+                              if now - r['time'] <= self.TRACK_REVISIT_WINDOW]
+        
+        def center(bbox):
+            return ((bbox['left'] + bbox['right']) / 2.0, (bbox['top'] + bbox['bottom']) / 2.0)
+        
+        best, best_distance = None, None
+        for r in self.recent_tracks:
+            if r['model_id'] != product['id']:
+                continue
+            bbox = r['bbox']
+            size = max(bbox['right'] - bbox['left'], bbox['bottom'] - bbox['top'])
+            distance = self.distance_2_points(center(bbox), center(product['bbox']))
+            if distance > size * self.TRACK_REVISIT_DISTANCE:
+                continue
+            if best is None or distance < best_distance:
+                best, best_distance = r, distance
+        
+        if best is None:
+            return None
+        self.recent_tracks.remove(best)
+        return best['track_id']
+
+    def detect_products(self, frame):
+        """
+        Volle Erkennung: Features über den ganzen Frame und Matching gegen alle Models.
+        Gibt None zurück wenn keine Features im Frame gefunden wurden.
+        """
+        stage_start = time.perf_counter()
+        
+        # Frame für Feature-Extraktion verkleinern (in wiederverwendeten Puffer)
+        height, width = frame.shape[:2]
+        small_size = (int(round(width * self.RESIZE_FACTOR)), int(round(height * self.RESIZE_FACTOR)))
+        small_frame = cv2.resize(frame, small_size,
+                                 dst=self.scratch_buffer('small', (small_size[1], small_size[0], 3)))
+        
+        use_binary = self.binary_detector is not None
+        sift_scene = None
+        scene_hsv = None  # Wird erst beim ersten Farbprüfungs-Kandidaten berechnet
+        
+        if use_binary:
+            # Schneller Pfad: binäre Features + ein LSH-Index für alle Models
+            kp_scene, des_scene = self.binary_detector.detectAndCompute(small_frame, None)
+            lsh_matcher = None
+            if des_scene is not None and len(kp_scene) > 0:
+                lsh_matcher = self.create_lsh_matcher()
+                lsh_matcher.add([des_scene])
+                lsh_matcher.train()
+            elif self.SIFT_FALLBACK:
+                # Zu texturarm für binäre Features -> ganzer Frame über SIFT
+                use_binary = False
+        
+        if not use_binary:
+            kp_scene, des_scene = self.sift.detectAndCompute(small_frame, None)
+            sift_scene = (kp_scene, des_scene)
+            lsh_matcher = None
+        
+        self.record_stage('features', stage_start)
+        
+        if des_scene is None or len(kp_scene) == 0:
+            return None
+        
+        detections = []
+        
+        # Teste jedes Model
+        for model_id, model_data in self.models.items():
+            # Feature Matching
+            stage_start = time.perf_counter()
+            if use_binary:
+                model_kp = model_data['binary_keypoints']
+                scene_kp = kp_scene
+                good_matches = self.match_features(model_data['binary_descriptors'], des_scene, lsh_matcher)
+                
+                # Knappe Kandidaten (oder Models mit zu wenigen binären Features) mit SIFT
+                # verifizieren, die SIFT-Szene wird dabei höchstens einmal pro Frame berechnet
+                ambiguous = (len(model_kp) < self.MIN_MATCHES or
+                             self.AMBIGUOUS_MIN_MATCHES <= len(good_matches) < self.MIN_MATCHES)
+                if self.SIFT_FALLBACK and ambiguous:
+                    if sift_scene is None:
+                        fallback_start = time.perf_counter()
+                        sift_scene = self.sift.detectAndCompute(small_frame, None)
+                        self.record_stage('sift_fallback', fallback_start)
+                    model_kp = model_data['keypoints']
+                    scene_kp = sift_scene[0]
+                    good_matches = self.match_features(model_data['descriptors'], sift_scene[1])
+            else:
+                model_kp = model_data['keypoints']
+                scene_kp = kp_scene
+                good_matches = self.match_features(model_data['descriptors'], des_scene)
+            self.record_stage(f'match_model_{model_id}', stage_start)
+            
+            if len(good_matches) < self.MIN_MATCHES:
+                continue
+            
+            # Homographie berechnen
+            stage_start = time.perf_counter()
+            src_pts = np.float32([model_kp[m.queryIdx].pt for m in good_matches]).reshape(-1,1,2)
+            dst_pts = np.float32([scene_kp[m.trainIdx].pt for m in good_matches]).reshape(-1,1,2)
+            
+            # Skaliere Punkte zurück auf Originalgröße
+            dst_pts = dst_pts / self.RESIZE_FACTOR
+            
+            try:
+                M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+                if M is None:
+                    continue
+            except:
+                continue
+            
+            # Model-Ecken transformieren
+            h, w = model_data['image'].shape[:2]
+            corners = np.float32([[0,0],[0,h-1],[w-1,h-1],[w-1,0]]).reshape(-1,1,2)
+            
+            try:
+                transformed_corners = cv2.perspectiveTransform(corners, M)
+            except:
+                continue
+            
+            # Bounding Box validieren
+            bbox = self.validate_bounding_box(transformed_corners, frame.shape)
+            self.record_stage('homography', stage_start)
+            if bbox is None:
+                continue
+            
+            # Schnelle Farbprüfung auf dem verkleinerten Frame (HSV einmal pro Frame)
+            stage_start = time.perf_counter()
+            if scene_hsv is None:
+                scene_hsv = cv2.cvtColor(small_frame, cv2.COLOR_BGR2HSV,
+                                         dst=self.scratch_buffer('hsv', small_frame.shape))
+            top_left, bottom_right = bbox
+            scene_crop = scene_hsv[int(top_left[1] * self.RESIZE_FACTOR):int(bottom_right[1] * self.RESIZE_FACTOR),
+                                   int(top_left[0] * self.RESIZE_FACTOR):int(bottom_right[0] * self.RESIZE_FACTOR)]
+            
+            color_ok, color_score = self.quick_color_check(model_data, scene_crop)
+            self.record_stage('color_check', stage_start)
+            if not color_ok:
+                continue
+            
+            # Konfidenz basierend auf Matches berechnen
+            confidence = min(len(good_matches) / 20.0, 1.0)  # Normalisiert auf 0-1
+            
+            # Produkt-Info zusammenstellen MIT PREIS
+            product_info = {
+                'id': model_id,
+                'name': model_data['name'],
+                'confidence': confidence,
+                'matches': len(good_matches),
+                'color_score': round(float(color_score), 2),
+                'price_euro': model_data['price_euro'],
+                'has_price': model_data['has_price'],
+                'bbox': {
+                    'left': bbox[0][0],
+                    'top': bbox[0][1],
+                    'right': bbox[1][0],
+                    'bottom': bbox[1][1]
+                },
+                'color_id': model_id % len(self.colors)
+            }
+            
+            # RANSAC-Inlier dienen als Startpunkte für das Optical-Flow-Tracking
+            inlier_pts = dst_pts[mask.ravel() == 1]
+            
+            detections.append({
+                'product': product_info,
+                'homography': M,
+                'corners': transformed_corners,
+                'points': inlier_pts.reshape(-1, 1, 2).astype(np.float32)
+            })
+        
+        return detections
+
+    def update_tracks(self, gray):
+        """
+        Verfolgt die Inlier-Punkte aller Tracks per Optical Flow in den neuen Frame.
+        Gibt False zurück wenn mindestens ein Track verloren ging (-> volle Erkennung).
+        """
+        active = [t for t in self.tracks.values() if not t['lost']]
+        if not active or self.prev_gray is None:
+            return False
+        
+        # Alle Punkte in einem einzigen LK-Aufruf verfolgen
+        all_points = np.concatenate([t['points'] for t in active])
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, all_points, None, winSize=(21, 21), maxLevel=3
+        )
+        
+        all_ok = True
+        offset = 0
+        for track in active:
+            count = len(track['points'])
+            old_pts = track['points']
+            new_pts = next_points[offset:offset + count]
+            ok = status[offset:offset + count].ravel() == 1
+            offset += count
+            
+            if ok.sum() < self.TRACK_MIN_POINTS:
+                track['lost'] = True
+                all_ok = False
+                continue
+            
+            # Ähnlichkeitstransformation zwischen letztem und aktuellem Frame
+            A, inliers = cv2.estimateAffinePartial2D(
+                old_pts[ok], new_pts[ok], method=cv2.RANSAC, ransacReprojThreshold=3.0
+            )
+            if A is None:
+                track['lost'] = True
+                all_ok = False
+                continue
+            
+            inliers = inliers.ravel() == 1
+            quality = float(inliers.sum()) / track['initial_points']
+            corners = cv2.transform(track['corners'], A)
+            bbox = self.validate_bounding_box(corners, gray.shape)
+            
+            if quality < self.TRACK_MIN_CONFIDENCE or bbox is None:
+                track['lost'] = True
+                all_ok = False
+                continue
+            
+            track['points'] = new_pts[ok][inliers].reshape(-1, 1, 2)
+            track['corners'] = corners
+            track['homography'] = np.vstack([A, [0, 0, 1]]) @ track['homography']
+            track['quality'] = quality
+            track['product']['bbox'] = {
+                'left': bbox[0][0],
+                'top': bbox[0][1],
+                'right': bbox[1][0],
+                'bottom': bbox[1][1]
+            }
+        
+        return all_ok
+
+    def associate_detections(self, detections):
+        """
+        Ordnet Erkennungen bestehenden Tracks zu (gleiches Model + BBox-Überlappung).
+        Ohne passenden Track wird ein kürzlich verworfener Track desselben Models
+        wieder aufgenommen. Gibt nur die Produkte wirklich neuer Tracks zurück -
+        nur diese landen im Warenkorb.
+        """
+        new_products = []
+        matched = set()
+        now = time.time()
+        
+        for detection in detections:
+            product = detection['product']
+            best_id = None
+            best_iou = self.TRACK_IOU_THRESHOLD
+            
+            for track_id, track in self.tracks.items():
+                if track_id in matched or track['product']['id'] != product['id']:
+                    continue
+                iou = self.bbox_iou(track['product']['bbox'], product['bbox'])
+                if iou >= best_iou:
+                    best_id, best_iou = track_id, iou
+            
+            if best_id is None:
+                best_id = self.revisit_track(product, now)
+            if best_id is None:
+                best_id = self.next_track_id
+                self.next_track_id += 1
+                new_products.append(product)
+            
+            self.tracks[best_id] = {
+                'track_id': best_id,
+                'product': product,
+                'homography': detection['homography'],
+                'corners': detection['corners'],
+                'points': detection['points'],
+                'initial_points': len(detection['points']),
+                'quality': 1.0,
+                'misses': 0,
+                'lost': len(detection['points']) < self.TRACK_MIN_POINTS
+            }
+            matched.add(best_id)
+        
+        # Nicht bestätigte Tracks altern und werden nach mehreren Fehlversuchen verworfen
+        for track_id in list(self.tracks.keys()):
+            if track_id in matched:
+                continue
+            self.tracks[track_id]['misses'] += 1
+            if self.tracks[track_id]['misses'] > self.TRACK_MAX_MISSES:
+                self.remember_track(self.tracks.pop(track_id), now)
+        
+        return new_products
+
+    def recognize_products_in_frame(self, frame):
+        """
+        Erkennt Produkte in einem Frame für Web-Interface mit Preisen.
+        Bestätigte Produkte werden per Optical Flow verfolgt; die volle
+        Feature-Erkennung läuft nur nach Zeitplan oder bei verlorenem Track.
+        """
+        if frame is None or frame.size == 0:
+            return {
+                'products_found': False,
+                'product_count': 0,
+                'products': [],
+                'total_value': 0.0,
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'frame_processed': True
+            }
+        
+        # Tracks nur unter Lock ändern/lesen - reset_tracks kommt aus anderen Threads
+        with self.track_lock:
+            # Zwei abwechselnde Graupuffer: prev_gray muss für den Optical Flow erhalten bleiben
+            gray_slot = 'gray_b' if self.prev_gray is self.scratch.get('gray_a') else 'gray_a'
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                                dst=self.scratch_buffer(gray_slot, frame.shape[:2]))
+            if self.prev_gray is not None and self.prev_gray.shape != gray.shape:
+                self.reset_tracks(keep_recent=True)
+            
+            stage_start = time.perf_counter()
+            tracking_ok = self.update_tracks(gray)
+            if self.tracks:
+                self.record_stage('tracking', stage_start)
+            self.frames_since_detection += 1
+            self.prev_gray = gray
+            
+            new_products = []
+            full_detection = (not tracking_ok or
+                              self.frames_since_detection >= self.FULL_DETECTION_INTERVAL)
+            
+            if full_detection:
+                self.frames_since_detection = 0
+                detections = self.detect_products(frame)
+                
+                if detections is None and not self.tracks:
+                    return {
+                        'products_found': False,
+                        'product_count': 0,
+                        'products': [],
+                        'total_value': 0.0,
+                        'timestamp': datetime.now().strftime("%H:%M:%S"),
+                        'message': 'Keine Features im Frame gefunden'
+                    }
+                
+                new_products = self.associate_detections(detections or [])
+            
+            detected_products = []
+            for track in self.tracks.values():
+                if track['lost']:
+                    continue
+                product = dict(track['product'])
+                product['track_id'] = track['track_id']
+                product['tracking_quality'] = round(track['quality'], 2)
+                detected_products.append(product)
+        
+        # Sortiere nach Konfidenz
+        detected_products.sort(key=lambda x: x['confidence'], reverse=True)
+        
+        # Berechne Gesamtwert
+        total_value = sum(p['price_euro'] for p in detected_products if p['has_price'])
+        
+        # SCHREIBE NUR NEUE TRACKS IN DATEI
+        if new_products:
+            self.write_detected_products(new_products)
+        
+        return {
+            'products_found': len(detected_products) > 0,
+            'product_count': len(detected_products),
+            'products': detected_products,
+            'total_value': total_value,
+            'timestamp': datetime.now().strftime("%H:%M:%S"),
+            'frame_processed': True,
+            'full_detection': full_detection,
+            'active_tracks': len(detected_products),
+            'best_product': detected_products[0]['name'] if detected_products else 'Suche...',
+            'best_confidence': detected_products[0]['confidence'] if detected_products else 0
+        }
+
+    def process_frame_from_base64(self, image_b64):
+        """Verarbeitet Frame aus Base64-String (oder direkt aus JPEG-Bytes vom Pi)"""
+        try:
+            # Base64 zu Image
+            nparr = np.frombuffer(frame_bytes(image_b64), np.uint8)
+            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            
+            return self.recognize_products_in_frame(frame)
+            
+        except Exception as e:
+            print(f"Frame processing error: {e}")
+            return {
+                'products_found': False,
+                'product_count': 0,
+                'products': [],
+                'total_value': 0.0,
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'error': str(e)
+            }
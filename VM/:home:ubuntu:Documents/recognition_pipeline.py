@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""
+Gemeinsamer Erkennungs-Kern für stream_server.py und product_recog/product_recog.py
+
+- Frame: eingehender Frame (JPEG-Bytes, Base64 oder ndarray), wird je Variante
+  höchstens einmal decodiert - mehrere Stufen teilen sich den Decode
+- Recognizer: Schnittstelle einer Erkennungsstufe (Gesicht, Produkt, ...)
+- LatestFrameSlot: Übergabe mit Condition-Variable, nur der neueste Frame
+- RecognitionPipeline: Slot -> aktive Stufen -> on_result, mit Laufzeiten je
+  Stufe und Back-Pressure über den AdmissionController
+- StageBudget: Rechenzeit-Budget je Stufe, damit sich mehrere Stufen auf einem
+  Frame (combined_server.py) nicht gegenseitig ausbremsen
+- ClockSkew: Aufnahmezeitpunkt vom Pi in Server-Zeit umrechnen, damit zu alte
+  Frames vor dem Decode verworfen werden können (Deadline)
+- StageTimer: Laufzeiten je Stufe (Server: gleitendes Fenster, Replay/Benchmark: alle)
+
+Keine Flask/SocketIO-Abhängigkeiten - auch offline nutzbar.
+"""
+
+import base64
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# JPEG-Decoder skaliert direkt beim Decodieren (volles Bild wird nie angelegt)
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+def frame_bytes(image):
+    """JPEG-Bytes aus dem Frame-Payload (binär vom Pi oder Base64-String)"""
+    if isinstance(image, (bytes, bytearray)):
+        return image
+    return base64.b64decode(image)
+
+class StageTimer:
+    """Sammelt Laufzeiten je Verarbeitungsstufe (window: nur die letzten N je Stufe)"""
+    def __init__(self, window=None):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append(seconds)
+
+    def summary(self):
+        """Anzahl, Mittelwert, p95 und Summe je Stufe in Millisekunden"""
+        result = {}
+        with self.lock:
+            for stage, values in sorted(self.samples.items()):
+                values_ms = np.array(values) * 1000
+                result[stage] = {
+                    'count': len(values),
+                    'mean_ms': round(float(values_ms.mean()), 3),
+                    'p95_ms': round(float(np.percentile(values_ms, 95)), 3),
+                    'total_ms': round(float(values_ms.sum()), 1)
+                }
+        return result
+
+class LatestFrameSlot:
+    """
+    Übergabe-Slot zwischen Socket-Handler und Erkennungs-Thread.
+    Hält nur den neuesten unverarbeiteten Frame - ein älterer wird überschrieben
+    statt sich in einer Queue zu stauen.
+    """
+    def __init__(self):
+        self.item = None
+        self.overwritten = 0
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        """Legt einen Frame ab, gibt False zurück wenn dabei ein älterer verworfen wurde"""
+        with self.condition:
+            replaced = self.item is not None
+            if replaced:
+                self.overwritten += 1
+            self.item = item
+            self.condition.notify()
+        return not replaced
+
+    def take(self, timeout=None):
+        """Holt den neuesten Frame (wartet höchstens timeout Sekunden, None: bis
+        ein Frame kommt oder wake()), sonst None"""
+        with self.condition:
+            if self.item is None:
+                self.condition.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+    def wake(self):
+        """Weckt einen wartenden take() ohne Frame (z.B. zum Beenden)"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.item = None
+
+    def __len__(self):
+        return 0 if self.item is None else 1
+
+class AdmissionController:
+    """
+    Back-Pressure zum Pi: leitet aus der gemessenen Verarbeitungszeit Vorgaben
+    (Ziel-FPS, Bildbreite, JPEG-Qualität) ab, damit der Pi nicht mehr Frames
+    aufnimmt, codiert und hochlädt als der Server verarbeiten kann.
+    Zuerst wird die Framerate gesenkt, erst unter min_fps die Auflösung
+    (widths mit nur einem Eintrag: Auflösung bleibt fest, z.B. für SIFT).
+    Die Framerate regelt nur diese Klasse - Server überspringen selbst keine
+    Frames, der Pi sendet von seinen 15 FPS jeden round(15 / target_fps)-ten.
+    """
+    WIDTHS = (480, 400, 320)
+
+    def __init__(self, max_fps=7.5, min_fps=2.0, headroom=0.85, uplink_budget_kbps=2000,
+                 min_quality=30, max_quality=50, ack_interval=1.0, widths=WIDTHS,
+                 roi_allowed=True):
+        self.max_fps = max_fps                  # Obergrenze für den Pi (15 FPS Kamera, sendet jeden 2.)
+        self.min_fps = min_fps
+        self.headroom = headroom                # Anteil der Verarbeitungsrate, der angefordert wird
+        self.uplink_budget_kbps = uplink_budget_kbps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.ack_interval = ack_interval        # Sekunden zwischen frame_ack-Events
+        self.widths = tuple(widths)
+        self.roi_allowed = bool(roi_allowed)    # Gesichtsausschnitte vom Pi erlaubt
+
+        self.avg_duration = 0.0
+        self.width_index = 0
+        self.jpeg_quality = max_quality
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.window_start = time.time()
+        self.last_ack = 0.0
+        self.lock = threading.Lock()
+        self.advice = {
+            'target_fps': max_fps,
+            'width': self.widths[0],
+            'jpeg_quality': max_quality,
+            'processing_fps': 0.0,
+            'received_fps': 0.0,
+            'roi_allowed': self.roi_allowed
+        }
+
+    def configure(self, widths=None, roi_allowed=None):
+        """Ändert die zulässigen Breiten bzw. ROI-Freigabe (z.B. beim Moduswechsel),
+        wirkt ab dem nächsten frame_ack"""
+        with self.lock:
+            if widths is not None:
+                self.widths = tuple(widths)
+                self.width_index = min(self.width_index, len(self.widths) - 1)
+            if roi_allowed is not None:
+                self.roi_allowed = bool(roi_allowed)
+            self.advice.update(width=self.widths[self.width_index], roi_allowed=self.roi_allowed)
+            self.last_ack = 0.0
+
+    def record_processing(self, duration):
+        """Meldet die Verarbeitungszeit eines Frames (exponentiell geglättet)"""
+        with self.lock:
+            if self.avg_duration == 0.0:
+                self.avg_duration = duration
+            else:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    def on_frame_received(self, payload_bytes):
+        """Zählt einen eingehenden Frame, gibt die Vorgabe zurück wenn ein frame_ack fällig ist"""
+        with self.lock:
+            self.frames_received += 1
+            self.bytes_received += payload_bytes
+
+            now = time.time()
+            if now - self.last_ack < self.ack_interval:
+                return None
+
+            self._update(now - self.window_start)
+            self.frames_received = 0
+            self.bytes_received = 0
+            self.window_start = now
+            self.last_ack = now
+            return dict(self.advice)
+
+    def _update(self, elapsed):
+        """Berechnet die Vorgabe neu (Aufrufer hält lock)"""
+        processing_fps = 1.0 / self.avg_duration if self.avg_duration else self.max_fps
+        target_fps = processing_fps * self.headroom
+
+        # Auflösung nur ändern wenn die Framerate allein nicht reicht (mit Hysterese)
+        if target_fps < self.min_fps and self.width_index < len(self.widths) - 1:
+            self.width_index += 1
+        elif target_fps >= self.min_fps * 2.5 and self.width_index > 0:
+            self.width_index -= 1
+        target_fps = min(self.max_fps, max(self.min_fps, target_fps))
+
+        # JPEG-Qualität am Uplink-Budget ausrichten (Bytes pro Frame x Ziel-FPS)
+        if self.frames_received:
+            needed_kbps = self.bytes_received / self.frames_received * 8 / 1000 * target_fps
+            if needed_kbps > self.uplink_budget_kbps and self.jpeg_quality > self.min_quality:
+                self.jpeg_quality -= 5
+            elif needed_kbps < self.uplink_budget_kbps * 0.6 and self.jpeg_quality < self.max_quality:
+                self.jpeg_quality += 5
+
+        self.advice = {
+            'target_fps': round(target_fps, 1),
+            'width': self.widths[self.width_index],
+            'jpeg_quality': self.jpeg_quality,
+            'processing_fps': round(processing_fps, 1),
+            'received_fps': round(self.frames_received / elapsed, 1) if elapsed > 0 else 0.0,
+            'roi_allowed': self.roi_allowed
+        }
+
+    def get_stats(self):
+        """Aktuelle Vorgabe und geglättete Verarbeitungszeit für /metrics"""
+        with self.lock:
+            return dict(self.advice, avg_processing_ms=round(self.avg_duration * 1000, 1))
+
+class ClockSkew:
+    """
+    Schätzt den Uhrenversatz zwischen Pi und Server aus (Empfang - Aufnahme).
+    Das Minimum über die letzten window Frames entspricht Versatz plus kürzester
+    Übertragungszeit - das Alter eines Frames ist damit die Verzögerung über den
+    schnellsten zuletzt gesehenen Frame hinaus (NTP auf dem Pi ist nicht nötig).
+    """
+    def __init__(self, window=100):
+        self.offsets = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, captured_at, received_at):
+        with self.lock:
+            self.offsets.append(received_at - captured_at)
+
+    def offset(self):
+        with self.lock:
+            return min(self.offsets) if self.offsets else None
+
+    def age(self, captured_at, now=None):
+        """Alter eines Frames in Sekunden (None ohne Schätzung)"""
+        offset = self.offset()
+        if offset is None:
+            return None
+        return (now or time.time()) - captured_at - offset
+
+class Frame:
+    """
+    Ein eingehender Frame mit optionalem Gesichtsausschnitt (roi) vom Pi.
+    captured_at: Aufnahmezeitpunkt nach der Uhr des Pi (time.time()), falls mitgeschickt.
+    Decodiert wird erst, wenn eine Stufe das Bild anfordert, und je Variante
+    nur einmal: fordert eine Stufe das volle Bild und eine andere das halbe an,
+    wird das halbe aus dem vollen verkleinert statt ein zweites Mal decodiert.
+    """
+    def __init__(self, payload, roi=None, captured_at=None):
+        self.payload = payload
+        self.roi = roi
+        self.captured_at = captured_at
+        self.received_at = time.perf_counter()
+        self.received_wall = time.time()
+        self.timings = {}       # Stufe -> Sekunden (von der Pipeline gesetzt)
+        self.images = {}        # Verkleinerungsfaktor -> BGR-Bild
+        self.decodes = 0
+        if isinstance(payload, np.ndarray):
+            self.images[1] = payload
+
+    def jpeg(self):
+        return None if isinstance(self.payload, np.ndarray) else frame_bytes(self.payload)
+
+    def bgr(self, reduce=1):
+        """BGR-Bild in 1/reduce der Originalgröße (None wenn nicht decodierbar)"""
+        if reduce in self.images:
+            return self.images[reduce]
+
+        full = self.images.get(1)
+        if full is not None:
+            height, width = full.shape[:2]
+            image = cv2.resize(full, (width // reduce, height // reduce), interpolation=cv2.INTER_AREA)
+        else:
+            buffer = np.frombuffer(frame_bytes(self.payload), np.uint8)
+            image = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[reduce])
+            self.decodes += 1
+        self.images[reduce] = image
+        return image
+
+class Recognizer:
+    """
+    Schnittstelle einer Erkennungsstufe. Unterklassen setzen name und liefern in
+    process() ein JSON-fähiges Ergebnis-Dict. Den Frame holen sie sich über
+    frame.bgr(...) - so entscheidet die Stufe selbst über die benötigte Auflösung.
+    reduce gibt diese Auflösung der Pipeline bekannt, damit sie bei mehreren
+    Stufen einmal in der größten benötigten decodiert.
+    """
+    name = 'recognizer'
+    reduce = 1
+
+    def process(self, frame):
+        raise NotImplementedError
+
+    def get_stats(self):
+        return {}
+
+class StageBudget:
+    """
+    Rechenzeit-Budget einer Stufe in Sekunden pro Frame.
+    Pro Frame wird das Budget gutgeschrieben, die Stufe läuft nur, wenn das
+    Guthaben ihre geglättete Laufzeit deckt - eine Stufe, die im Mittel 300 ms
+    braucht, läuft mit 100 ms Budget also etwa jeden dritten Frame.
+    """
+    def __init__(self, seconds, burst=3):
+        self.seconds = seconds
+        self.burst = burst          # Maximal angespartes Guthaben in Frames
+        self.credit = 0.0
+        self.avg_duration = 0.0
+        self.runs = 0
+        self.skipped = 0
+
+    def admit(self):
+        """Guthaben für einen Frame gutschreiben, True wenn die Stufe laufen darf"""
+        self.credit = min(self.credit + self.seconds,
+                          max(self.seconds * self.burst, self.avg_duration))
+        if self.credit < self.avg_duration:
+            self.skipped += 1
+            return False
+        return True
+
+    def record(self, duration):
+        self.credit -= duration
+        if self.avg_duration == 0.0:
+            self.avg_duration = duration
+        else:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self.runs += 1
+
+    def get_stats(self):
+        return {
+            'budget_ms': round(self.seconds * 1000, 1),
+            'avg_ms': round(self.avg_duration * 1000, 1),
+            'runs': self.runs,
+            'skipped': self.skipped
+        }
+
+class RecognitionPipeline:
+    """
+    Erkennungs-Thread eines Servers: wartet (Condition-Variable, kein Polling)
+    auf den neuesten Frame und gibt ihn nacheinander an alle aktiven Stufen.
+    on_result(stage_name, result, frame) wird nach jeder Stufe aufgerufen
+    (bzw. der eigene Handler der Stufe aus add_stage).
+    budgets: optional Stufenname -> Sekunden pro Frame (StageBudget)
+    deadline: Frames, die älter sind (Aufnahme bzw. Empfang), werden vor dem
+    Decode verworfen - Ergebnisse zeigen, was die Kamera jetzt sieht
+    """
+    def __init__(self, stages, on_result, admission=None, slot=None, timer=None, budgets=None,
+                 deadline=None):
+        self.stages = list(stages)
+        self.active = {stage.name: True for stage in self.stages}
+        self.on_result = on_result
+        self.handlers = {}
+        self.budgets = {}
+        for name, seconds in (budgets or {}).items():
+            self.set_stage_budget(name, seconds)
+        self.admission = admission
+        self.slot = slot or LatestFrameSlot()
+        self.timer = timer or StageTimer(window=500)
+        self.running = False
+        self.thread = None
+        self.frames_submitted = 0
+        self.frames_processed = 0
+        self.stage_errors = 0
+        self.idle_wakeups = 0   # step() ohne Frame zurückgekehrt (Timeout oder wake)
+        self.deadline = deadline
+        self.clock = ClockSkew()
+        self.frames_expired = 0
+
+    def submit(self, payload, roi=None, captured_at=None):
+        """Nimmt einen Frame an; False wenn dabei ein älterer unverarbeiteter verworfen wurde"""
+        frame = Frame(payload, roi, captured_at)
+        if captured_at is not None:
+            self.clock.observe(captured_at, frame.received_wall)
+        self.frames_submitted += 1
+        return self.slot.put(frame)
+
+    def frame_age(self, frame):
+        """Alter in Sekunden: seit der Aufnahme (Uhrenversatz korrigiert), mindestens die Wartezeit"""
+        age = time.perf_counter() - frame.received_at
+        if frame.captured_at is not None:
+            capture_age = self.clock.age(frame.captured_at)
+            if capture_age is not None:
+                age = max(age, capture_age)
+        return age
+
+    def add_stage(self, stage, on_result=None, active=True, budget=None):
+        """Weitere Stufe anhängen (läuft nach den bisherigen), optional mit eigenem Handler"""
+        self.stages.append(stage)
+        self.active[stage.name] = bool(active)
+        if on_result:
+            self.handlers[stage.name] = on_result
+        if budget:
+            self.set_stage_budget(stage.name, budget)
+
+    def set_stage_active(self, name, active):
+        self.active[name] = bool(active)
+
+    def set_stage_budget(self, name, seconds):
+        """Budget in Sekunden pro Frame setzen, None entfernt es"""
+        if seconds:
+            self.budgets[name] = StageBudget(seconds)
+        else:
+            self.budgets.pop(name, None)
+
+    def active_stages(self):
+        return [stage for stage in self.stages if self.active.get(stage.name)]
+
+    def process(self, frame):
+        """Führt alle aktiven Stufen auf einem Frame aus (auch direkt aus Tests/Replay)"""
+        self.timer.add('queue_wait', time.perf_counter() - frame.received_at)
+        age = self.frame_age(frame)
+        self.timer.add('frame_age', age)
+        if self.deadline and age > self.deadline:
+            # Veraltet - verwerfen bevor decodiert wird
+            self.frames_expired += 1
+            return {}
+
+        frame_start = time.perf_counter()
+        stages = [stage for stage in self.active_stages()
+                  if stage.name not in self.budgets or self.budgets[stage.name].admit()]
+
+        # Mehrere Stufen: einmal in der größten benötigten Auflösung decodieren,
+        # kleinere Varianten entstehen daraus per Resize
+        if len(stages) > 1 and not frame.images:
+            decode_start = time.perf_counter()
+            frame.bgr(min(stage.reduce for stage in stages))
+            self.timer.add('decode', time.perf_counter() - decode_start)
+
+        results = {}
+        for stage in stages:
+            stage_start = time.perf_counter()
+            try:
+                results[stage.name] = stage.process(frame)
+            except Exception as e:
+                self.stage_errors += 1
+                print(f"Processing error ({stage.name}): {e}")
+                continue
+            frame.timings[stage.name] = time.perf_counter() - stage_start
+            self.timer.add(f'stage_{stage.name}', frame.timings[stage.name])
+            if stage.name in self.budgets:
+                self.budgets[stage.name].record(frame.timings[stage.name])
+            self.handlers.get(stage.name, self.on_result)(stage.name, results[stage.name], frame)
+
+        duration = time.perf_counter() - frame_start
+        self.timer.add('frame_total', duration)
+        if self.admission:
+            self.admission.record_processing(duration)
+        self.frames_processed += 1
+        return results
+
+    def step(self, timeout=None):
+        """Verarbeitet den nächsten Frame, sobald er da ist (False nach timeout
+        bzw. wake() ohne Frame). Ohne timeout schläft der Thread bis zum nächsten Frame."""
+        frame = self.slot.take(timeout=timeout)
+        if frame is None:
+            self.idle_wakeups += 1
+            return False
+        self.process(frame)
+        return True
+
+    def wake(self):
+        """Weckt den wartenden Erkennungs-Thread, damit er sein Abbruch-Flag prüft"""
+        self.slot.wake()
+
+    def run(self):
+        while self.running:
+            self.step()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+    def get_stats(self):
+        """Zähler, Laufzeiten je Stufe und Back-Pressure für /metrics"""
+        return {
+            'stages': {stage.name: dict(stage.get_stats(), active=self.active[stage.name],
+                                        budget=self.budgets[stage.name].get_stats()
+                                        if stage.name in self.budgets else None)
+                       for stage in self.stages},
+            'frames_submitted': self.frames_submitted,
+            'frames_processed': self.frames_processed,
+            'frames_overwritten': self.slot.overwritten,
+            'frames_expired': self.frames_expired,
+            'deadline_ms': round(self.deadline * 1000) if self.deadline else None,
+            'clock_offset_ms': (round(self.clock.offset() * 1000, 1)
+                                if self.clock.offset() is not None else None),
+            'queue_size': len(self.slot),
+            'stage_errors': self.stage_errors,
+            'idle_wakeups': self.idle_wakeups,
+            'timings': self.timer.summary(),
+            'admission': self.admission.get_stats() if self.admission else None
+        }
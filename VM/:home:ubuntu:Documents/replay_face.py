@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Replay-Harness für die Gesichtserkennung
+
+Spielt eine aufgenommene Frame-Sequenz mit fester Rate durch
+enqueue_frame -> background_processor (RecognitionPipeline) -> process_frame_fast aus stream_server.py.
+Kamera, MQTT-Broker und Stripe werden nicht benötigt: MQTT und Socket.IO
+werden durch lokale Stubs ersetzt, Stripe läuft im Demo-Modus und die
+Datenbank liegt in einem temporären Arbeitsverzeichnis.
+
+Identitäts-Labels (optional, JSON): Frame -> Name der sichtbaren Person
+    {"frame_0010.jpg": "max", "frame_0011.jpg": "max"}
+Damit wird die Zeit vom ersten Auftauchen bis zum payment_dialog gemessen.
+
+Mit --policies werden Detektions-Policies (DETECTION_PRESETS in stream_server.py)
+verglichen: jeder Frame läuft ohne Pacing direkt durch process_frame_fast,
+gemessen werden Laufzeit je Frame und Trefferquote gegen die Labels.
+
+Aufruf:
+    python replay_face.py --frames recordings/lane_01 --known-faces known_faces --fps 7.5
+    python replay_face.py --video recordings/lane_02.mp4 --labels lane_02.json --output report.json
+    python replay_face.py --frames recordings/lane_01 --labels lane_01.json --policies fixed adaptive fast cascade
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import cv2
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+from recognition_pipeline import Frame, StageTimer
+
+class LocalMqttStub:
+    """Lokaler Ersatz für den MQTT-Broker: zeichnet Publishes nur auf"""
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.messages.append({'time': time.perf_counter(), 'topic': topic, 'payload': payload})
+
+    def is_connected(self):
+        return True
+
+class SocketIOStub:
+    """Lokaler Ersatz für Flask-SocketIO: zeichnet emit()-Aufrufe mit Zeitstempel auf"""
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def emit(self, event, data=None, **kwargs):
+        with self.lock:
+            self.events.append({'time': time.perf_counter(), 'event': event, 'data': data})
+
+    def count(self, event):
+        with self.lock:
+            return sum(1 for e in self.events if e['event'] == event)
+
+    def get(self, event):
+        with self.lock:
+            return [e for e in self.events if e['event'] == event]
+
+def load_replay_frames(frames_dir=None, video=None, jpeg_quality=50):
+    """
+    Lädt die Sequenz als (Frame-Schlüssel, Base64-JPEG) wie sie der Pi sendet.
+    JPEG-Dateien werden unverändert übernommen, Video-Frames wie im
+    stream_client.py mit Qualität 50 codiert.
+    """
+    frames = []
+    if video:
+        cap = cv2.VideoCapture(video)
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            if ok:
+                frames.append((str(index), base64.b64encode(buffer).decode('utf-8')))
+            index += 1
+        cap.release()
+    else:
+        for filename in sorted(os.listdir(frames_dir)):
+            if not filename.lower().endswith(('.jpg', '.jpeg')):
+                continue
+            with open(os.path.join(frames_dir, filename), 'rb') as f:
+                frames.append((filename, base64.b64encode(f.read()).decode('utf-8')))
+
+    print(f"✓ {len(frames)} Frames für Replay geladen")
+    return frames
+
+def prepare_server(known_faces_dir):
+    """
+    Importiert stream_server in einem temporären Arbeitsverzeichnis
+    (eigene DB, keine config.json -> Stripe Demo-Modus) und ersetzt MQTT/Socket.IO
+    """
+    workdir = tempfile.mkdtemp(prefix='face_replay_')
+    if known_faces_dir:
+        shutil.copytree(os.path.abspath(known_faces_dir), os.path.join(workdir, 'known_faces'))
+    os.chdir(workdir)
+
+    os.environ['FAY_MQTT_DISABLED'] = '1'
+    import stream_server as server
+
+    server.stripe.api_key = 'demo_key'
+    server.mqtt_client = LocalMqttStub()
+    server.socketio = SocketIOStub()
+    server.pipeline.timer = StageTimer()
+    server.detected_products_file = os.path.join(workdir, 'detected_products.txt')
+    server.clear_detected_products()
+
+    server.init_database()
+    server.load_known_faces()
+    print(f"✓ {len(server.known_face_names)} bekannte Gesichter: {server.known_face_names}")
+    return server, workdir
+
+def run_replay(server, frames, fps, labels, drain_timeout=30.0):
+    """Sendet die Frames mit fester Rate und wartet bis alle angenommenen verarbeitet sind"""
+    server.processing_active = True
+    worker = threading.Thread(target=server.background_processor, daemon=True)
+    worker.start()
+
+    interval = 1.0 / fps
+    first_seen = {}
+    dropped_before = server.frames_dropped
+    expired_before = server.pipeline.frames_expired
+    start_time = time.perf_counter()
+
+    for index, (key, image_b64) in enumerate(frames):
+        delay = start_time + index * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        name = labels.get(key)
+        if name and name not in first_seen:
+            first_seen[name] = time.perf_counter()
+
+        server.enqueue_frame(image_b64)
+
+    send_done = time.perf_counter()
+
+    # Warten bis alle nicht überschriebenen Frames ein recognition_result erzeugt haben
+    while (server.socketio.count('recognition_result') <
+           len(frames) - (server.frames_dropped - dropped_before) -
+           (server.pipeline.frames_expired - expired_before) and
+           time.perf_counter() - send_done < drain_timeout):
+        time.sleep(0.01)
+
+    end_time = time.perf_counter()
+    server.stop_processing()
+    worker.join(timeout=2)
+
+    processed = server.socketio.count('recognition_result')
+    elapsed = end_time - start_time
+
+    return {
+        'frames_sent': len(frames),
+        'frames_dropped': server.frames_dropped - dropped_before,
+        'frames_expired': server.pipeline.frames_expired - expired_before,
+        'frames_processed': processed,
+        'send_fps': fps,
+        'processed_fps': round(processed / elapsed, 2) if elapsed else 0.0,
+        'elapsed_s': round(elapsed, 2),
+        'stages': server.pipeline.timer.summary(),
+        'payment_dialogs': summarize_dialogs(server.socketio.get('payment_dialog'), first_seen, start_time),
+        'mqtt_messages': len(server.mqtt_client.messages)
+    }
+
+def summarize_dialogs(dialogs, first_seen, start_time):
+    """Anzahl und Zeit bis zum ersten payment_dialog je Identität"""
+    summary = {}
+    for dialog in dialogs:
+        name = dialog['data']['user_name']
+        entry = summary.setdefault(name, {'count': 0, 'first_dialog_ms': None, 'confidences': []})
+        entry['count'] += 1
+        entry['confidences'].append(round(float(dialog['data']['confidence']), 3))
+
+        if entry['first_dialog_ms'] is None:
+            reference = first_seen.get(name, start_time)
+            entry['first_dialog_ms'] = round((dialog['time'] - reference) * 1000, 1)
+            entry['reference'] = 'first_labelled_frame' if name in first_seen else 'replay_start'
+
+    for name in first_seen:
+        summary.setdefault(name, {'count': 0, 'first_dialog_ms': None, 'confidences': []})
+    return summary
+
+def compare_policies(server, frames, labels, policies):
+    """
+    Jede Policy auf allen Frames (ohne Pacing, ohne Pipeline): Laufzeit je Frame und
+    Trefferquote. Gelabelte Frames zählen als erkannt, wenn ein Gesicht gefunden wurde,
+    und als identifiziert, wenn eine Box den gelabelten Namen trägt. Boxen in
+    ungelabelten Frames und fremde Namen zählen als Fehler.
+    """
+    results = {}
+    for name in policies:
+        server.detection_policy = server.create_detection_policy(name)
+        server.identity_lanes.reset()
+        server.pipeline.timer = StageTimer()
+
+        latencies = []
+        counts = {'labelled': 0, 'detected': 0, 'identified': 0, 'false_detections': 0, 'wrong_identity': 0}
+        for key, image_b64 in frames:
+            start = time.perf_counter()
+            result = server.process_frame_fast(Frame(image_b64))
+            latencies.append(time.perf_counter() - start)
+
+            label = labels.get(key)
+            names = [face['name'] for face in result.get('faces', [])]
+            if label:
+                counts['labelled'] += 1
+                counts['detected'] += bool(names)
+                counts['identified'] += label in names
+            elif names:
+                counts['false_detections'] += 1
+            counts['wrong_identity'] += sum(1 for n in names if n not in ('Unbekannt', label))
+
+        latencies.sort()
+        labelled = counts['labelled']
+        results[name] = dict(
+            counts,
+            mean_ms=round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            p95_ms=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+            detection_rate=round(counts['detected'] / labelled, 3) if labelled else None,
+            identification_rate=round(counts['identified'] / labelled, 3) if labelled else None,
+            stages=server.pipeline.timer.summary(),
+            policy=server.detection_policy.get_stats()
+        )
+    return results
+
+def print_policy_comparison(results):
+    print(f"\n{'='*78}")
+    print("DETEKTIONS-POLICIES")
+    print(f"{'='*78}")
+    print(f"{'Policy':<12} | {'Ø ms':>7} | {'p95 ms':>7} | {'Erkannt':>7} | {'Ident.':>7} | "
+          f"{'Fehl':>4} | {'Falsch':>6} | Skalen")
+    print(f"{'-'*78}")
+    rate = lambda value: f"{value:.1%}" if value is not None else "-"
+    for name, r in results.items():
+        scales = ', '.join(f"1/{scale}: {count}" for scale, count in sorted(r['policy']['scales'].items()))
+        print(f"{name:<12} | {r['mean_ms']:>7} | {r['p95_ms']:>7} | {rate(r['detection_rate']):>7} | "
+              f"{rate(r['identification_rate']):>7} | {r['false_detections']:>4} | {r['wrong_identity']:>6} | {scales}")
+    print(f"{'='*78}")
+
+def print_summary(report):
+    print(f"\n{'='*60}")
+    print("FACE PIPELINE REPLAY")
+    print(f"{'='*60}")
+    print(f"Frames gesendet:    {report['frames_sent']} @ {report['send_fps']} FPS")
+    print(f"Frames verworfen:   {report['frames_dropped']} (von neuerem Frame überschrieben)")
+    print(f"Frames abgelaufen:  {report['frames_expired']} (älter als {server.FRAME_DEADLINE * 1000:.0f} ms)")
+    print(f"Frames verarbeitet: {report['frames_processed']} ({report['processed_fps']} FPS)")
+    print("\nStufen:")
+    for stage, stats in report['stages'].items():
+        print(f"   {stage:<12} {stats['count']:>6}x  Ø {stats['mean_ms']:>8.1f} ms  p95 {stats['p95_ms']:>8.1f} ms")
+    print("\nPayment-Dialoge:")
+    for name, entry in report['payment_dialogs'].items():
+        latency = f"{entry['first_dialog_ms']:.0f} ms" if entry['first_dialog_ms'] is not None else "nie"
+        print(f"   {name:<20} {entry['count']:>3}x  erster Dialog nach {latency}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay-Harness für die Gesichtserkennung")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--frames', help="Ordner mit aufgenommenen JPEG-Frames")
+    source.add_argument('--video', help="Videodatei mit aufgenommenen Frames")
+    parser.add_argument('--labels', help="JSON-Datei: Frame -> Identität")
+    parser.add_argument('--known-faces', default='known_faces', help="Ordner mit bekannten Gesichtern")
+    parser.add_argument('--fps', type=float, default=7.5, help="Sende-Rate (Pi: 15 FPS, jeder 2. Frame)")
+    parser.add_argument('--output', help="JSON-Report speichern")
+    parser.add_argument('--policies', nargs='+', help="Detektions-Policies vergleichen (z.B. fixed adaptive fast cascade)")
+    args = parser.parse_args()
+
+    # Pfade vor dem Wechsel ins temporäre Arbeitsverzeichnis auflösen
+    frames_dir = os.path.abspath(args.frames) if args.frames else None
+    video = os.path.abspath(args.video) if args.video else None
+    output = os.path.abspath(args.output) if args.output else None
+
+    labels = {}
+    if args.labels:
+        with open(args.labels, 'r', encoding='utf-8') as f:
+            labels = {str(k): v for k, v in json.load(f).items()}
+
+    frames = load_replay_frames(frames_dir, video)
+    server, workdir = prepare_server(args.known_faces)
+
+    try:
+        if args.policies:
+            report = {'policies': compare_policies(server, frames, labels, args.policies)}
+        else:
+            report = run_replay(server, frames, args.fps, labels)
+        report['created'] = datetime.now().isoformat()
+        report['source'] = video or frames_dir
+        if args.policies:
+            print_policy_comparison(report['policies'])
+        else:
+            print_summary(report)
+
+        if output:
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"\n📄 Report gespeichert: {output}")
+    finally:
+        os.chdir(SCRIPT_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
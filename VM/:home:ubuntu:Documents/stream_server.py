@@ -1,9 +1,8 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
 import face_recognition
 import numpy as np
 import cv2
-import base64
 import os
 import threading
 import time
@@ -13,6 +12,8 @@ from collections import deque
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import stripe
+from recognition_pipeline import (AdmissionController, LatestFrameSlot, RecognitionPipeline,
+                                  Recognizer, frame_bytes)
 import paho.mqtt.client as mqtt
 import threading
 import time
@@ -32,12 +33,16 @@ stripe.api_key = config.get('stripe', {}).get('secret_key', 'demo_key')
 STRIPE_PUBLISHABLE_KEY = config.get('stripe', {}).get('publishable_key', 'demo_key')
 
 # MQTT Configuration
-MQTT_BROKER = "141.72.12.186"
+MQTT_BROKER = os.environ.get('FAY_MQTT_BROKER', "141.72.12.186")
 MQTT_PORT = 1883
 def init_mqtt():
     """MQTT Client initialisieren"""
+    if os.environ.get('FAY_MQTT_DISABLED') == '1':
+        print("MQTT deaktiviert (FAY_MQTT_DISABLED=1)")
+        return None
+    
     try:
-        client = mqtt.Client()
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)  # keine Callbacks
         client.connect(MQTT_BROKER, MQTT_PORT, 60)
         client.loop_start()
         print(f"MQTT Client verbunden mit {MQTT_BROKER}:{MQTT_PORT}")
@@ -59,6 +64,31 @@ app.config['SECRET_KEY'] = 'face_recognition_secret'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
 
+# Versand-Naht für Socket.IO: im Standardbetrieb Flask-SocketIO, im Async-Modus
+# (async_server.py) setzt dieser broadcast_hook und reply_target.sid, dann landen
+# alle Events in einer asyncio-Queue des AsyncServers.
+broadcast_hook = None
+reply_target = threading.local()
+
+def broadcast(event, data=None, local=False):
+    """Event an alle verbundenen Clients (auch aus Hintergrund-Threads).
+    local=True: nur an Clients dieses Prozesses, nicht über die Message-Queue
+    an die anderen Worker (cluster_server.py)"""
+    if broadcast_hook:
+        broadcast_hook(event, data, local=local)
+    elif local:
+        socketio.emit(event, data, ignore_queue=True)
+    else:
+        socketio.emit(event, data)
+
+def reply(event, data=None):
+    """Antwort nur an den Client, dessen Event gerade verarbeitet wird"""
+    sid = getattr(reply_target, 'sid', None)
+    if broadcast_hook and sid is not None:
+        broadcast_hook(event, data, to=sid)
+    else:
+        emit(event, data)
+
 mqtt_client = init_mqtt()
 
 def send_payment_result_to_esp(success, user_name=None):
@@ -84,18 +114,236 @@ def send_payment_result_to_esp(success, user_name=None):
 known_face_encodings = []
 known_face_names = []
 current_recognition = {'face_recognized': False, 'user_name': 'Warte...', 'confidence': 0}
-processing_queue = deque(maxlen=3)
 processing_active = True
+frames_dropped = 0
+# Hot-Standby: mqtt_monitor.py hält Gesichts- und Produkterkennung warm und schaltet
+# nur den aktiven Modus um (POST /control/active). Standalone-Start bleibt aktiv.
+SERVER_PORT = int(os.environ.get('FAY_PORT', 5000))
+service_active = os.environ.get('FAY_START_ACTIVE', '1') == '1'
+redirect_url = None  # Aktiver Dienst, an den ein inaktiver Server den Pi weiterleitet
+# Mehrprozess-Betrieb (cluster_server.py): Worker-Nummer und MQTT-Bus für gemeinsamen Zustand
+WORKER_ID = int(os.environ.get('FAY_WORKER_ID', 0))
+cluster_bus = None
+# Frames gehen nur über den Bus, solange ein anderer Worker Viewer meldet (Lease in Sekunden)
+VIEWER_LEASE = 10.0
+remote_viewers_until = 0.0
+viewer_lease_sent = 0.0
+frame_hook = None  # async_server: weckt wartende MJPEG-Tasks bei Frames anderer Worker
+frame_scratch = {}  # Wiederverwendete Zwischenpuffer der Frame-Aufbereitung
+# Ältere Frames (ab Aufnahme auf dem Pi) werden vor dem Decode verworfen (0 = aus)
+FRAME_DEADLINE = float(os.environ.get('FAY_FRAME_DEADLINE_MS', 500)) / 1000
+# Identität je Spur: gemittelte Konfidenz und Mindest-Evidenz (Summe der Größengewichte)
+IDENTITY_THRESHOLD = float(os.environ.get('FAY_IDENTITY_THRESHOLD', 0.6))
+IDENTITY_EVIDENCE = float(os.environ.get('FAY_IDENTITY_EVIDENCE', 1.5))
+# Detektions-Policy (Preset aus DETECTION_PRESETS, Upsample optional überschreiben)
+# Standard bleibt 'fixed', bis replay_face.py --policies auf echten Aufnahmen etwas anderes belegt
+DETECTION_POLICY = os.environ.get('FAY_DETECT_POLICY', 'fixed')
+DETECTION_UPSAMPLE = os.environ.get('FAY_DETECT_UPSAMPLE')
+
+class ViewerStream:
+    """
+    MJPEG-Ausgabe für das Dashboard (/video_stream, /video_feed).
+    Hält nur den zuletzt empfangenen Frame. Gerendert (ROI-Ausschnitt einsetzen,
+    Gesichtsboxen zeichnen, JPEG codieren) wird nur wenn jemand zuschaut und
+    höchstens einmal pro Frame - alle Viewer teilen sich dasselbe JPEG.
+    Ohne ROI und ohne Boxen wird das JPEG vom Pi unverändert durchgereicht.
+    """
+    BOX_COLORS = ((0.7, (80, 175, 76)), (0.4, (0, 152, 255)), (-1.0, (54, 67, 244)))  # BGR wie im Dashboard
+
+    def __init__(self, overlay=True, jpeg_quality=70):
+        self.overlay = overlay            # Boxen serverseitig einzeichnen
+        self.jpeg_quality = jpeg_quality
+        self.condition = threading.Condition()
+        self.render_lock = threading.Lock()
+        self.raw = None                   # (JPEG-Bytes, roi) wie vom Pi empfangen
+        self.seq = 0
+        self.rendered = (0, None)         # (seq, JPEG-Bytes) des zuletzt gerenderten Frames
+        self.base_jpeg = None             # Letzter ganzer Frame (Hintergrund für ROI-Ausschnitte)
+        self.base_source = None           # JPEG, aus dem base_frame decodiert wurde
+        self.base_frame = None            # ... bei Bedarf decodiert (nur unter render_lock)
+        self.viewers = 0
+        self.frames_rendered = 0
+        self.frames_encoded = 0
+
+    def publish(self, jpeg_bytes, roi=None):
+        """Neuer Frame vom Pi - kostet nichts, solange niemand zuschaut"""
+        with self.condition:
+            self.raw = (jpeg_bytes, roi)
+            self.seq += 1
+            if not roi:
+                self.base_jpeg = jpeg_bytes
+            self.condition.notify_all()
+
+    def subscribe(self):
+        with self.condition:
+            self.viewers += 1
+            return self.viewers
+
+    def unsubscribe(self):
+        with self.condition:
+            self.viewers = max(0, self.viewers - 1)
+            return self.viewers
+
+    def wait_frame(self, last_seq, timeout=None):
+        """Wartet auf einen Frame neuer als last_seq, gibt (JPEG, seq) oder (None, last_seq) zurück"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq, timeout):
+                return None, last_seq
+            seq, raw = self.seq, self.raw
+        return self.render(seq, raw), seq
+
+    def latest(self):
+        """Aktueller Frame als JPEG (für Einzelbild-Abruf) oder None"""
+        with self.condition:
+            seq, raw = self.seq, self.raw
+        return self.render(seq, raw) if raw else None
+
+    def render(self, seq, raw):
+        with self.render_lock:
+            if self.rendered[0] >= seq:
+                return self.rendered[1]
+
+            jpeg_bytes, roi = raw
+            faces = current_recognition.get('faces', []) if self.overlay else []
+            if not roi and not faces:
+                output = jpeg_bytes
+            else:
+                frame = self.compose(jpeg_bytes, roi)
+                if frame is None:
+                    return self.rendered[1]
+                for face in faces:
+                    self.draw_face(frame, face)
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if not ok:
+                    return self.rendered[1]
+                output = buffer.tobytes()
+                self.frames_encoded += 1
+
+            self.rendered = (seq, output)
+            self.frames_rendered += 1
+            return output
+
+    def compose(self, jpeg_bytes, roi):
+        """Ganzer Frame (Kopie) bzw. ROI-Ausschnitt auf den letzten ganzen Frame gesetzt"""
+        image = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None or not roi:
+            return image
+
+        shape = (int(roi['frame_height']), int(roi['frame_width']), 3)
+        with self.condition:
+            base_jpeg = self.base_jpeg
+        if self.base_source is not base_jpeg:
+            self.base_source = base_jpeg
+            self.base_frame = cv2.imdecode(np.frombuffer(base_jpeg, np.uint8), cv2.IMREAD_COLOR) if base_jpeg else None
+        if self.base_frame is None or self.base_frame.shape != shape:
+            self.base_frame = np.zeros(shape, dtype=np.uint8)
+
+        # Ausschnitt bleibt im Hintergrund stehen, bis wieder ein ganzer Frame kommt
+        top, left = int(roi['top']), int(roi['left'])
+        height = min(image.shape[0], shape[0] - top)
+        width = min(image.shape[1], shape[1] - left)
+        self.base_frame[top:top + height, left:left + width] = image[:height, :width]
+        return self.base_frame.copy()
+
+    def draw_face(self, frame, face):
+        box = face['box']
+        confidence = float(face.get('confidence', 0))
+        color = next(c for threshold, c in self.BOX_COLORS if confidence > threshold)
+        cv2.rectangle(frame, (box['left'], box['top']), (box['right'], box['bottom']), color, 2)
+        label = f"{face.get('name', 'Unbekannt')} ({confidence * 100:.0f}%)"
+        cv2.putText(frame, label, (box['left'], max(12, box['top'] - 6)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'viewers': self.viewers,
+                'frames_received': self.seq,
+                'frames_rendered': self.frames_rendered,
+                'frames_encoded': self.frames_encoded,
+                'overlay': self.overlay
+            }
+
+frame_slot = LatestFrameSlot()
+admission = AdmissionController()
+viewer_stream = ViewerStream(overlay=os.environ.get('FAY_STREAM_OVERLAY', '1') == '1')
+
+def share_state(kind, data):
+    """Zustand an die anderen Worker melden (nur im Mehrprozess-Betrieb)"""
+    if cluster_bus:
+        cluster_bus.publish(kind, data)
+
+def keep_viewer_lease():
+    """Viewer an diesem Worker melden, damit der Worker mit dem Pi seine Frames teilt"""
+    global viewer_lease_sent
+    now = time.time()
+    if cluster_bus and now - viewer_lease_sent > VIEWER_LEASE / 2:
+        viewer_lease_sent = now
+        share_state('viewers', {'worker': WORKER_ID})
+
+def share_frame(jpeg_bytes, roi):
+    """Frame an die anderen Worker, falls dort gerade jemand zuschaut"""
+    if cluster_bus and time.time() < remote_viewers_until:
+        cluster_bus.publish_frame(jpeg_bytes, roi)
+
+def record_stage(stage, start_time):
+    """Meldet die Laufzeit einer Verarbeitungsstufe seit start_time"""
+    pipeline.timer.add(stage, time.perf_counter() - start_time)
+
+def scratch_buffer(name, shape):
+    """Liefert einen wiederverwendbaren uint8-Puffer, neu angelegt nur bei geänderter Größe"""
+    buffer = frame_scratch.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, np.uint8)
+        frame_scratch[name] = buffer
+    return buffer
+
+def enqueue_frame(image_b64, roi=None, captured_at=None):
+    """
+    Nimmt einen Frame (optional als Gesichtsausschnitt mit roi vom Pi) zur Erkennung an.
+    Ein noch nicht verarbeiteter älterer Frame wird ersetzt und als verworfen
+    gezählt (Rückgabe False). captured_at: Aufnahmezeitpunkt laut Pi (Deadline).
+    """
+    global frames_dropped
+    
+    if pipeline.submit(image_b64, roi, captured_at):
+        return True
+    
+    frames_dropped += 1
+    return False
 
 # KORRIGIERTE Product Integration Variablen
 detected_products_file = "/home/ubuntu/Documents/product_recog/detected_products.txt"
 current_detected_products = []
+# Kombinierter Betrieb (combined_server.py): Warenkorb direkt aus der Session der
+# Produkterkennung im selben Prozess statt aus der Produktdatei.
+# Erwartet products(), signature() und clear().
+product_source = None
+
+PRODUCT_DISPLAY_NAMES = {
+    "Product_0": "Baeren Marken Milch",
+    "Product_1": "Vitalis Muesli 500g"
+}
 
 def load_detected_products():
     """Lädt erkannte Produkte aus der Textdatei (ALLE PRODUKTE, keine Zeitstempel-Filterung)"""
     global current_detected_products
     
     try:
+        if product_source is not None:
+            products = product_source.products()
+            current_detected_products = products
+            total_value = sum(p['price_euro'] for p in products)
+            print(f"📦 {len(products)} Produkte aus der Erkennungs-Session, Gesamtwert: {total_value:.2f}€")
+            return {
+                'products': products,
+                'total_value': round(total_value, 2),
+                'product_count': len(products),
+                'last_updated': datetime.now().isoformat(),
+                'status': 'loaded',
+                'source_file': None
+            }
+        
         if os.path.exists(detected_products_file):
             print(f"📦 Lade ALLE Produktdaten aus: {detected_products_file}")
             
@@ -118,11 +366,7 @@ def load_detected_products():
                 if len(parts) >= 4:
                     try:
                         timestamp_str = parts[0]
-                        product_name = parts[1]
-                        if product_name == "Product_0":
-                            product_name = "Baeren Marken Milch"
-                        elif product_name == "Product_1":
-                            product_name = "Vitalis Muesli 500g"
+                        product_name = PRODUCT_DISPLAY_NAMES.get(parts[1], parts[1])
                         price_str = parts[2].replace('€', '').strip()
                         confidence_str = parts[3].replace('%', '').strip()
                         model_id = parts[4] if len(parts) > 4 else 'Unknown'
@@ -181,6 +425,12 @@ def clear_detected_products():
     try:
         current_detected_products = []
         
+        if product_source is not None:
+            product_source.clear()
+            print("🔄 Erkannte Produkte gelöscht")
+            cart.refresh(force=True)
+            return True
+        
         # Schreibe leere Datei mit Header
         empty_content = """=== ERKANNTE PRODUKTE MIT PREISEN ===
 Format: Zeitstempel | Produktname | Preis(€) | Konfidenz(%) | Model-ID
@@ -191,6 +441,7 @@ Format: Zeitstempel | Produktname | Preis(€) | Konfidenz(%) | Model-ID
             f.write(empty_content)
         
         print("🔄 Erkannte Produkte gelöscht")
+        cart.refresh(force=True)
         return True
     except Exception as e:
         print(f"Fehler beim Löschen der Produktdaten: {e}")
@@ -198,12 +449,13 @@ Format: Zeitstempel | Produktname | Preis(€) | Konfidenz(%) | Model-ID
 
 def get_current_cart_summary():
     """Gibt eine Zusammenfassung des aktuellen Warenkorbs zurück"""
-    if not current_detected_products:
-        load_detected_products()
-    
-    # Gruppiere identische Produkte
+    cart.refresh()  # Parst nur, wenn sich die Produktdatei geändert hat
+    return summarize_products(current_detected_products)
+
+def summarize_products(products):
+    """Gruppiert identische Produkte mit Anzahl, Summe und mittlerer Konfidenz"""
     product_groups = {}
-    for product in current_detected_products:
+    for product in products:
         key = product['name']
         if key not in product_groups:
             product_groups[key] = {
@@ -226,11 +478,136 @@ def get_current_cart_summary():
     
     return {
         'groups': list(product_groups.values()),
-        'total_items': len(current_detected_products),
+        'total_items': len(products),
         'unique_products': len(product_groups),
-        'total_value': sum(p['price_euro'] for p in current_detected_products)
+        'total_value': sum(p['price_euro'] for p in products)
     }
 
+class CartState:
+    """
+    Versionierter Warenkorb für alle Dashboards.
+    Die Produktdatei wird nur neu geparst, wenn sich mtime/Größe geändert haben.
+    Jede Änderung wird als Delta (hinzugefügt, entfernt, Summen) mit fortlaufender
+    Version per 'cart_delta' an alle Clients gepusht. Nach einem Reconnect holt
+    sich ein Client mit seiner letzten Version die fehlenden Deltas ('cart_sync'),
+    bzw. einen Snapshot, falls sie nicht mehr in der Historie liegen.
+    """
+    def __init__(self, history_size=50):
+        self.lock = threading.RLock()
+        self.version = 0
+        self.items = {}                   # Schlüssel -> Produkt, Reihenfolge wie in der Datei
+        self.load_status = 'not_loaded'
+        self.last_updated = None
+        self.file_signature = None
+        self.history = deque(maxlen=history_size)
+        self.parses = 0
+
+    def refresh(self, force=False):
+        """Prüft die Produktdatei und pusht bei Änderung ein Delta (Rückgabe: Delta oder None)"""
+        try:
+            if product_source is not None:
+                signature = product_source.signature()
+            else:
+                stat = os.stat(detected_products_file)
+                signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        
+        with self.lock:
+            if not force and self.parses and signature == self.file_signature:
+                return None
+            self.file_signature = signature
+            data = load_detected_products()
+            self.parses += 1
+            delta = self.apply(data)
+        
+        if delta:
+            # Jeder Worker pusht seine eigenen Versionen nur an seine Clients
+            broadcast('cart_delta', delta, local=True)
+        return delta
+
+    def apply(self, data):
+        """Vergleicht den geparsten Stand mit dem bisherigen und erzeugt das Delta"""
+        self.load_status = data.get('status', 'unknown')
+        self.last_updated = data.get('last_updated', datetime.now().isoformat())
+        
+        # Gleiche Produkt-ID (Name + Sekunde) kann mehrfach vorkommen -> laufender Index
+        items, seen = {}, {}
+        for product in data.get('products', []):
+            index = seen.get(product['id'], 0)
+            seen[product['id']] = index + 1
+            key = f"{product['id']}#{index}"
+            items[key] = dict(product, key=key)
+        
+        added = [product for key, product in items.items() if key not in self.items]
+        removed = [key for key in self.items if key not in items]
+        self.items = items
+        if not added and not removed:
+            return None
+        
+        self.version += 1
+        delta = {
+            'version': self.version,
+            'base_version': self.version - 1,
+            'added': added,
+            'removed': removed,
+            **self.totals(),
+            'timestamp': datetime.now().strftime("%H:%M:%S")
+        }
+        self.history.append(delta)
+        print(f"🛒 Warenkorb v{self.version}: +{len(added)} / -{len(removed)}, "
+              f"{delta['product_count']} Produkte, {delta['total_value']}€")
+        return delta
+
+    def totals(self):
+        products = list(self.items.values())
+        return {
+            'total_value': round(sum(p['price_euro'] for p in products), 2),
+            'product_count': len(products),
+            'summary': summarize_products(products)
+        }
+
+    def status(self):
+        """Aktueller Stand im Format von load_detected_products (plus Version)"""
+        self.refresh()
+        with self.lock:
+            return {
+                'products': list(self.items.values()),
+                'total_value': self.totals()['total_value'],
+                'product_count': len(self.items),
+                'last_updated': self.last_updated,
+                'status': self.load_status,
+                'version': self.version
+            }
+
+    def sync(self, since_version):
+        """Fehlende Deltas seit since_version, sonst ein vollständiger Snapshot"""
+        self.refresh()
+        with self.lock:
+            if since_version == self.version:
+                return {'version': self.version, 'deltas': []}
+            if (isinstance(since_version, int) and self.history and
+                    self.history[0]['base_version'] <= since_version < self.version):
+                return {
+                    'version': self.version,
+                    'deltas': [d for d in self.history if d['version'] > since_version]
+                }
+            return {
+                'version': self.version,
+                'snapshot': {'products': list(self.items.values()), **self.totals()}
+            }
+
+cart = CartState()
+
+def cart_watcher(interval=1.0):
+    """Prüft die Produktdatei (nur stat, Parse nur bei Änderung) und pusht Deltas"""
+    while processing_active:
+        try:
+            cart.refresh()
+        except Exception as e:
+            print(f"Warenkorb-Watcher Fehler: {e}")
+        time.sleep(interval)
+
 # Datenbank Setup
 def init_database():
     """Erstellt User- und Payment-Tabellen"""
@@ -264,10 +641,36 @@ def init_database():
         )
     ''')
     
+    # Letzter Payment-Dialog je Person (gemeinsam für alle Worker)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_triggers (
+            user_name TEXT PRIMARY KEY,
+            triggered_at REAL NOT NULL
+        )
+    ''')
+    
     conn.commit()
     conn.close()
     print("Datenbank initialisiert")
 
+def claim_payment_trigger(user_name, now, window=30):
+    """Darf dieser Prozess den Payment-Dialog auslösen? Im Mehrprozess-Betrieb
+    gewinnt genau ein Worker pro Person und Zeitfenster (SQLite serialisiert)"""
+    if cluster_bus is None:
+        return True
+    
+    conn = sqlite3.connect('face_payments.db', timeout=5)
+    try:
+        cursor = conn.execute('''
+            INSERT INTO payment_triggers (user_name, triggered_at) VALUES (?, ?)
+            ON CONFLICT(user_name) DO UPDATE SET triggered_at = excluded.triggered_at
+            WHERE payment_triggers.triggered_at <= ?
+        ''', (user_name, now, now - window))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
 def get_user_payment_info(name):
     """Holt Payment-Info für einen User"""
     conn = sqlite3.connect('face_payments.db')
@@ -413,6 +816,9 @@ def load_known_faces():
                     print(f"Geladen: {name}")
             except Exception as e:
                 print(f"Fehler bei {filename}: {e}")
+    
+    # Entscheidungen gegen die alten Gesichter verwerfen
+    identity_lanes.reset()
 
 # Werte senden
 def mqtt_confidence_sender():
@@ -429,104 +835,370 @@ def mqtt_confidence_sender():
             print(f"Auto-MQTT Fehler: {e}")
             time.sleep(30)
 
-def background_processor():
-    """Hintergrund-Thread für Gesichtserkennung MIT Product-Anzeige"""
-    global current_recognition, processing_active, current_detected_products
-    last_payment_trigger = {}
-    last_product_check = 0
+last_payment_trigger = {}  # Person -> Zeitpunkt des letzten Payment-Dialogs
+
+def on_face_result(stage, result, frame):
+    """Ergebnis der Gesichtsstufe: Payment-Dialog auslösen und an alle Clients senden"""
+    global current_recognition
+    current_recognition = result
+    share_state('recognition', result)
     
-    while processing_active:
-        try:
-            if processing_queue:
-                image_b64 = processing_queue.popleft()
-                result = process_frame_fast(image_b64)
-                current_recognition = result
-                
-                # Alle 5 Sekunden Produktdaten neu laden
-                current_time = time.time()
-                if current_time - last_product_check > 5:
-                    product_data = load_detected_products()
-                    if product_data['product_count'] > 0:
-                        print(f"🛒 Warenkorb-Update: {product_data['product_count']} Produkte, {product_data['total_value']}€")
-                        
-                        # Sende Warenkorb-Update an alle Clients
-                        socketio.emit('cart_update', {
-                            'products': current_detected_products,
-                            'total_value': product_data['total_value'],
-                            'product_count': product_data['product_count'],
-                            'summary': get_current_cart_summary(),
-                            'timestamp': datetime.now().strftime("%H:%M:%S")
-                        })
-                    
-                    last_product_check = current_time
+    # Warenkorb-Änderungen pusht cart_watcher als Delta
+    current_time = time.time()
+    
+    # PAYMENT DIALOG TRIGGER bei erfolgreicher Gesichtserkennung
+    if result['face_recognized'] and result['confidence'] > 0.6:
+        user_name = result['user_name']
+        confidence = result['confidence']
+        
+        # Nur alle 30 Sekunden Payment-Dialog für gleiche Person
+        if (user_name not in last_payment_trigger or
+                current_time - last_payment_trigger[user_name] > 30) and \
+                claim_payment_trigger(user_name, current_time):
+            
+            print(f"FACE ERKANNT: {user_name}! ({confidence:.1%})")
+            
+            # Aktuelle Warenkorb-Daten holen
+            product_data = cart.status()
+            
+            # Standard Payment-Dialog senden
+            broadcast('payment_dialog', {
+                'user_name': user_name,
+                'confidence': confidence,
+                'default_amount': get_user_default_amount(user_name),
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'source': 'face_recognition',
+                'has_products': product_data['product_count'] > 0,
+                'products': current_detected_products,
+                'total_value': product_data['total_value'],
+                'summary': get_current_cart_summary()
+            })
+            
+            # Zusätzlich: Product Payment Info senden (falls Produkte erkannt)
+            if current_detected_products:
+                summary = get_current_cart_summary()
                 
-                # PAYMENT DIALOG TRIGGER bei erfolgreicher Gesichtserkennung
-                if result['face_recognized'] and result['confidence'] > 0.6:
-                    user_name = result['user_name']
-                    confidence = result['confidence']
-                    
-                    # Nur alle 30 Sekunden Payment-Dialog für gleiche Person
-                    if user_name not in last_payment_trigger or \
-                       current_time - last_payment_trigger[user_name] > 30:
-                        
-                        print(f"FACE ERKANNT: {user_name}! ({confidence:.1%})")
-                        
-                        # Aktuelle Warenkorb-Daten holen
-                        product_data = load_detected_products()
-                        
-                        # Standard Payment-Dialog senden
-                        socketio.emit('payment_dialog', {
-                            'user_name': user_name,
-                            'confidence': confidence,
-                            'default_amount': get_user_default_amount(user_name),
-                            'timestamp': datetime.now().strftime("%H:%M:%S"),
-                            'source': 'face_recognition',
-                            'has_products': product_data['product_count'] > 0,
-                            'products': current_detected_products,
-                            'total_value': product_data['total_value'],
-                            'summary': get_current_cart_summary()
-                        })
-                        
-                        # Zusätzlich: Product Payment Info senden (falls Produkte erkannt)
-                        if current_detected_products:
-                            summary = get_current_cart_summary()
-                            
-                            print(f"💰 Erkannte Produkte verfügbar: {summary['unique_products']} verschiedene Produkte")
-                            
-                            socketio.emit('products_available', {
-                                'user_name': user_name,
-                                'products': current_detected_products,
-                                'total_value': product_data['total_value'],
-                                'product_count': product_data['product_count'],
-                                'summary': summary,
-                                'message': f'{summary["unique_products"]} verschiedene Produkte - {product_data["total_value"]}€',
-                                'timestamp': datetime.now().strftime("%H:%M:%S")
-                            })
-                        
-                        last_payment_trigger[user_name] = current_time
+                print(f"💰 Erkannte Produkte verfügbar: {summary['unique_products']} verschiedene Produkte")
                 
-                # Ergebnis an alle Clients senden
-                socketio.emit('recognition_result', result)
-            else:
-                time.sleep(0.05)
+                broadcast('products_available', {
+                    'user_name': user_name,
+                    'products': current_detected_products,
+                    'total_value': product_data['total_value'],
+                    'product_count': product_data['product_count'],
+                    'summary': summary,
+                    'message': f'{summary["unique_products"]} verschiedene Produkte - {product_data["total_value"]}€',
+                    'timestamp': datetime.now().strftime("%H:%M:%S")
+                })
+            
+            last_payment_trigger[user_name] = current_time
+    
+    # Ergebnis an alle Clients senden
+    broadcast('recognition_result', result)
+
+def background_processor():
+    """Hintergrund-Thread: schläft bis ein Frame kommt (kein Polling) und gibt ihn durch die Pipeline"""
+    while processing_active:
+        try:
+            pipeline.step()
         except Exception as e:
             print(f"Processing error: {e}")
             time.sleep(0.1)
 
-def process_frame_fast(image_b64):
-    """Optimierte Gesichtserkennung mit Bounding Boxes"""
+def stop_processing():
+    """Hintergrund-Threads beenden - der wartende Erkennungs-Thread wird geweckt"""
+    global processing_active
+    processing_active = False
+    pipeline.wake()
+
+def roi_face_locations(roi, shape):
+    """Gesichtsboxen des Pi (relativ zum Ausschnitt) auf den Ausschnitt begrenzen"""
+    height, width = shape[:2]
+    locations = []
+    for top, right, bottom, left in roi.get('faces', []):
+        top, bottom = max(0, int(top)), min(height, int(bottom))
+        left, right = max(0, int(left)), min(width, int(right))
+        if bottom > top and right > left:
+            locations.append((top, right, bottom, left))
+    return locations
+
+def box_iou(a, b):
+    """Überlappung zweier Boxen (top, right, bottom, left)"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - inter
+    return inter / union if union > 0 else 0.0
+
+class IdentityLanes:
+    """
+    Identitäts-Entscheidung je Spur statt je Frame.
+    Eine Spur ist ein Gesicht, das über die Frames per Box-Überlappung verfolgt
+    wird. Die Treffer einer Spur werden gewichtet gemittelt: große (nahe)
+    Gesichter zählen mehr, ältere Frames klingen exponentiell ab, Frames ohne
+    Treffer ziehen den Mittelwert nach unten. Entschieden wird, sobald der
+    Mittelwert für eine Person über threshold liegt und genug Evidenz gesammelt
+    ist (min_evidence: Summe der Größengewichte). Danach wird die Spur nicht
+    mehr encodiert, bis sie verloren geht (max_missed Frames ohne Box).
+    """
+    def __init__(self, threshold=0.6, min_evidence=1.5, decay=0.7, full_weight_height=120,
+                 min_weight=0.25, iou_threshold=0.3, max_missed=3):
+        self.threshold = threshold
+        self.min_evidence = min_evidence
+        self.decay = decay
+        self.full_weight_height = full_weight_height  # Gesichtshöhe (px im ganzen Frame) mit Gewicht 1
+        self.min_weight = min_weight
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.lanes = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.stats = {'encoded': 0, 'encode_skipped': 0, 'decisions': 0, 'lanes_lost': 0}
+
+    def reset(self):
+        """Alle Spuren verwerfen (z.B. nach Änderung der bekannten Gesichter)"""
+        with self.lock:
+            self.lanes = []
+
+    def assign(self, boxes):
+        """Ordnet die Boxen dieses Frames Spuren zu (neue Spur ohne Überlappung),
+        gibt die Spur je Box zurück"""
+        with self.lock:
+            free = list(self.lanes)
+            assigned = []
+            for box in boxes:
+                lane = max(free, key=lambda l: box_iou(l['box'], box), default=None)
+                if lane is not None and box_iou(lane['box'], box) >= self.iou_threshold:
+                    free.remove(lane)
+                else:
+                    lane = {'id': self.next_id, 'scores': {}, 'weight': 0.0, 'evidence': 0.0,
+                            'candidate': None, 'fused': 0.0, 'identity': None}
+                    self.next_id += 1
+                lane['box'] = box
+                lane['missed'] = 0
+                assigned.append(lane)
+            
+            for lane in free:
+                lane['missed'] += 1
+            kept = [lane for lane in free if lane['missed'] <= self.max_missed]
+            self.stats['lanes_lost'] += len(free) - len(kept)
+            self.lanes = assigned + kept
+            return assigned
+
+    def observe(self, lane, name, confidence):
+        """Treffer eines Frames (name None: kein bekanntes Gesicht) in die Spur einrechnen"""
+        top, _, bottom, _ = lane['box']
+        weight = min(1.0, max(self.min_weight, (bottom - top) / self.full_weight_height))
+        
+        scores = lane['scores']
+        for key in scores:
+            scores[key] *= self.decay
+        if name:
+            scores[name] = scores.get(name, 0.0) + weight * confidence
+        lane['weight'] = lane['weight'] * self.decay + weight
+        lane['evidence'] += weight
+        self.stats['encoded'] += 1
+        
+        if scores:
+            best = max(scores, key=scores.get)
+            lane['candidate'] = best
+            lane['fused'] = scores[best] / lane['weight']
+            if lane['fused'] > self.threshold and lane['evidence'] >= self.min_evidence:
+                lane['identity'] = best
+                self.stats['decisions'] += 1
+                print(f"🧭 Spur {lane['id']}: {best} entschieden ({lane['fused']:.1%}, "
+                      f"Evidenz {lane['evidence']:.1f})")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, lanes=len(self.lanes),
+                        decided=sum(1 for lane in self.lanes if lane['identity']))
+
+identity_lanes = IdentityLanes(threshold=IDENTITY_THRESHOLD, min_evidence=IDENTITY_EVIDENCE)
+
+class DetectionPolicy:
+    """
+    Wie Gesichter gefunden und encodiert werden.
+    model: 'hog', 'cnn' (dlib CNN, auf CPU langsam) oder 'cascade' (Haar-Cascade
+    sucht Kandidaten, HOG prüft nur deren Umgebung).
+    adaptive: ohne Gesicht fest 1/reduce wie 'fixed' (bei Back-Pressure verkleinert
+    schon der Pi). Solange Gesichter im Bild sind, so viel gröber, dass das kleinste
+    noch erkannt wird (HOG-Fenster 80 px, je Upsample halbiert), aber nicht unter
+    track_width Pixel Breite. Nie feiner als 1/reduce.
+    full_res_encode: Encodings aus dem Frame in voller Auflösung statt aus dem
+    verkleinerten Detektionsbild (genauer, kostet einen zweiten Decode nur wenn
+    eine Spur noch nicht entschieden ist).
+    use_pi_boxes: Gesichtsboxen des Pi (ROI) übernehmen und nicht selbst detektieren.
+    """
+    SCALES = (4, 2, 1)
+    HOG_WINDOW = 80
+    
+    def __init__(self, model='hog', upsample=1, adaptive=True, reduce=2, track_width=120,
+                 full_res_encode=True, use_pi_boxes=True, face_memory=3):
+        self.model = model
+        self.upsample = upsample
+        self.adaptive = adaptive
+        self.reduce = reduce
+        self.track_width = track_width
+        self.full_res_encode = full_res_encode
+        self.use_pi_boxes = use_pi_boxes
+        self.face_memory = face_memory  # Frames, die die letzte Gesichtsgröße gilt
+        self.frame_width = None
+        self.face_height = None
+        self.face_age = 0
+        self.cascade = None
+        self.stats = {'frames': 0, 'scales': {}, 'cascade_candidates': 0, 'cascade_rejected': 0,
+                      'full_res_encodes': 0}
+        
+        if model == 'cascade':
+            cascade_file = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+            cascade = cv2.CascadeClassifier(cascade_file)
+            if cascade.empty():
+                print(f"⚠️ Haar-Cascade nicht ladbar: {cascade_file} - nur HOG")
+                self.model = 'hog'
+            else:
+                self.cascade = cascade
+    
+    @property
+    def min_face(self):
+        """Kleinste erkennbare Gesichtshöhe im Detektionsbild"""
+        return self.HOG_WINDOW / 2 ** self.upsample
+    
+    def detect_reduce(self):
+        """Verkleinerung des Frames für die Detektion"""
+        if not self.adaptive or not self.frame_width or not self.face_height:
+            return self.reduce
+        for reduce in self.SCALES:
+            if reduce <= self.reduce:
+                break
+            if self.frame_width / reduce >= self.track_width and self.face_height / reduce >= self.min_face:
+                return reduce
+        return self.reduce
+    
+    def locate(self, rgb):
+        """Gesichtsboxen (top, right, bottom, left) im übergebenen Bild"""
+        self.stats['frames'] += 1
+        if self.model == 'cascade':
+            return self.locate_cascade(rgb)
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample,
+                                               model=self.model)
+    
+    def locate_cascade(self, rgb):
+        """Haar-Cascade liefert Kandidaten, HOG bestätigt im Ausschnitt um jeden Kandidaten"""
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        min_size = int(self.min_face)
+        candidates = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4,
+                                                   minSize=(min_size, min_size))
+        height, width = rgb.shape[:2]
+        locations = []
+        for x, y, w, h in candidates:
+            self.stats['cascade_candidates'] += 1
+            pad = w // 2
+            top, left = max(0, y - pad), max(0, x - pad)
+            bottom, right = min(height, y + h + pad), min(width, x + w + pad)
+            found = face_recognition.face_locations(rgb[top:bottom, left:right],
+                                                    number_of_times_to_upsample=self.upsample, model='hog')
+            if not found:
+                self.stats['cascade_rejected'] += 1
+            for t, r, b, l in found:
+                box = (t + top, r + left, b + top, l + left)
+                if all(box_iou(box, other) < 0.5 for other in locations):
+                    locations.append(box)
+        return locations
+    
+    def observe(self, frame_width, boxes):
+        """Frame-Breite und kleinste Gesichtshöhe (volle Auflösung) für die nächste Skala merken"""
+        self.frame_width = frame_width
+        if boxes:
+            self.face_height = min(bottom - top for top, _, bottom, _ in boxes)
+            self.face_age = 0
+        elif self.face_height:
+            self.face_age += 1
+            if self.face_age > self.face_memory:
+                self.face_height = None
+    
+    def record_scale(self, reduce):
+        self.stats['scales'][reduce] = self.stats['scales'].get(reduce, 0) + 1
+    
+    def get_stats(self):
+        return dict(self.stats, model=self.model, upsample=self.upsample, adaptive=self.adaptive,
+                    full_res_encode=self.full_res_encode, use_pi_boxes=self.use_pi_boxes,
+                    reduce=self.detect_reduce(), face_height=self.face_height)
+
+# Vergleichbare Policies (replay_face.py --policies)
+DETECTION_PRESETS = {
+    'fixed': {'adaptive': False, 'reduce': 2, 'full_res_encode': False},  # bisheriges Verhalten
+    'adaptive': {},
+    'fast': {'upsample': 0},
+    'cascade': {'model': 'cascade'},
+    'cnn': {'model': 'cnn', 'adaptive': False, 'reduce': 2},
+    'no_pi_boxes': {'use_pi_boxes': False}
+}
+
+def create_detection_policy(name, upsample=None):
+    """Policy aus Preset-Namen, unbekannte Namen fallen auf 'fixed' zurück"""
+    if name not in DETECTION_PRESETS:
+        print(f"⚠️ Unbekannte Detektions-Policy '{name}' - verwende 'fixed'")
+        name = 'fixed'
+    options = dict(DETECTION_PRESETS[name])
+    if upsample is not None:
+        options['upsample'] = int(upsample)
+    return DetectionPolicy(**options)
+
+detection_policy = create_detection_policy(DETECTION_POLICY, DETECTION_UPSAMPLE)
+
+def process_frame_fast(frame):
+    """
+    Optimierte Gesichtserkennung mit Bounding Boxes (frame: recognition_pipeline.Frame).
+    Detektion und Encoding nach detection_policy (Modell, Skala, Auflösung der Encodings).
+    Mit roi (Gesichtsausschnitt vom Pi) entfällt die Detektion: die Boxen
+    des Pi werden übernommen, encodiert wird in voller Auflösung, und die
+    Koordinaten werden per Offset auf den ganzen Frame zurückgerechnet.
+    Encodiert werden nur Gesichter, deren Spur noch nicht entschieden ist (IdentityLanes).
+    """
     try:
-        # Base64 zu Image
-        image_bytes = base64.b64decode(image_b64)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Frame für bessere Performance verkleinern
-        small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        # Gesichtserkennung
-        face_locations = face_recognition.face_locations(rgb_small_frame, model='hog')
+        stage_start = time.perf_counter()
+        roi = frame.roi
+        
+        if roi:
+            # Ausschnitt ist bereits klein -> volle Auflösung decodieren
+            crop = frame.bgr()
+            rgb_small_frame = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB,
+                                           dst=scratch_buffer('rgb_roi', crop.shape))
+            record_stage('decode', stage_start)
+            
+            if detection_policy.use_pi_boxes:
+                face_locations = roi_face_locations(roi, crop.shape)
+            else:
+                stage_start = time.perf_counter()
+                face_locations = detection_policy.locate(rgb_small_frame)
+                record_stage('detect', stage_start)
+            scale_factor = 1
+            offset_x, offset_y = int(roi['left']), int(roi['top'])
+        else:
+            # Der JPEG-Decoder skaliert direkt auf die Detektionsgröße, der volle Frame wird
+            # nur für Encodings angelegt (oder wenn eine andere Stufe ihn schon decodiert hat)
+            scale_factor = detection_policy.detect_reduce()
+            small_frame = frame.bgr(reduce=scale_factor)
+            
+            # RGB für face_recognition in wiederverwendeten Puffer
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB,
+                                           dst=scratch_buffer('rgb_small', small_frame.shape))
+            record_stage('decode', stage_start)
+            
+            # Gesichtserkennung
+            stage_start = time.perf_counter()
+            face_locations = detection_policy.locate(rgb_small_frame)
+            record_stage('detect', stage_start)
+            detection_policy.record_scale(scale_factor)
+            offset_x, offset_y = 0, 0
+        
+        # Boxen im ganzen Frame (skaliert, bei ROI mit Offset) den Spuren zuordnen
+        boxes = [(int(top * scale_factor) + offset_y, int(right * scale_factor) + offset_x,
+                  int(bottom * scale_factor) + offset_y, int(left * scale_factor) + offset_x)
+                 for top, right, bottom, left in face_locations]
+        lanes = identity_lanes.assign(boxes)
+        if not roi:
+            detection_policy.observe(small_frame.shape[1] * scale_factor, boxes)
         
         if not face_locations:
             result = {
@@ -538,21 +1210,37 @@ def process_frame_fast(image_b64):
                 'faces': []
             }
         else:
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+            # Entschiedene Spuren nicht erneut encodieren
+            pending = [i for i, lane in enumerate(lanes) if not lane['identity']]
+            identity_lanes.stats['encode_skipped'] += len(lanes) - len(pending)
+            face_encodings = {}
+            if pending and detection_policy.full_res_encode and scale_factor != 1:
+                # Encodings aus dem Frame in voller Auflösung (Boxen schon im ganzen Frame)
+                stage_start = time.perf_counter()
+                full_frame = frame.bgr()
+                rgb_full_frame = cv2.cvtColor(full_frame, cv2.COLOR_BGR2RGB,
+                                              dst=scratch_buffer('rgb_full', full_frame.shape))
+                record_stage('decode_full', stage_start)
+                
+                stage_start = time.perf_counter()
+                encodings = face_recognition.face_encodings(rgb_full_frame, [boxes[i] for i in pending])
+                face_encodings = dict(zip(pending, encodings))
+                detection_policy.stats['full_res_encodes'] += len(pending)
+                record_stage('encode', stage_start)
+            elif pending:
+                stage_start = time.perf_counter()
+                encodings = face_recognition.face_encodings(rgb_small_frame,
+                                                            [face_locations[i] for i in pending])
+                face_encodings = dict(zip(pending, encodings))
+                record_stage('encode', stage_start)
+            
+            stage_start = time.perf_counter()
             faces_data = []
             best_match = None
+            candidate = None
             
-            for i, face_encoding in enumerate(face_encodings):
-                face_location = face_locations[i]
-                
-                # Koordinaten zurück auf Original-Größe skalieren
-                top, right, bottom, left = face_location
-                scale_factor = 2.0
-                top = int(top * scale_factor)
-                right = int(right * scale_factor)
-                bottom = int(bottom * scale_factor)
-                left = int(left * scale_factor)
-                
+            for i, lane in enumerate(lanes):
+                top, right, bottom, left = lane['box']
                 face_info = {
                     'box': {
                         'left': left,
@@ -561,31 +1249,40 @@ def process_frame_fast(image_b64):
                         'bottom': bottom
                     },
                     'name': 'Unbekannt',
-                    'confidence': 0
+                    'confidence': 0,
+                    'lane': lane['id']
                 }
                 
-                if len(known_face_encodings) > 0:
-                    matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=0.45)
-                    
-                    if True in matches:
-                        face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                        best_match_index = np.argmin(face_distances)
+                if i in face_encodings:
+                    name, confidence = None, 0.0
+                    if len(known_face_encodings) > 0:
+                        face_encoding = face_encodings[i]
+                        matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=0.45)
                         
-                        if matches[best_match_index]:
-                            name = known_face_names[best_match_index]
-                            confidence = 1 - face_distances[best_match_index]
+                        if True in matches:
+                            face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
+                            best_match_index = np.argmin(face_distances)
                             
-                            face_info['name'] = name
-                            face_info['confidence'] = confidence
-                            
-                            # Bester Match für Haupt-Panel
-                            if not best_match or confidence > best_match['confidence']:
-                                best_match = {
-                                    'name': name,
-                                    'confidence': confidence
-                                }
+                            if matches[best_match_index]:
+                                name = known_face_names[best_match_index]
+                                confidence = 1 - face_distances[best_match_index]
+                    identity_lanes.observe(lane, name, confidence)
+                
+                # Angezeigt wird der über die Spur gemittelte Wert
+                if lane['candidate']:
+                    face_info['name'] = lane['identity'] or lane['candidate']
+                    face_info['confidence'] = float(lane['fused'])
+                face_info['decided'] = lane['identity'] is not None
+                
+                # Bester Match für Haupt-Panel (nur entschiedene Spuren)
+                if lane['identity']:
+                    if not best_match or lane['fused'] > best_match['confidence']:
+                        best_match = {'name': lane['identity'], 'confidence': float(lane['fused'])}
+                elif lane['candidate']:
+                    candidate = lane['candidate']
                 
                 faces_data.append(face_info)
+            record_stage('match', stage_start)
             
             # Ergebnis zusammenstellen
             if best_match:
@@ -600,7 +1297,7 @@ def process_frame_fast(image_b64):
             else:
                 result = {
                     'face_recognized': False,
-                    'user_name': 'Unbekannt',
+                    'user_name': 'Prüfe...' if candidate else 'Unbekannt',
                     'confidence': 0,
                     'timestamp': datetime.now().strftime("%H:%M:%S"),
                     'face_count': len(face_locations),
@@ -635,6 +1332,24 @@ def process_frame_fast(image_b64):
             'faces': []
         }
 
+class FaceRecognizer(Recognizer):
+    """Gesichtserkennung als Stufe der RecognitionPipeline"""
+    name = 'face'
+    
+    @property
+    def reduce(self):
+        """Detektionsauflösung laut detection_policy (mit roi: Ausschnitt in voller Auflösung)"""
+        return detection_policy.detect_reduce()
+
+    def process(self, frame):
+        return process_frame_fast(frame)
+
+    def get_stats(self):
+        return {'known_faces': len(known_face_names)}
+
+pipeline = RecognitionPipeline([FaceRecognizer()], on_result=on_face_result,
+                               admission=admission, slot=frame_slot, deadline=FRAME_DEADLINE)
+
 # Config API Endpoint
 @app.route('/config')
 def show_config():
@@ -663,7 +1378,7 @@ def show_config():
 @app.route('/api/detected_products')
 def get_detected_products():
     """Gibt alle erkannten Produkte zurück"""
-    data = load_detected_products()
+    data = cart.status()
     summary = get_current_cart_summary()
     
     result = {
@@ -681,7 +1396,7 @@ def clear_products():
     
     if success:
         # Clients informieren
-        socketio.emit('products_cleared', {
+        broadcast('products_cleared', {
             'message': 'Alle Produkte gelöscht',
             'products': [],
             'total_value': 0
@@ -702,7 +1417,7 @@ def pay_for_products():
         user_name = data.get('user_name', 'Guest')
         
         # Aktuelle Produkte laden
-        product_data = load_detected_products()
+        product_data = cart.status()
         products = product_data.get('products', [])
         
         if not products:
@@ -725,7 +1440,7 @@ def pay_for_products():
         
         if payment:
             # Payment-Erfolg an alle Clients senden
-            socketio.emit('payment_triggered', {
+            broadcast('payment_triggered', {
                 'user_name': user_name,
                 'amount': total_amount,
                 'payment_id': payment['id'],
@@ -764,7 +1479,7 @@ def pay_for_products():
 @app.route('/api/product_status')
 def get_product_status():
     """Gibt Status der Produkterkennung zurück"""
-    data = load_detected_products()
+    data = cart.status()
     summary = get_current_cart_summary()
     
     return jsonify({
@@ -776,6 +1491,7 @@ def get_product_status():
         'unique_products': summary['unique_products'],
         'last_updated': data.get('last_updated'),
         'status': data.get('status', 'unknown'),
+        'version': data.get('version', 0),
         'source_file': detected_products_file,
         'summary': summary
     })
@@ -1037,10 +1753,12 @@ def disable_user_payment(name):
 @app.route('/health')
 def health_check():
     """Server-Status für headless_capture.py"""
-    product_data = load_detected_products()
+    product_data = cart.status()
     
     return jsonify({
         'status': 'running',
+        'active': service_active,
+        'worker': WORKER_ID,
         'known_faces': len(known_face_names),
         'faces_loaded': known_face_names,
         'payment_enabled': True,
@@ -1051,6 +1769,52 @@ def health_check():
         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     })
 
+def set_active(active, url=None):
+    """Aktiv/Standby setzen; im Standby eigene Pis zum aktiven Dienst umleiten"""
+    global service_active, redirect_url
+    service_active = active
+    redirect_url = None if service_active else url
+    
+    if not service_active:
+        # Wartenden Frame verwerfen und verbundene Pis zum aktiven Dienst schicken
+        frame_slot.clear()
+        if redirect_url:
+            broadcast('redirect', {'url': redirect_url}, local=True)
+    
+    print(f"🔀 Gesichtserkennung {'AKTIV' if service_active else 'Standby'}"
+          f"{f' -> {redirect_url}' if redirect_url else ''}")
+
+def apply_shared_state(kind, data):
+    """Zustand eines anderen Workers übernehmen (Handler des ClusterBus)"""
+    global current_recognition, remote_viewers_until
+    if kind == 'recognition':
+        current_recognition = data
+    elif kind == 'viewers':
+        remote_viewers_until = time.time() + VIEWER_LEASE
+    elif kind == 'faces':
+        load_known_faces()
+        print(f"👥 Gesichter von anderem Worker aktualisiert: {known_face_names}")
+    elif kind == 'active':
+        set_active(data['active'], data.get('redirect_url'))
+
+def apply_shared_frame(jpeg_bytes, roi):
+    """Frame vom Pi an einem anderen Worker - nur für die Viewer, nicht zur Erkennung"""
+    viewer_stream.publish(jpeg_bytes, roi)
+    if frame_hook:
+        frame_hook()
+
+@app.route('/control/active', methods=['POST'])
+def control_active():
+    """Hot-Standby-Umschaltung durch mqtt_monitor.py (nur lokal erreichbar)"""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Nur lokal erlaubt'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    set_active(bool(data.get('active', True)), data.get('redirect_url'))
+    # Hinter nginx erreicht der Aufruf nur einen Worker - die anderen folgen über den Bus
+    share_state('active', {'active': service_active, 'redirect_url': redirect_url})
+    return jsonify({'active': service_active, 'redirect_url': redirect_url})
+
 @app.route('/add_face', methods=['POST'])
 def add_face():
     """Neues Gesicht hinzufügen"""
@@ -1084,6 +1848,7 @@ def add_face():
                 return jsonify({'error': 'No face detected in image'}), 400
             
             load_known_faces()
+            share_state('faces', {'names': known_face_names})
             
             return jsonify({
                 'success': True,
@@ -1125,6 +1890,7 @@ def delete_face(name):
         
         if deleted:
             load_known_faces()
+            share_state('faces', {'names': known_face_names})
             return jsonify({
                 'success': True,
                 'message': f'Face {name} deleted successfully',
@@ -1145,6 +1911,46 @@ def index():
 def payment_setup():
     return render_template('payment_setup.html', faces=known_face_names)
 
+def mjpeg_frames():
+    """multipart/x-mixed-replace-Generator: ein Viewer solange die Verbindung offen ist"""
+    viewers = viewer_stream.subscribe()
+    print(f"📺 MJPEG-Viewer verbunden ({viewers} aktiv)")
+    try:
+        seq = 0
+        last_jpeg = None
+        while processing_active:
+            keep_viewer_lease()
+            jpeg, seq = viewer_stream.wait_frame(seq, timeout=5.0)
+            if jpeg is None:
+                # Keep-Alive ohne neuen Frame (Pi pausiert): erst beim Schreiben merkt
+                # der Server, dass der Browser weg ist - sonst bliebe er angemeldet
+                # und hielte die Viewer-Lease am Leben
+                if last_jpeg is None:
+                    yield b'\r\n'
+                    continue
+                jpeg = last_jpeg
+            last_jpeg = jpeg
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                   str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+    finally:
+        viewers = viewer_stream.unsubscribe()
+        print(f"📺 MJPEG-Viewer getrennt ({viewers} aktiv)")
+
+@app.route('/video_stream')
+def video_stream():
+    """MJPEG-Live-Stream aus dem zuletzt empfangenen Frame (optional mit Gesichtsboxen)"""
+    return Response(mjpeg_frames(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/video_feed')
+def video_feed():
+    """Einzelnes JPEG des aktuellen Frames (Polling-Fallback)"""
+    keep_viewer_lease()
+    jpeg = viewer_stream.latest()
+    if jpeg is None:
+        return '', 204
+    return Response(jpeg, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/metrics')
 def get_metrics():
     """Live-Metriken für OpenHAB"""
@@ -1185,13 +1991,22 @@ def get_metrics():
         except Exception as e:
             print(f"MQTT Send-Fehler: {e}")
     
-    product_data = load_detected_products()
+    product_data = cart.status()
     
     return jsonify({
         'current_confidence': current_recognition.get('confidence', 0) * 100,
         'average_confidence': round(avg_confidence * 100, 1),
         'payments_today': payments_today,
-        'queue_size': len(processing_queue),
+        'queue_size': len(frame_slot),
+        'frames_dropped': frames_dropped,
+        'frames_expired': pipeline.frames_expired,
+        'admission': admission.get_stats(),
+        'viewer_stream': viewer_stream.get_stats(),
+        'pipeline': pipeline.get_stats(),
+        'identity': identity_lanes.get_stats(),
+        'detection': detection_policy.get_stats(),
+        'worker': WORKER_ID,
+        'cluster': cluster_bus.stats if cluster_bus else None,
         'face_recognized': current_recognition.get('face_recognized', False),
         'current_user': current_recognition.get('user_name', 'None'),
         'cart_items': product_data.get('product_count', 0),
@@ -1203,18 +2018,8 @@ def get_metrics():
 @socketio.on('connect')
 def handle_connect():
     print("Client verbunden")
-    emit('recognition_result', current_recognition)
-    
-    # Sende aktuellen Warenkorb-Status
-    product_data = load_detected_products()
-    if product_data['product_count'] > 0:
-        emit('cart_update', {
-            'products': current_detected_products,
-            'total_value': product_data['total_value'],
-            'product_count': product_data['product_count'],
-            'summary': get_current_cart_summary(),
-            'timestamp': datetime.now().strftime("%H:%M:%S")
-        })
+    reply('recognition_result', current_recognition)
+    # Warenkorb holt sich der Client per 'cart_sync' mit seiner letzten Version
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -1223,11 +2028,40 @@ def handle_disconnect():
 @socketio.on('video_frame')
 def handle_video_frame(data):
     """Empfängt Video-Frames und verarbeitet sie asynchron"""
+    # Im Standby keine Erkennung - der Pi wird zum aktiven Dienst umgeleitet
+    if not service_active:
+        if redirect_url:
+            reply('redirect', {'url': redirect_url})
+        return
+    
     if 'image' in data:
-        if len(processing_queue) < processing_queue.maxlen:
-            processing_queue.append(data['image'])
-        
-        emit('video_frame', {'image': data['image']}, broadcast=True)
+        # Einmal in JPEG-Bytes wandeln - Erkennung und MJPEG-Ausgabe teilen sie sich
+        image_bytes = frame_bytes(data['image'])
+        roi = data.get('roi')
+        enqueue_frame(image_bytes, roi, data.get('captured_at'))
+        
+        # Back-Pressure: Vorgaben nur an den sendenden Pi, höchstens einmal pro Sekunde
+        advice = admission.on_frame_received(len(image_bytes))
+        if advice:
+            reply('frame_ack', advice)
+        
+        # Dashboard holt Frames per /video_stream - kein Rebroadcast über Socket.IO
+        viewer_stream.publish(image_bytes, roi)
+        share_frame(image_bytes, roi)
+
+@socketio.on('start_video_stream')
+def handle_start_video_stream():
+    """Dashboard meldet sich als Viewer an und bekommt die MJPEG-Quelle"""
+    reply('video_stream_info', {
+        'url': '/video_stream',
+        'overlay': viewer_stream.overlay,
+        'viewers': viewer_stream.get_stats()['viewers']
+    })
+
+@socketio.on('stop_video_stream')
+def handle_stop_video_stream():
+    """Abmelden passiert durch Schließen der MJPEG-Verbindung - hier nur bestätigen"""
+    reply('video_stream_info', {'url': None, 'overlay': viewer_stream.overlay})
 
 @socketio.on('confirm_payment')
 def handle_payment_confirmation(data):
@@ -1244,7 +2078,7 @@ def handle_payment_confirmation(data):
         payment = create_payment_for_user(user_name, confidence, amount_cents)
         
         if payment:
-            socketio.emit('payment_triggered', {
+            broadcast('payment_triggered', {
                 'user_name': user_name,
                 'amount': payment['amount'] / 100,
                 'payment_id': payment['id'],
@@ -1254,7 +2088,7 @@ def handle_payment_confirmation(data):
             })
             print(f"Payment-Notification gesendet")
         else:
-            socketio.emit('payment_triggered', {
+            broadcast('payment_triggered', {
                 'user_name': user_name,
                 'status': 'failed',
                 'message': 'Payment nicht konfiguriert',
@@ -1264,7 +2098,7 @@ def handle_payment_confirmation(data):
     except Exception as e:
         print(f"Payment confirmation error: {e}")
         send_payment_result_to_esp(False, data.get('user_name', 'Unknown'))
-        socketio.emit('payment_triggered', {
+        broadcast('payment_triggered', {
            'user_name': data.get('user_name', 'Unknown'),
            'status': 'failed',
            'message': str(e)
@@ -1277,11 +2111,11 @@ def handle_pay_for_products_socket(data):
         user_name = data.get('user_name', 'Guest')
         
         # Aktuelle Produkte laden
-        product_data = load_detected_products()
+        product_data = cart.status()
         products = product_data.get('products', [])
         
         if not products:
-            emit('payment_result', {
+            reply('payment_result', {
                 'success': False,
                 'message': 'Keine Produkte zum Bezahlen'
             })
@@ -1295,7 +2129,7 @@ def handle_pay_for_products_socket(data):
         
         if payment:
             # Payment-Notification an alle senden
-            socketio.emit('payment_triggered', {
+            broadcast('payment_triggered', {
                 'user_name': user_name,
                 'amount': total_amount,
                 'payment_id': payment['id'],
@@ -1309,32 +2143,38 @@ def handle_pay_for_products_socket(data):
             # Produkte löschen
             clear_detected_products()
             
-            emit('payment_result', {
+            reply('payment_result', {
                 'success': True,
                 'payment_id': payment['id'],
                 'amount': total_amount,
                 'message': 'Product Payment erfolgreich'
             })
         else:
-            emit('payment_result', {
+            reply('payment_result', {
                 'success': False,
                 'message': 'Payment konnte nicht erstellt werden'
             })
             
     except Exception as e:
         print(f"Socket Product Payment Fehler: {e}")
-        emit('payment_result', {
+        reply('payment_result', {
             'success': False,
             'message': str(e)
         })
 
+@socketio.on('cart_sync')
+def handle_cart_sync(data=None):
+    """Client meldet seine Warenkorb-Version und bekommt fehlende Deltas oder einen Snapshot"""
+    since_version = (data or {}).get('version')
+    reply('cart_sync', cart.sync(since_version))
+
 @socketio.on('request_product_status')
 def handle_request_product_status():
     """Client fordert aktuellen Warenkorb-Status an"""
-    product_data = load_detected_products()
+    product_data = cart.status()
     summary = get_current_cart_summary()
     
-    emit('product_status', {
+    reply('product_status', {
         'products': current_detected_products,
         'total_value': product_data['total_value'],
         'product_count': product_data['product_count'],
@@ -1348,38 +2188,50 @@ def handle_clear_products_socket():
     success = clear_detected_products()
     
     if success:
-        socketio.emit('products_cleared', {
+        broadcast('products_cleared', {
             'message': 'Warenkorb geleert',
             'products': [],
             'total_value': 0
-        }, broadcast=True)
+        })
         
-        emit('clear_result', {'success': True})
+        reply('clear_result', {'success': True})
     else:
-        emit('clear_result', {'success': False, 'message': 'Fehler beim Leeren'})
+        reply('clear_result', {'success': False, 'message': 'Fehler beim Leeren'})
 
-if __name__ == '__main__':
+def init_server():
+    """Datenbank, Gesichter und Warenkorb laden, Hintergrund-Threads starten
+    (gemeinsam für den Standardbetrieb und async_server.py)"""
     print("Starte Face Recognition Payment Server...")
     init_database()
     load_known_faces()
     print(f"{len(known_face_names)} Gesichter geladen: {known_face_names}")
     
     # Product Integration initialisieren
-    product_status = load_detected_products()
+    product_status = cart.status()
     print(f"Product Integration: {product_status.get('product_count', 0)} Produkte geladen")
     print(f"Warenkorb-Gesamtwert: {product_status.get('total_value', 0):.2f}€")
     
     # Background-Processor starten
     processor_thread = threading.Thread(target=background_processor, daemon=True)
     processor_thread.start()
+    
+    # Warenkorb-Deltas an alle Dashboards pushen (ersetzt Polling der Clients).
+    # Mit product_source (combined_server.py) meldet die Produktstufe Änderungen selbst.
+    if product_source is None:
+        cart_thread = threading.Thread(target=cart_watcher, daemon=True)
+        cart_thread.start()
 
-    # MQTT Client initialisieren
-    mqtt_thread = threading.Thread(target=mqtt_confidence_sender, daemon=True)
-    mqtt_thread.start()
+    # MQTT Client initialisieren (im Mehrprozess-Betrieb nur Worker 0, sonst doppelte Werte)
+    if WORKER_ID == 0:
+        mqtt_thread = threading.Thread(target=mqtt_confidence_sender, daemon=True)
+        mqtt_thread.start()
+
+if __name__ == '__main__':
+    init_server()
     
     print(f"\nPayment-System aktiviert")
     print(f"Stripe-Modus: {'Test' if stripe.api_key.startswith('sk_test_') else 'Demo/Live'}")
-    print("Server läuft auf http://0.0.0.0:5000")
+    print(f"Server läuft auf http://0.0.0.0:{SERVER_PORT} ({'aktiv' if service_active else 'Standby'})")
     print("\nAPI Endpoints:")
     print("  GET  /config                        - System-Konfiguration")
     print("  GET  /health                        - Server-Status")
@@ -1394,12 +2246,16 @@ if __name__ == '__main__':
     print("  GET  /payment/users                 - Alle Payment-User")
     print("  POST /payment/disable/<name>        - Payment deaktivieren")
     print("  GET  /payment-setup                 - Payment Setup UI")
+    print("  GET  /video_stream                  - MJPEG-Live-Stream (Viewer)")
+    print("  GET  /video_feed                    - Aktueller Frame als JPEG")
     print("  GET  /metrics                       - Live-Metriken für OpenHAB")
+    print("  POST /control/active                - Hot-Standby umschalten (lokal)")
     print("\nWARENKORB API Endpoints:")
     print("  GET  /api/detected_products         - Erkannte Produkte anzeigen")
     print("  POST /api/clear_products            - Alle Produkte löschen")
     print("  POST /api/pay_for_products          - Für alle Produkte bezahlen")
     print("  GET  /api/product_status            - Produktstatus abfragen")
+    print("\n🛒 Warenkorb-Push: Socket.IO 'cart_delta' (versioniert), Resync per 'cart_sync'")
     print(f"\n💾 Produktdatei: '{detected_products_file}'")
     print("🔗 Verbindung zu Product Recognition System aktiv")
     print("🛒 ALLE PRODUKTE werden geladen (keine Zeitstempel-Filterung)")
@@ -1410,6 +2266,6 @@ if __name__ == '__main__':
     print(f"  Status: {'✅ Verbunden' if mqtt_client else '❌ Fehler'}")
     
     try:
-        socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
+        socketio.run(app, host='0.0.0.0', port=SERVER_PORT, debug=False, allow_unsafe_werkzeug=True)
     finally:
-        processing_active = False
+        stop_processing()